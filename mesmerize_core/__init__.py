@@ -3,8 +3,13 @@ from .batch_utils import (
     get_parent_raw_data_path,
     load_batch,
     create_batch,
+    migrate_batch,
+    set_path_cache_ttl,
+    clear_path_cache,
 )
 from .caiman_extensions import *
+from .caiman_extensions.slurm import set_slurm_commands, SlurmCommands, LocalSlurmCommands
+from .caiman_extensions.worker import start_worker, stop_worker, get_worker
 from pathlib import Path
 
 
@@ -16,6 +21,15 @@ __all__ = [
     "get_parent_raw_data_path",
     "load_batch",
     "create_batch",
+    "migrate_batch",
+    "set_path_cache_ttl",
+    "clear_path_cache",
+    "set_slurm_commands",
+    "SlurmCommands",
+    "LocalSlurmCommands",
+    "start_worker",
+    "stop_worker",
+    "get_worker",
     "CaimanDataFrameExtensions",
     "CaimanSeriesExtensions",
     "CNMFExtensions",
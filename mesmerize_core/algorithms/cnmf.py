@@ -16,18 +16,23 @@ from datetime import datetime
 # prevent circular import
 if __name__ in ["__main__", "__mp_main__"]:  # when running in subprocess
     from mesmerize_core import set_parent_raw_data_path, load_batch
-    from mesmerize_core.utils import IS_WINDOWS
+    from mesmerize_core.batch_storage import write_item_results
+    from mesmerize_core.utils import IS_WINDOWS, StageMetrics
 else:  # when running with local backend
     from ..batch_utils import set_parent_raw_data_path, load_batch
-    from ..utils import IS_WINDOWS
+    from ..batch_storage import write_item_results
+    from ..utils import IS_WINDOWS, StageMetrics
 
 
-def run_algo(batch_path, uuid, data_path: str = None):
+def run_algo(batch_path, uuid, data_path: str = None, dview=None, n_processes: int = None):
     algo_start = time.time()
+    metrics = StageMetrics()
     set_parent_raw_data_path(data_path)
 
-    df = load_batch(batch_path)
-    item = df[df["uuid"] == uuid].squeeze()
+    with metrics.stage("load_batch"):
+        # only read, the results are written with write_item_results()
+        df = load_batch(batch_path, track_changes=False)
+    item = df.caiman.uloc(uuid)
 
     input_movie_path = item["input_movie_path"]
     # resolve full path
@@ -44,68 +49,82 @@ def run_algo(batch_path, uuid, data_path: str = None):
     )
 
     # adapted from current demo notebook
-    if "MESMERIZE_N_PROCESSES" in os.environ.keys():
-        try:
-            n_processes = int(os.environ["MESMERIZE_N_PROCESSES"])
-        except:
+    if n_processes is None:
+        if "MESMERIZE_N_PROCESSES" in os.environ.keys():
+            try:
+                n_processes = int(os.environ["MESMERIZE_N_PROCESSES"])
+            except:
+                n_processes = psutil.cpu_count() - 1
+        else:
             n_processes = psutil.cpu_count() - 1
-    else:
-        n_processes = psutil.cpu_count() - 1
     # Start cluster for parallel processing
-    c, dview, n_processes = cm.cluster.setup_cluster(
-        backend="local", n_processes=n_processes, single_thread=False
-    )
+    # a warm pool is passed in by the worker service, it is not stopped here
+    stop_dview = dview is None
+    if dview is None:
+        with metrics.stage("setup_cluster"):
+            c, dview, n_processes = cm.cluster.setup_cluster(
+                backend="local", n_processes=n_processes, single_thread=False
+            )
 
     # merge cnmf and eval kwargs into one dict
     cnmf_params = CNMFParams(params_dict=params["main"])
     # Run CNMF, denote boolean 'success' if CNMF completes w/out error
     try:
-        fname_new = cm.save_memmap(
-            [input_movie_path], base_name=f"{uuid}_cnmf-memmap_", order="C", dview=dview
-        )
+        with metrics.stage("memmap"):
+            fname_new = cm.save_memmap(
+                [input_movie_path], base_name=f"{uuid}_cnmf-memmap_", order="C", dview=dview
+            )
 
-        print("making memmap")
+            print("making memmap")
 
-        Yr, dims, T = cm.load_memmap(fname_new)
-        images = np.reshape(Yr.T, [T] + list(dims), order="F")
+            Yr, dims, T = cm.load_memmap(fname_new)
+            images = np.reshape(Yr.T, [T] + list(dims), order="F")
 
-        proj_paths = dict()
-        for proj_type in ["mean", "std", "max"]:
-            p_img = getattr(np, f"nan{proj_type}")(images, axis=0)
-            proj_paths[proj_type] = output_dir.joinpath(
-                f"{uuid}_{proj_type}_projection.npy"
-            )
-            np.save(str(proj_paths[proj_type]), p_img)
+        with metrics.stage("projections"):
+            proj_paths = dict()
+            for proj_type in ["mean", "std", "max"]:
+                p_img = getattr(np, f"nan{proj_type}")(images, axis=0)
+                proj_paths[proj_type] = output_dir.joinpath(
+                    f"{uuid}_{proj_type}_projection.npy"
+                )
+                np.save(str(proj_paths[proj_type]), p_img)
 
         # in fname new load in memmap order C
-        cm.stop_server(dview=dview)
-        c, dview, n_processes = cm.cluster.setup_cluster(
-            backend="local", n_processes=None, single_thread=False
-        )
+        if stop_dview:
+            with metrics.stage("setup_cluster"):
+                cm.stop_server(dview=dview)
+                c, dview, n_processes = cm.cluster.setup_cluster(
+                    backend="local", n_processes=n_processes, single_thread=False
+                )
 
         print("performing CNMF")
         cnm = cnmf.CNMF(n_processes, params=cnmf_params, dview=dview)
 
         print("fitting images")
-        cnm = cnm.fit(images)
+        with metrics.stage("fit"):
+            cnm = cnm.fit(images)
         #
         if "refit" in params.keys():
             if params["refit"] is True:
                 print("refitting")
-                cnm = cnm.refit(images, dview=dview)
+                with metrics.stage("refit"):
+                    cnm = cnm.refit(images, dview=dview)
 
         print("performing eval")
-        cnm.estimates.evaluate_components(images, cnm.params, dview=dview)
+        with metrics.stage("evaluate_components"):
+            cnm.estimates.evaluate_components(images, cnm.params, dview=dview)
 
-        output_path = output_dir.joinpath(f"{uuid}.hdf5").resolve()
+        with metrics.stage("save"):
+            output_path = output_dir.joinpath(f"{uuid}.hdf5").resolve()
 
-        cnm.save(str(output_path))
+            cnm.save(str(output_path))
 
-        Cn = cm.local_correlations(images.transpose(1, 2, 0))
-        Cn[np.isnan(Cn)] = 0
+        with metrics.stage("correlation_image"):
+            Cn = cm.local_correlations(images.transpose(1, 2, 0))
+            Cn[np.isnan(Cn)] = 0
 
-        corr_img_path = output_dir.joinpath(f"{uuid}_cn.npy").resolve()
-        np.save(str(corr_img_path), Cn, allow_pickle=False)
+            corr_img_path = output_dir.joinpath(f"{uuid}_cn.npy").resolve()
+            np.save(str(corr_img_path), Cn, allow_pickle=False)
 
         # output dict for dataframe row (pd.Series)
         d = dict()
@@ -136,15 +155,19 @@ def run_algo(batch_path, uuid, data_path: str = None):
     except:
         d = {"success": False, "traceback": traceback.format_exc()}
 
-    cm.stop_server(dview=dview)
+    if stop_dview:
+        cm.stop_server(dview=dview)
 
-    # Add dictionary to output column of series
-    df.loc[df["uuid"] == uuid, "outputs"] = [d]
-    # Add ran timestamp to ran_time column of series
-    df.loc[df["uuid"] == uuid, "ran_time"] = datetime.now().isoformat(timespec="seconds", sep="T")
-    df.loc[df["uuid"] == uuid, "algo_duration"] = str(round(time.time() - algo_start, 2)) + " sec"
-    # save dataframe to disc
-    df.to_pickle(batch_path)
+    d["stage_metrics"] = metrics.to_dict()
+
+    # store the results for this item only, the batch file is not rewritten
+    write_item_results(
+        batch_path,
+        uuid,
+        outputs=d,
+        ran_time=datetime.now().isoformat(timespec="seconds", sep="T"),
+        algo_duration=str(round(time.time() - algo_start, 2)) + " sec",
+    )
 
 
 @click.command()
@@ -13,18 +13,23 @@ from datetime import datetime
 
 if __name__ in ["__main__", "__mp_main__"]:  # when running in subprocess
     from mesmerize_core import set_parent_raw_data_path, load_batch
-    from mesmerize_core.utils import IS_WINDOWS
+    from mesmerize_core.batch_storage import write_item_results
+    from mesmerize_core.utils import IS_WINDOWS, StageMetrics
 else:  # when running with local backend
     from ..batch_utils import set_parent_raw_data_path, load_batch
-    from ..utils import IS_WINDOWS
+    from ..batch_storage import write_item_results
+    from ..utils import IS_WINDOWS, StageMetrics
 
 
-def run_algo(batch_path, uuid, data_path: str = None):
+def run_algo(batch_path, uuid, data_path: str = None, dview=None, n_processes: int = None):
     algo_start = time.time()
+    metrics = StageMetrics()
     set_parent_raw_data_path(data_path)
 
-    df = load_batch(batch_path)
-    item = df[df["uuid"] == uuid].squeeze()
+    with metrics.stage("load_batch"):
+        # only read, the results are written with write_item_results()
+        df = load_batch(batch_path, track_changes=False)
+    item = df.caiman.uloc(uuid)
 
     input_movie_path = item["input_movie_path"]
     # resolve full path
@@ -37,36 +42,43 @@ def run_algo(batch_path, uuid, data_path: str = None):
     print("cnmfe params:", params)
 
     # adapted from current demo notebook
-    if "MESMERIZE_N_PROCESSES" in os.environ.keys():
-        try:
-            n_processes = int(os.environ["MESMERIZE_N_PROCESSES"])
-        except:
+    if n_processes is None:
+        if "MESMERIZE_N_PROCESSES" in os.environ.keys():
+            try:
+                n_processes = int(os.environ["MESMERIZE_N_PROCESSES"])
+            except:
+                n_processes = psutil.cpu_count() - 1
+        else:
             n_processes = psutil.cpu_count() - 1
-    else:
-        n_processes = psutil.cpu_count() - 1
     # Start cluster for parallel processing
-    c, dview, n_processes = cm.cluster.setup_cluster(
-        backend="local", n_processes=n_processes, single_thread=False
-    )
+    # a warm pool is passed in by the worker service, it is not stopped here
+    stop_dview = dview is None
+    if dview is None:
+        with metrics.stage("setup_cluster"):
+            c, dview, n_processes = cm.cluster.setup_cluster(
+                backend="local", n_processes=n_processes, single_thread=False
+            )
 
     try:
-        fname_new = cm.save_memmap(
-            [input_movie_path], base_name=f"{uuid}_cnmf-memmap_", order="C", dview=dview
-        )
-
-        print("making memmap")
-        Yr, dims, T = cm.load_memmap(fname_new)
-        images = np.reshape(Yr.T, [T] + list(dims), order="F")
-
-        # TODO: if projections already exist from mcorr we don't
-        #  need to waste compute time re-computing them here
-        proj_paths = dict()
-        for proj_type in ["mean", "std", "max"]:
-            p_img = getattr(np, f"nan{proj_type}")(images, axis=0)
-            proj_paths[proj_type] = output_dir.joinpath(
-                f"{uuid}_{proj_type}_projection.npy"
+        with metrics.stage("memmap"):
+            fname_new = cm.save_memmap(
+                [input_movie_path], base_name=f"{uuid}_cnmf-memmap_", order="C", dview=dview
             )
-            np.save(str(proj_paths[proj_type]), p_img)
+
+            print("making memmap")
+            Yr, dims, T = cm.load_memmap(fname_new)
+            images = np.reshape(Yr.T, [T] + list(dims), order="F")
+
+        with metrics.stage("projections"):
+            # TODO: if projections already exist from mcorr we don't
+            #  need to waste compute time re-computing them here
+            proj_paths = dict()
+            for proj_type in ["mean", "std", "max"]:
+                p_img = getattr(np, f"nan{proj_type}")(images, axis=0)
+                proj_paths[proj_type] = output_dir.joinpath(
+                    f"{uuid}_{proj_type}_projection.npy"
+                )
+                np.save(str(proj_paths[proj_type]), p_img)
 
         d = dict()  # for output
 
@@ -86,12 +98,15 @@ def run_algo(batch_path, uuid, data_path: str = None):
             n_processes=n_processes, dview=dview, params=cnmfe_params_dict
         )
         print("Performing CNMFE")
-        cnm = cnm.fit(images)
+        with metrics.stage("fit"):
+            cnm = cnm.fit(images)
         print("evaluating components")
-        cnm.estimates.evaluate_components(images, cnm.params, dview=dview)
+        with metrics.stage("evaluate_components"):
+            cnm.estimates.evaluate_components(images, cnm.params, dview=dview)
 
-        cnmf_hdf5_path = output_dir.joinpath(f"{uuid}.hdf5").resolve()
-        cnm.save(str(cnmf_hdf5_path))
+        with metrics.stage("save"):
+            cnmf_hdf5_path = output_dir.joinpath(f"{uuid}.hdf5").resolve()
+            cnm.save(str(cnmf_hdf5_path))
 
         # save output paths to outputs dict
         d["cnmf-hdf5-path"] = cnmf_hdf5_path.relative_to(output_dir.parent)
@@ -119,15 +134,19 @@ def run_algo(batch_path, uuid, data_path: str = None):
     except:
         d = {"success": False, "traceback": traceback.format_exc()}
 
-    cm.stop_server(dview=dview)
+    if stop_dview:
+        cm.stop_server(dview=dview)
+
+    d["stage_metrics"] = metrics.to_dict()
 
-    # Add dictionary to output column of series
-    df.loc[df["uuid"] == uuid, "outputs"] = [d]
-    # Add ran timestamp to ran_time column of series
-    df.loc[df["uuid"] == uuid, "ran_time"] = datetime.now().isoformat(timespec="seconds", sep="T")
-    df.loc[df["uuid"] == uuid, "algo_duration"] = str(round(time.time() - algo_start, 2)) + " sec"
-    # save dataframe to disc
-    df.to_pickle(batch_path)
+    # store the results for this item only, the batch file is not rewritten
+    write_item_results(
+        batch_path,
+        uuid,
+        outputs=d,
+        ran_time=datetime.now().isoformat(timespec="seconds", sep="T"),
+        algo_duration=str(round(time.time() - algo_start, 2)) + " sec",
+    )
 
 
 @click.command()
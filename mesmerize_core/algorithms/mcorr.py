@@ -17,18 +17,25 @@ from datetime import datetime
 # prevent circular import
 if __name__ in ["__main__", "__mp_main__"]:  # when running in subprocess
     from mesmerize_core import set_parent_raw_data_path, load_batch
+    from mesmerize_core.batch_storage import write_item_results
+    from mesmerize_core.utils import StageMetrics
 else:  # when running with local backend
     from ..batch_utils import set_parent_raw_data_path, load_batch
+    from ..batch_storage import write_item_results
+    from ..utils import StageMetrics
 
 
-def run_algo(batch_path, uuid, data_path: str = None):
+def run_algo(batch_path, uuid, data_path: str = None, dview=None, n_processes: int = None):
     algo_start = time.time()
+    metrics = StageMetrics()
     set_parent_raw_data_path(data_path)
 
     batch_path = Path(batch_path)
-    df = load_batch(batch_path)
+    with metrics.stage("load_batch"):
+        # only read, the results are written with write_item_results()
+        df = load_batch(batch_path, track_changes=False)
 
-    item = df[df["uuid"] == uuid].squeeze()
+    item = df.caiman.uloc(uuid)
     # resolve full path
     input_movie_path = str(df.paths.resolve(item["input_movie_path"]))
 
@@ -43,19 +50,24 @@ def run_algo(batch_path, uuid, data_path: str = None):
     params = item["params"]
 
     # adapted from current demo notebook
-    if "MESMERIZE_N_PROCESSES" in os.environ.keys():
-        try:
-            n_processes = int(os.environ["MESMERIZE_N_PROCESSES"])
-        except:
+    if n_processes is None:
+        if "MESMERIZE_N_PROCESSES" in os.environ.keys():
+            try:
+                n_processes = int(os.environ["MESMERIZE_N_PROCESSES"])
+            except:
+                n_processes = psutil.cpu_count() - 1
+        else:
             n_processes = psutil.cpu_count() - 1
-    else:
-        n_processes = psutil.cpu_count() - 1
 
     print("starting mc")
     # Start cluster for parallel processing
-    c, dview, n_processes = cm.cluster.setup_cluster(
-        backend="local", n_processes=n_processes, single_thread=False
-    )
+    # a warm pool is passed in by the worker service, it is not stopped here
+    stop_dview = dview is None
+    if dview is None:
+        with metrics.stage("setup_cluster"):
+            c, dview, n_processes = cm.cluster.setup_cluster(
+                backend="local", n_processes=n_processes, single_thread=False
+            )
 
     rel_params = dict(params["main"])
     opts = CNMFParams(params_dict=rel_params)
@@ -63,48 +75,51 @@ def run_algo(batch_path, uuid, data_path: str = None):
     try:
         # Run MC
         fnames = [input_movie_path]
-        mc = MotionCorrect(fnames, dview=dview, **opts.get_group("motion"))
-        mc.motion_correct(save_movie=True)
+        with metrics.stage("motion_correction"):
+            mc = MotionCorrect(fnames, dview=dview, **opts.get_group("motion"))
+            mc.motion_correct(save_movie=True)
 
-        # find path to mmap file
-        memmap_output_path_temp = df.paths.resolve(mc.mmap_file[0])
+            # find path to mmap file
+            memmap_output_path_temp = df.paths.resolve(mc.mmap_file[0])
 
-        # filename to move the output back to data dir
-        mcorr_memmap_path = output_dir.joinpath(
-            f"{uuid}-{memmap_output_path_temp.name}"
-        )
+            # filename to move the output back to data dir
+            mcorr_memmap_path = output_dir.joinpath(
+                f"{uuid}-{memmap_output_path_temp.name}"
+            )
 
-        # move the output file
-        move_file(memmap_output_path_temp, mcorr_memmap_path)
+            # move the output file
+            move_file(memmap_output_path_temp, mcorr_memmap_path)
 
         print("mc finished successfully!")
 
         print("computing projections")
-        Yr, dims, T = cm.load_memmap(str(mcorr_memmap_path))
-        images = np.reshape(Yr.T, [T] + list(dims), order="F")
-
-        proj_paths = dict()
-        for proj_type in ["mean", "std", "max"]:
-            p_img = getattr(np, f"nan{proj_type}")(images, axis=0)
-            proj_paths[proj_type] = output_dir.joinpath(
-                f"{uuid}_{proj_type}_projection.npy"
-            )
-            np.save(str(proj_paths[proj_type]), p_img)
+        with metrics.stage("projections"):
+            Yr, dims, T = cm.load_memmap(str(mcorr_memmap_path))
+            images = np.reshape(Yr.T, [T] + list(dims), order="F")
+
+            proj_paths = dict()
+            for proj_type in ["mean", "std", "max"]:
+                p_img = getattr(np, f"nan{proj_type}")(images, axis=0)
+                proj_paths[proj_type] = output_dir.joinpath(
+                    f"{uuid}_{proj_type}_projection.npy"
+                )
+                np.save(str(proj_paths[proj_type]), p_img)
 
         print("Computing correlation image")
-        Cns = local_correlations_movie_offline(
-            [str(mcorr_memmap_path)],
-            remove_baseline=True,
-            window=1000,
-            stride=1000,
-            winSize_baseline=100,
-            quantil_min_baseline=10,
-            dview=dview,
-        )
-        Cn = Cns.max(axis=0)
-        Cn[np.isnan(Cn)] = 0
-        cn_path = output_dir.joinpath(f"{uuid}_cn.npy")
-        np.save(str(cn_path), Cn, allow_pickle=False)
+        with metrics.stage("correlation_image"):
+            Cns = local_correlations_movie_offline(
+                [str(mcorr_memmap_path)],
+                remove_baseline=True,
+                window=1000,
+                stride=1000,
+                winSize_baseline=100,
+                quantil_min_baseline=10,
+                dview=dview,
+            )
+            Cn = Cns.max(axis=0)
+            Cn[np.isnan(Cn)] = 0
+            cn_path = output_dir.joinpath(f"{uuid}_cn.npy")
+            np.save(str(cn_path), Cn, allow_pickle=False)
 
         # output dict for pandas series for dataframe row
         d = dict()
@@ -112,16 +127,17 @@ def run_algo(batch_path, uuid, data_path: str = None):
         print("finished computing correlation image")
 
         # Compute shifts
-        if params["main"]["pw_rigid"] == True:
-            x_shifts = mc.x_shifts_els
-            y_shifts = mc.y_shifts_els
-            shifts = [x_shifts, y_shifts]
-            shift_path = output_dir.joinpath(f"{uuid}_shifts.npy")
-            np.save(str(shift_path), shifts)
-        else:
-            shifts = mc.shifts_rig
-            shift_path = output_dir.joinpath(f"{uuid}_shifts.npy")
-            np.save(str(shift_path), shifts)
+        with metrics.stage("shifts"):
+            if params["main"]["pw_rigid"] == True:
+                x_shifts = mc.x_shifts_els
+                y_shifts = mc.y_shifts_els
+                shifts = [x_shifts, y_shifts]
+                shift_path = output_dir.joinpath(f"{uuid}_shifts.npy")
+                np.save(str(shift_path), shifts)
+            else:
+                shifts = mc.shifts_rig
+                shift_path = output_dir.joinpath(f"{uuid}_shifts.npy")
+                np.save(str(shift_path), shifts)
 
         # relative paths
         cn_path = cn_path.relative_to(output_dir.parent)
@@ -146,15 +162,19 @@ def run_algo(batch_path, uuid, data_path: str = None):
         d = {"success": False, "traceback": traceback.format_exc()}
         print("mc failed, stored traceback in output")
 
-    cm.stop_server(dview=dview)
+    if stop_dview:
+        cm.stop_server(dview=dview)
 
-    # Add dictionary to output column of series
-    df.loc[df["uuid"] == uuid, "outputs"] = [d]
-    # Add ran timestamp to ran_time column of series
-    df.loc[df["uuid"] == uuid, "ran_time"] = datetime.now().isoformat(timespec="seconds", sep="T")
-    df.loc[df["uuid"] == uuid, "algo_duration"] = str(round(time.time() - algo_start, 2)) + " sec"
-    # Save DataFrame to disk
-    df.to_pickle(batch_path)
+    d["stage_metrics"] = metrics.to_dict()
+
+    # store the results for this item only, the batch file is not rewritten
+    write_item_results(
+        batch_path,
+        uuid,
+        outputs=d,
+        ran_time=datetime.now().isoformat(timespec="seconds", sep="T"),
+        algo_duration=str(round(time.time() - algo_start, 2)) + " sec",
+    )
 
 
 @click.command()
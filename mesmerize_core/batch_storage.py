@@ -0,0 +1,1084 @@
+"""
+Storage engines for the batch DataFrame.
+
+The engine is chosen from the file extension of the batch path:
+
+    | ``.pickle`` (or any other extension): the whole DataFrame is written to a single pickle file on every change
+    | ``.db``, ``.sqlite``, ``.sqlite3``: every batch item is a row in an SQLite database and only the rows that
+      change are written
+
+All writes to a batch file are done while holding an advisory lock on ``<batch_path>.lock``. The lock file also holds
+a version counter that is incremented on every write. ``load_batch()`` stores the version and a digest of every cell in
+``df.attrs``, so that ``save_to_disk()`` can detect that the DataFrame is stale and merge its changes with the
+changes on disk instead of overwriting them.
+"""
+
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import warnings
+from contextlib import contextmanager
+from pathlib import Path
+from typing import *
+from uuid import UUID
+from collections.abc import MutableMapping, Mapping
+
+import pandas as pd
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+
+SQLITE_EXTENSIONS = [".db", ".sqlite", ".sqlite3"]
+
+# columns of the sqlite table that are not columns of the DataFrame
+_SQLITE_INTERNAL_COLUMNS = ["_row", "_success"]
+
+#: columns whose large cells are not read until they are accessed when a batch is loaded with ``lazy=True``
+LAZY_COLUMNS = ["params", "outputs"]
+# cells smaller than this many bytes, such as ``None``, are always read
+_LAZY_MIN_SIZE = 128
+
+VERSION_ATTR = "batch_version"
+_DIGESTS_ATTR = "_row_digests"
+# uuid -> row position, see ``_get_uuid_position()``
+UUID_INDEX_ATTR = "_uuid_index"
+# see ``caiman_extensions._dependencies``
+DEPENDENCY_GRAPH_ATTR = "_dependency_graph"
+
+# attrs that are only meaningful in memory, they are not written to pickle batch files
+_PRIVATE_ATTRS = [VERSION_ATTR, _DIGESTS_ATTR, UUID_INDEX_ATTR, DEPENDENCY_GRAPH_ATTR]
+
+# the version is stored as a fixed width number at the start of the lock file, so that it is always
+# written with a single small write and can be read without holding the lock
+_VERSION_WIDTH = 20
+# the byte that is locked on Windows, after the version so that reading the version is never blocked
+_LOCK_OFFSET = 32
+
+
+class BatchLock:
+    """
+    Advisory lock on a batch file that works across processes, threads, and on most shared filesystems.
+    Reentrant within a thread, use ``batch_lock()`` to get the lock for a batch file.
+
+    .. code-block:: python
+
+        with batch_lock(batch_path) as lock:
+            # only one process can be in here at a time
+            lock.version
+    """
+
+    def __init__(self, path: Union[str, Path], timeout: float = 60):
+        self.path = Path(path)
+        #: max seconds to wait for the lock before raising ``TimeoutError``
+        self.timeout = timeout
+
+        # lockf/msvcrt locks are per process, this keeps out other threads of this process
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self):
+        if not self._thread_lock.acquire(timeout=self.timeout):
+            raise TimeoutError(f"Could not acquire lock on batch file: {self.path}")
+
+        self._depth += 1
+        if self._depth > 1:
+            return
+
+        try:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0))
+            self._lock_file()
+        except BaseException:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            self._depth -= 1
+            self._thread_lock.release()
+            raise
+
+    def _lock_file(self):
+        fd = self._fd
+        deadline = time.monotonic() + self.timeout
+        wait = 0.001
+        while True:
+            try:
+                if os.name == "nt":
+                    os.lseek(fd, _LOCK_OFFSET, os.SEEK_SET)
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                else:
+                    # flock and not lockf, lockf locks are released when any fd of the file is closed by the process
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Could not acquire lock on batch file: {self.path}")
+                time.sleep(wait)
+                # back off so that dozens of waiting workers don't hammer a shared filesystem
+                wait = min(wait * 2, 0.1)
+
+    def release(self):
+        if self._depth == 0:
+            raise RuntimeError("lock is not held")
+
+        self._depth -= 1
+        if self._depth == 0:
+            fd = self._fd
+            if os.name == "nt":
+                os.lseek(fd, _LOCK_OFFSET, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+            self._fd = None
+
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def read_version(self) -> int:
+        """current version of the batch file, does not require holding the lock"""
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read(_VERSION_WIDTH)
+        except FileNotFoundError:
+            return 0
+
+        if len(data) < _VERSION_WIDTH:
+            return 0
+
+        return int(data)
+
+    @property
+    def version(self) -> int:
+        return self.read_version()
+
+    def bump(self) -> int:
+        """increment the version, must be called while holding the lock"""
+        if self._depth == 0:
+            raise RuntimeError("lock is not held")
+
+        version = self.read_version() + 1
+
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        os.write(self._fd, f"{version:0{_VERSION_WIDTH}d}".encode())
+
+        return version
+
+
+_locks: Dict[str, BatchLock] = dict()
+_locks_lock = threading.Lock()
+
+
+def batch_lock(batch_path: Union[str, Path]) -> BatchLock:
+    """get the lock for a batch file, there is only one lock instance per batch file in a process"""
+    path = os.path.abspath(str(batch_path)) + ".lock"
+    with _locks_lock:
+        if path not in _locks:
+            _locks[path] = BatchLock(path)
+        return _locks[path]
+
+
+# digest of lazy cells that were not modified since they were read
+_LAZY_UNCHANGED = b"lazy"
+# digest of NaN cells, NaN is not equal to itself
+_NAN = b"nan"
+
+# cells of these types are their own digest, only other cells such as the ``params`` and ``outputs`` dicts are
+# pickled and hashed
+_SCALAR_TYPES = (str, int, float, bool, type(None), pd.Timestamp)
+
+
+def _digest_bytes(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=8).digest()
+
+
+def _digest(value: Any) -> Hashable:
+    if type(value) in _SCALAR_TYPES:
+        if value != value:
+            return _NAN
+        return type(value), value
+
+    if isinstance(value, LazyCell) and not value.is_modified():
+        # so that computing digests never reads lazy cells
+        return _LAZY_UNCHANGED
+
+    return _digest_bytes(_dumps(value))
+
+
+class _RowDigests:
+    """
+    uuid -> {column: digest} of the rows as they are on disk, stored in ``df.attrs``.
+
+    Only the digests are kept, not the data they were computed from. pandas deep copies ``attrs`` every time a row
+    or a sub-DataFrame is taken, this is shared instead and is never modified, ``updated()`` returns a new instance.
+    """
+
+    def __init__(
+            self,
+            digests: Dict[str, dict],
+            changed: Optional[Dict[str, dict]] = None,
+            removed: Tuple[str, ...] = (),
+    ):
+        self._digests = digests
+        self._changed = changed if changed is not None else dict()
+        self._removed = removed
+
+    def get(self) -> Dict[str, dict]:
+        if len(self._changed) == 0 and len(self._removed) == 0:
+            return self._digests
+
+        digests = {**self._digests, **self._changed}
+        for u in self._removed:
+            digests.pop(u, None)
+
+        return digests
+
+    def updated(self, changed: Dict[str, dict], removed: Optional[str] = None) -> "_RowDigests":
+        """digests after rows were changed or removed on disk"""
+        return _RowDigests(
+            digests=self._digests,
+            changed={**self._changed, **changed},
+            removed=self._removed if removed is None else (*self._removed, removed),
+        )
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def _get_row_digests(df: pd.DataFrame) -> Dict[str, dict]:
+    columns = list(df.columns)
+    return {
+        row[columns.index("uuid")]: {c: _digest(v) for c, v in zip(columns, row)}
+        for row in df.itertuples(index=False, name=None)
+    }
+
+
+def get_row_digests(df: pd.DataFrame, track_changes: bool = True) -> _RowDigests:
+    """
+    digests of the cells of ``df``, lazy cells that were not read are not read.
+    If ``track_changes`` is ``False`` no digests are computed, see ``load_batch()``.
+    """
+    if not track_changes:
+        return _RowDigests(dict())
+    return _RowDigests(_get_row_digests(df))
+
+
+def set_batch_version(df: pd.DataFrame, version: int, digests: Optional[_RowDigests] = None):
+    """
+    set the version of the batch file that the DataFrame is identical to,
+    ``digests`` are computed from ``df`` if not provided
+    """
+    if digests is None:
+        digests = get_row_digests(df)
+
+    df.attrs[VERSION_ATTR] = version
+    df.attrs[_DIGESTS_ATTR] = digests
+
+
+def _update_row_digests(df: pd.DataFrame, version: int, changed: pd.DataFrame = None, removed: str = None):
+    """update the version and digests after rows of ``df`` were written or removed"""
+    digests: _RowDigests = df.attrs.get(_DIGESTS_ATTR, _RowDigests(dict()))
+
+    changed = _get_row_digests(changed) if changed is not None else dict()
+
+    df.attrs[VERSION_ATTR] = version
+    df.attrs[_DIGESTS_ATTR] = digests.updated(changed, removed)
+
+
+class BatchStorage:
+    """
+    Base class for batch storage engines.
+
+    Every method that writes takes the full DataFrame, engines that cannot
+    update single rows in place simply rewrite everything.
+    Writes are done while holding the batch lock and increment the batch version,
+    the version and row digests in the DataFrame's ``attrs`` are kept up to date.
+    Subclasses implement the underscore methods.
+    """
+
+    #: ``True`` if the engine writes single rows in place, ``False`` if it rewrites the entire batch file
+    row_level: bool = False
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.lock = batch_lock(self.path)
+
+    def exists(self) -> bool:
+        return self.path.is_file()
+
+    def read(self, columns: Optional[List[str]] = None, lazy: bool = False) -> pd.DataFrame:
+        """
+        read the batch DataFrame
+
+        Parameters
+        ----------
+        columns: list of str, optional
+            only read these columns, the ``"uuid"`` column is always read
+
+        lazy: bool
+            if supported by the engine, the large cells of the ``"params"`` and ``"outputs"`` columns are read
+            when they are first accessed
+        """
+        return self._read(columns, lazy)
+
+    def read_versioned(
+            self,
+            columns: Optional[List[str]] = None,
+            lazy: bool = False
+    ) -> Tuple[pd.DataFrame, int]:
+        """
+        read the batch DataFrame and the version it corresponds to, without holding the lock.
+        Tries again if the batch is written in the meantime.
+        """
+        while True:
+            version = self.lock.read_version()
+            df = self._read(columns, lazy)
+            if self.lock.read_version() == version:
+                return df, version
+
+    def read_row(self, uuid: str, columns: Optional[List[str]] = None) -> Optional[dict]:
+        """read the cells of a single item, ``None`` if there is no item with the given uuid"""
+        df = self._read(columns)
+        rows = df.loc[df["uuid"] == uuid]
+        if rows.index.size == 0:
+            return None
+
+        return rows.iloc[0].to_dict()
+
+    def write(self, df: pd.DataFrame) -> int:
+        """overwrite the batch on disk with the given DataFrame, returns the new version"""
+        with self.lock:
+            self._write(df)
+            version = self.lock.bump()
+
+        set_batch_version(df, version)
+        return version
+
+    def append_rows(self, df: pd.DataFrame, rows: pd.DataFrame) -> int:
+        """``rows`` were appended to the end of ``df``"""
+        with self.lock:
+            up_to_date = self._is_up_to_date(df)
+            self._append_rows(df, rows)
+            version = self.lock.bump()
+
+        if up_to_date:
+            _update_row_digests(df, version, changed=rows)
+        return version
+
+    def update_row(self, df: pd.DataFrame, uuid: str) -> int:
+        """the row with the given ``uuid`` was modified in ``df``"""
+        with self.lock:
+            up_to_date = self._is_up_to_date(df)
+            self._update_row(df, uuid)
+            version = self.lock.bump()
+
+        if up_to_date:
+            _update_row_digests(df, version, changed=df.iloc[[_get_uuid_position(df, uuid)]])
+        return version
+
+    def remove_row(self, df: pd.DataFrame, uuid: str) -> int:
+        """the row with the given ``uuid`` was removed from ``df``"""
+        with self.lock:
+            up_to_date = self._is_up_to_date(df)
+            self._remove_row(df, uuid)
+            version = self.lock.bump()
+
+        if up_to_date:
+            _update_row_digests(df, version, removed=uuid)
+        return version
+
+    def update_cells(self, uuid: str, values: dict) -> int:
+        """set the values of the given columns, ``{column: value}``, in the row with the given ``uuid``"""
+        with self.lock:
+            self._update_cells(uuid, values)
+            return self.lock.bump()
+
+    def delete(self):
+        """delete the batch file"""
+        with self.lock:
+            self._delete()
+            self.lock.bump()
+
+    def _read(self, columns: Optional[List[str]] = None, lazy: bool = False) -> pd.DataFrame:
+        raise NotImplementedError
+
+    def _write(self, df: pd.DataFrame):
+        raise NotImplementedError
+
+    # engines that rewrite the whole file write ``df`` if it is identical to the file apart from the change,
+    # else the change is applied to the DataFrame on disk so that changes made by others are not overwritten
+
+    def _is_up_to_date(self, df: pd.DataFrame) -> bool:
+        return df.attrs.get(VERSION_ATTR) == self.lock.version
+
+    def _append_rows(self, df: pd.DataFrame, rows: pd.DataFrame):
+        if self._is_up_to_date(df):
+            self._write(df)
+            return
+
+        disk_df = self._read()
+        self._write(pd.concat([disk_df, rows], ignore_index=True))
+
+    def _update_row(self, df: pd.DataFrame, uuid: str):
+        if self._is_up_to_date(df):
+            self._write(df)
+            return
+
+        disk_df = self._read()
+        row = df.iloc[_get_uuid_position(df, uuid)]
+        if not apply_item_results(disk_df, uuid, row.drop("uuid").to_dict()):
+            warnings.warn(f"Batch item {uuid} was removed from the batch file, it is not updated")
+            return
+        self._write(disk_df)
+
+    def _remove_row(self, df: pd.DataFrame, uuid: str):
+        if self._is_up_to_date(df):
+            self._write(df)
+            return
+
+        disk_df = self._read()
+        self._write(disk_df.loc[disk_df["uuid"] != uuid].reset_index(drop=True))
+
+    def _update_cells(self, uuid: str, values: dict):
+        df = self._read()
+        if not apply_item_results(df, uuid, values):
+            warnings.warn(f"Batch item {uuid} was removed from the batch file, it is not updated")
+            return
+        self._write(df)
+
+    def _delete(self):
+        os.remove(self.path)
+
+
+class PickleStorage(BatchStorage):
+    """The entire DataFrame is stored in a single pickle file"""
+
+    def _read(self, columns: Optional[List[str]] = None, lazy: bool = False) -> pd.DataFrame:
+        # the entire file has to be read anyways
+        df = pd.read_pickle(self.path)
+        if columns is not None:
+            df = df[[c for c in df.columns if c in columns or c == "uuid"]]
+
+        return df
+
+    def _write(self, df: pd.DataFrame):
+        df = df.copy(deep=False)
+        df.attrs = {k: v for k, v in df.attrs.items() if k not in _PRIVATE_ATTRS}
+        data = pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)
+
+        # write to a temp file and replace, readers never see a partially written file
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+
+def _quote(name: str) -> str:
+    """quote an sqlite identifier"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _dumps(value: Any) -> bytes:
+    return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class LazyCell(MutableMapping):
+    """
+    A ``params`` or ``outputs`` dict of an SQLite batch that is read from the batch file when it is first accessed.
+    Behaves like a dict, is pickled and copied as a dict.
+
+    ``outputs["success"]`` is known without reading the cell.
+    """
+
+    def __init__(self, path: Path, uuid: str, column: str, known: Optional[dict] = None):
+        self._path = path
+        self._uuid = uuid
+        self._column = column
+        self._known = known if known is not None else dict()
+
+        self._value: Optional[dict] = None
+        self._original_digest: Optional[bytes] = None
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._value is not None
+
+    def is_modified(self) -> bool:
+        if not self.is_loaded:
+            return False
+
+        return hashlib.blake2b(_dumps(self._value), digest_size=8).digest() != self._original_digest
+
+    def load(self) -> dict:
+        """read the cell from the batch file if it has not been read yet"""
+        if self._value is None:
+            conn = sqlite3.connect(str(self._path), timeout=60)
+            try:
+                r = conn.execute(
+                    f"SELECT {_quote(self._column)} FROM batch WHERE uuid = ?", [self._uuid]
+                ).fetchone()
+            finally:
+                conn.close()
+
+            if r is None:
+                raise KeyError(f"Item with UUID `{self._uuid}` not found in batch file: {self._path}")
+
+            self._set(pickle.loads(r[0]))
+
+        return self._value
+
+    def _set(self, value: dict):
+        self._value = value
+        self._original_digest = hashlib.blake2b(_dumps(value), digest_size=8).digest()
+
+    def __getitem__(self, key):
+        if self._value is None and key in self._known.keys():
+            return self._known[key]
+
+        return self.load()[key]
+
+    def __setitem__(self, key, value):
+        self.load()[key] = value
+
+    def __delitem__(self, key):
+        del self.load()[key]
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __len__(self):
+        return len(self.load())
+
+    def __reduce__(self):
+        return dict, (dict(self.load()),)
+
+    def __repr__(self):
+        if self._value is not None:
+            return repr(self._value)
+
+        known = ", ".join(f"{k!r}: {v!r}" for k, v in self._known.items())
+        return "{" + known + (", " if known else "") + "...}"
+
+
+def load_lazy_cells(df: pd.DataFrame):
+    """read all lazy cells of a DataFrame, one query per column of each batch file"""
+    for c in df.columns:
+        if c not in LAZY_COLUMNS:
+            continue
+
+        cells = [v for v in df[c] if isinstance(v, LazyCell) and not v.is_loaded]
+        for path in set(cell._path for cell in cells):
+            conn = sqlite3.connect(str(path), timeout=60)
+            try:
+                data = dict(conn.execute(f"SELECT uuid, {_quote(c)} FROM batch"))
+            finally:
+                conn.close()
+
+            for cell in cells:
+                if cell._path == path and cell._uuid in data.keys():
+                    cell._set(pickle.loads(data[cell._uuid]))
+
+
+def _success(outputs) -> Optional[int]:
+    """the ``_success`` column of an sqlite batch, so that the success of an item is known without reading outputs"""
+    if isinstance(outputs, LazyCell) and not outputs.is_loaded:
+        outputs = outputs._known
+
+    if not isinstance(outputs, Mapping) or "success" not in outputs.keys():
+        return None
+
+    return int(bool(outputs["success"]))
+
+
+class SQLiteStorage(BatchStorage):
+    """
+    Each batch item is a row in the ``batch`` table, rows are kept in the order in which they were added.
+    The ``uuid`` is stored as text and every other cell is stored pickled, so columns can be read separately.
+    Changes are written in transactions so readers never see a partially written batch.
+    """
+
+    row_level = True
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None so that transactions are managed explicitly in `_transaction()`
+        conn = sqlite3.connect(str(self.path), timeout=60, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def read_row(self, uuid: str, columns: Optional[List[str]] = None) -> Optional[dict]:
+        conn = self._connect()
+        try:
+            all_columns = self._get_columns(conn)
+            columns = [c for c in all_columns if columns is None or c in columns or c == "uuid"]
+            r = conn.execute(
+                f"SELECT {', '.join(map(_quote, columns))} FROM batch WHERE uuid = ?", [str(uuid)]
+            ).fetchone()
+        finally:
+            conn.close()
+
+        if r is None:
+            return None
+
+        return {c: v if c == "uuid" or v is None else pickle.loads(v) for c, v in zip(columns, r)}
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        try:
+            # take the write lock right away so concurrent writers wait instead of failing to upgrade their lock
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _get_table_columns(conn: sqlite3.Connection) -> List[str]:
+        return [r[1] for r in conn.execute("PRAGMA table_info(batch)").fetchall()]
+
+    def _get_columns(self, conn: sqlite3.Connection) -> List[str]:
+        """DataFrame columns stored in the table, in order"""
+        return [c for c in self._get_table_columns(conn) if c not in _SQLITE_INTERNAL_COLUMNS]
+
+    @staticmethod
+    def _create_table(conn: sqlite3.Connection, columns: List[str]):
+        col_defs = ["_row INTEGER PRIMARY KEY AUTOINCREMENT", "_success INTEGER"]
+        for c in columns:
+            if c == "uuid":
+                col_defs.append("uuid TEXT UNIQUE")
+            else:
+                col_defs.append(f"{_quote(c)} BLOB")
+
+        conn.execute(f"CREATE TABLE batch ({', '.join(col_defs)})")
+
+    def _add_missing_columns(self, conn: sqlite3.Connection, columns: Iterable[str]) -> List[str]:
+        """add columns that were added to the DataFrame to the table, returns all table columns"""
+        table_columns = self._get_table_columns(conn)
+        if "_success" not in table_columns:
+            # batch files created before the column was added
+            conn.execute("ALTER TABLE batch ADD COLUMN _success INTEGER")
+
+        for c in columns:
+            if c not in table_columns:
+                conn.execute(f"ALTER TABLE batch ADD COLUMN {_quote(c)} BLOB")
+                table_columns.append(c)
+
+        return [c for c in table_columns if c not in _SQLITE_INTERNAL_COLUMNS]
+
+    def _encode_cells(self, values: Dict[str, Any]) -> Dict[str, Any]:
+        """{column: value} -> {sql column: sql value}"""
+        cells = dict()
+        for c, v in values.items():
+            if c == "uuid":
+                cells["uuid"] = str(v)
+                continue
+
+            if isinstance(v, LazyCell) and not v.is_loaded and v._path == self.path:
+                # unchanged since it was read from this file
+                continue
+
+            cells[c] = _dumps(v)
+            if c == "outputs":
+                cells["_success"] = _success(v)
+
+        return cells
+
+    def _insert(self, conn: sqlite3.Connection, rows: pd.DataFrame):
+        # lazy cells from this file must have been loaded
+        for _, row in rows.iterrows():
+            cells = self._encode_cells(row.to_dict())
+            conn.execute(
+                f"INSERT INTO batch ({', '.join(map(_quote, cells.keys()))}) VALUES ({', '.join('?' * len(cells))})",
+                list(cells.values())
+            )
+
+    def _update(self, conn: sqlite3.Connection, uuid: str, values: Dict[str, Any]):
+        cells = self._encode_cells(values)
+        cells.pop("uuid", None)
+        if len(cells) == 0:
+            return
+
+        assignments = ", ".join(f"{_quote(c)} = ?" for c in cells.keys())
+        cursor = conn.execute(f"UPDATE batch SET {assignments} WHERE uuid = ?", [*cells.values(), str(uuid)])
+        if cursor.rowcount == 0:
+            raise KeyError(f"Item with UUID `{uuid}` not found in batch file: {self.path}")
+
+    def _read(self, columns: Optional[List[str]] = None, lazy: bool = False) -> pd.DataFrame:
+        conn = self._connect()
+        try:
+            all_columns = self._get_columns(conn)
+            if columns is None:
+                columns = all_columns
+            else:
+                columns = [c for c in all_columns if c in columns or c == "uuid"]
+
+            has_success = "_success" in self._get_table_columns(conn)
+
+            exprs = list()
+            for c in columns:
+                if lazy and c in LAZY_COLUMNS:
+                    # small cells such as `None` are read right away, NULL marks the cells that are read later
+                    exprs.append(f"CASE WHEN length({_quote(c)}) <= {_LAZY_MIN_SIZE} THEN {_quote(c)} END")
+                else:
+                    exprs.append(_quote(c))
+            exprs.append("_success" if has_success else "NULL")
+
+            cursor = conn.execute(f"SELECT {', '.join(exprs)} FROM batch ORDER BY _row")
+            rows = cursor.fetchall()
+        finally:
+            conn.close()
+
+        return self._decode_rows(columns, rows, lazy)
+
+    def _decode_rows(self, columns: List[str], rows: List[tuple], lazy: bool) -> pd.DataFrame:
+        uuid_ix = columns.index("uuid")
+        data = list()
+        for r in rows:
+            u = r[uuid_ix]
+            row = list()
+            for c, v in zip(columns, r):
+                if c == "uuid":
+                    row.append(v)
+                elif v is not None:
+                    row.append(pickle.loads(v))
+                elif lazy and c in LAZY_COLUMNS:
+                    known = {"success": bool(r[-1])} if c == "outputs" and r[-1] is not None else None
+                    row.append(LazyCell(self.path, u, c, known))
+                else:
+                    # column was added after this row was written
+                    row.append(None)
+            data.append(row)
+
+        # object dtype like the DataFrames that are created by `create_batch()`
+        return pd.DataFrame(data=data, columns=columns, dtype=object)
+
+    def _write(self, df: pd.DataFrame):
+        # the table is replaced, read lazy cells first
+        load_lazy_cells(df)
+
+        with self._transaction() as conn:
+            conn.execute("DROP TABLE IF EXISTS batch")
+            self._create_table(conn, list(df.columns))
+            self._insert(conn, df)
+
+    def _append_rows(self, df: pd.DataFrame, rows: pd.DataFrame):
+        with self._transaction() as conn:
+            self._add_missing_columns(conn, rows.columns)
+            self._insert(conn, rows)
+
+    def _update_row(self, df: pd.DataFrame, uuid: str):
+        row = df.iloc[_get_uuid_position(df, uuid)]
+
+        with self._transaction() as conn:
+            self._add_missing_columns(conn, df.columns)
+            self._update(conn, uuid, row.to_dict())
+
+    def _remove_row(self, df: pd.DataFrame, uuid: str):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM batch WHERE uuid = ?", [str(uuid)])
+
+    def _update_cells(self, uuid: str, values: dict):
+        with self._transaction() as conn:
+            self._add_missing_columns(conn, values.keys())
+            self._update(conn, uuid, values)
+
+    def _delete(self):
+        for suffix in ["", "-wal", "-shm"]:
+            path = self.path.with_name(self.path.name + suffix)
+            if path.is_file():
+                os.remove(path)
+
+
+def get_storage(path: Union[str, Path]) -> BatchStorage:
+    """
+    Get the storage engine for a batch file, chosen from the file extension
+
+    Parameters
+    ----------
+    path: str or Path
+        path to the batch file
+
+    Returns
+    -------
+    BatchStorage
+        ``SQLiteStorage`` if the extension is one of ``.db``, ``.sqlite``, ``.sqlite3``, else ``PickleStorage``
+    """
+    path = Path(path)
+    if path.suffix.lower() in SQLITE_EXTENSIONS:
+        return SQLiteStorage(path)
+
+    return PickleStorage(path)
+
+
+def merge_batch(df: pd.DataFrame, disk_df: pd.DataFrame) -> Tuple[pd.DataFrame, List[Tuple[str, str]]]:
+    """
+    Merge the changes made to a stale batch DataFrame with the batch DataFrame on disk.
+
+    The cell digests that ``load_batch()`` stores in ``df.attrs`` are used to find which cells were changed in
+    ``df`` since it was loaded, and which rows were added or removed. Changed cells and added rows are taken from
+    ``df``, removed rows are removed, everything else is taken from ``disk_df``. Rows that were added to the batch
+    on disk are kept, rows that were removed from the batch on disk are not brought back.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        stale batch DataFrame
+
+    disk_df: pd.DataFrame
+        current batch DataFrame on disk
+
+    Returns
+    -------
+    Tuple[pd.DataFrame, List[Tuple[str, str]]]
+        | merged DataFrame
+        | list of ``(uuid, column)`` of cells that were changed both in ``df`` and on disk, the value in ``df`` is
+          used for these cells
+    """
+    snapshot = df.attrs[_DIGESTS_ATTR].get() if _DIGESTS_ATTR in df.attrs.keys() else dict()
+
+    columns = list(df.columns) + [c for c in disk_df.columns if c not in df.columns]
+    local_rows = {u: i for i, u in enumerate(df["uuid"])}
+    disk_uuids = set(disk_df["uuid"])
+
+    data = list()
+    conflicts = list()
+    for disk_row in disk_df.itertuples(index=False, name=None):
+        disk_row = dict(zip(disk_df.columns, disk_row))
+        u = disk_row["uuid"]
+
+        if u not in local_rows:
+            if u not in snapshot:
+                # added to the batch on disk
+                data.append([disk_row.get(c) for c in columns])
+            # else: removed from df
+            continue
+
+        local_row = df.iloc[local_rows[u]]
+        if u not in snapshot:
+            # added by df and written without updating its digests
+            data.append([local_row[c] if c in df.columns else disk_row.get(c) for c in columns])
+            continue
+
+        row = list()
+        for c in columns:
+            original = snapshot[u].get(c)
+            if c in df.columns and _digest(local_row[c]) != original:
+                # changed in df
+                if c in disk_row.keys() and _digest(disk_row[c]) not in (original, _digest(local_row[c])):
+                    conflicts.append((u, c))
+                row.append(local_row[c])
+            else:
+                row.append(disk_row[c] if c in disk_row.keys() else local_row[c])
+        data.append(row)
+
+    # rows that were added in df, rows that were removed from the batch on disk are not brought back
+    for local_row in df.itertuples(index=False, name=None):
+        local_row = dict(zip(df.columns, local_row))
+        if local_row["uuid"] not in disk_uuids and local_row["uuid"] not in snapshot:
+            data.append([local_row.get(c) for c in columns])
+
+    merged = pd.DataFrame(data=data, columns=columns, dtype=object)
+    merged.attrs = {k: v for k, v in df.attrs.items() if k not in _PRIVATE_ATTRS}
+
+    return merged, conflicts
+
+
+def get_results_path(batch_path: Union[str, Path], uuid: str) -> Path:
+    """path to the results sidecar file of a batch item, it is in the item's output dir"""
+    return Path(batch_path).parent.joinpath(str(uuid), f"{uuid}_results.pickle")
+
+
+class _UUIDIndex(dict):
+    """
+    uuid -> position of the row, stored in ``df.attrs``.
+
+    pandas deep copies ``attrs`` for every row or sub-DataFrame that is taken, the index is shared instead.
+    Positions are therefore checked against the DataFrame on every lookup, the index is rebuilt if they
+    do not match, for example in a sub-DataFrame or after rows were removed.
+    """
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def _build_uuid_index(df: pd.DataFrame) -> _UUIDIndex:
+    index = _UUIDIndex((u, i) for i, u in enumerate(df["uuid"]))
+    df.attrs[UUID_INDEX_ATTR] = index
+    return index
+
+
+def _add_to_uuid_index(df: pd.DataFrame, uuids: Iterable[str], start: int):
+    """add rows that were appended to the DataFrame starting at position ``start``"""
+    if UUID_INDEX_ATTR in df.attrs.keys():
+        df.attrs[UUID_INDEX_ATTR].update((u, i) for i, u in enumerate(uuids, start=start))
+
+
+def _get_uuid_position(df: pd.DataFrame, u: Union[str, UUID]) -> int:
+    """position of the row with the given uuid, raises ``KeyError`` if there is no such row"""
+    u = str(u)
+    uuids = df["uuid"]
+
+    index: Dict[str, int] = df.attrs.get(UUID_INDEX_ATTR, dict())
+    i = index.get(u)
+    if i is not None and i < uuids.size and uuids.iat[i] == u:
+        return i
+
+    # rows were added or removed, or this is a sub-DataFrame
+    index = _build_uuid_index(df)
+    if u not in index.keys():
+        raise KeyError(f"No batch item found with uuid: {u}")
+
+    return index[u]
+
+
+def apply_item_results(df: pd.DataFrame, uuid: str, results: dict) -> bool:
+    """
+    set the results, ``{column: value}``, of the item with the given ``uuid`` in the DataFrame, in place.
+    Returns ``False`` and does nothing if the DataFrame has no item with this ``uuid``, for example if it was removed.
+    """
+    try:
+        i = _get_uuid_position(df, uuid)
+    except KeyError:
+        return False
+
+    for column, value in results.items():
+        if column not in df.columns:
+            df[column] = None
+        elif df[column].dtype != object:
+            # cells hold arbitrary python objects such as dicts
+            df[column] = df[column].astype(object)
+        df.iat[i, df.columns.get_loc(column)] = value
+
+    return True
+
+
+def write_item_results(batch_path: Union[str, Path], uuid: str, **results):
+    """
+    Store the results of running a batch item, such as ``outputs`` and ``ran_time``.
+    Called by the algorithm workers.
+
+    Storage engines that can update a single row do that directly. For pickle batches the results are written to a
+    small sidecar file in the item's output dir instead of rewriting the batch file, so that items which finish at
+    the same time cannot overwrite each other's results. ``load_batch()`` merges the sidecars, and
+    ``df.caiman.sync_results()`` writes them to the batch file.
+    """
+    storage = get_storage(batch_path)
+
+    if storage.row_level:
+        storage.update_cells(uuid, results)
+        return
+
+    path = get_results_path(batch_path, uuid)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # readers never see a partially written file
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump(results, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def read_item_results(batch_path: Union[str, Path], uuid: str) -> Optional[dict]:
+    """read the results sidecar of a batch item, ``None`` if there is no sidecar"""
+    try:
+        with open(get_results_path(batch_path, uuid), "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def read_all_item_results(batch_path: Union[str, Path], uuids: Iterable[str]) -> Dict[str, dict]:
+    """
+    read the results sidecars of the items with the given ``uuids``, ``{uuid: results}`` of the items that have one.
+
+    The batch dir is listed once and only the output dirs that exist are probed for a sidecar, so that items which
+    were never run cost no file system round trips.
+    """
+    try:
+        with os.scandir(Path(batch_path).parent) as entries:
+            dirs = {entry.name for entry in entries if entry.is_dir()}
+    except FileNotFoundError:
+        return dict()
+
+    all_results = dict()
+    for u in uuids:
+        if u not in dirs:
+            continue
+        results = read_item_results(batch_path, u)
+        if results is not None:
+            all_results[u] = results
+
+    return all_results
+
+
+def _get_ran_time(results: Mapping) -> Optional[float]:
+    """``ran_time`` of the results as seconds since the epoch, ``None`` if it is not set"""
+    ran_time = results.get("ran_time")
+    if ran_time is None:
+        return None
+    try:
+        # written as local time
+        return pd.Timestamp(ran_time).to_pydatetime().timestamp()
+    except (ValueError, TypeError):
+        return None
+
+
+def read_item_outputs(
+        batch_path: Union[str, Path],
+        uuid: str,
+        since: Optional[float] = None,
+) -> Optional[dict]:
+    """
+    ``outputs`` of a batch item that was run, ``None`` if the item has not been run or does not exist.
+
+    If ``since`` is given, as returned by ``time.time()``, only the outputs of a run that finished at or after
+    that time are returned, so that the outputs of a previous run are not mistaken for those of a new run.
+    """
+    results = read_item_results(batch_path, uuid)
+    if results is None or "outputs" not in results.keys():
+        # engines that write single rows, or the sidecar was already written to the batch file
+        results = get_storage(batch_path).read_row(uuid, columns=["outputs", "ran_time"])
+        if results is None:
+            return None
+
+    if since is not None:
+        ran_time = _get_ran_time(results)
+        # ran_time has a resolution of one second
+        if ran_time is None or ran_time < int(since):
+            return None
+
+    return results.get("outputs")
+
+
+def merge_item_results(df: pd.DataFrame, batch_path: Union[str, Path]) -> List[Path]:
+    """
+    Merge the results sidecars of all items into the DataFrame, in place.
+
+    Returns
+    -------
+    List[Path]
+        paths of the sidecar files that were merged
+    """
+    merged = list()
+    for u, results in read_all_item_results(batch_path, df["uuid"]).items():
+        # only the columns that were loaded
+        apply_item_results(df, u, {k: v for k, v in results.items() if k in df.columns})
+        merged.append(get_results_path(batch_path, u))
+
+    return merged
@@ -1,19 +1,27 @@
 import os
+import time
+from collections import Counter
 from pathlib import Path
-from typing import Union
+from typing import Union, Optional, List, Dict, Tuple
 
 import pandas as pd
 
+from .batch_storage import get_storage, merge_item_results, set_batch_version, get_row_digests
 from .utils import validate_path
 
 CURRENT_BATCH_PATH: Path = None  # only one batch at a time
 PARENT_DATA_PATH: Path = None
 
+# (batch dir, parent data path, relative path) -> (full path, time it was resolved)
+_RESOLVED_PATHS: Dict[Tuple[Path, Optional[Path], str], Tuple[Path, float]] = dict()
+PATH_CACHE_TTL: Optional[float] = None
+
 COMPUTE_BACKEND_SUBPROCESS = "subprocess"  #: subprocess backend
-COMPUTE_BACKEND_SLURM = "slurm"  #: SLURM backend, not yet implemented
+COMPUTE_BACKEND_SLURM = "slurm"  #: SLURM backend, see ``set_slurm_commands()``
 COMPUTE_BACKEND_LOCAL = "local"
+COMPUTE_BACKEND_WORKER = "worker"  #: warm worker service, see ``start_worker()``
 
-COMPUTE_BACKENDS = [COMPUTE_BACKEND_SUBPROCESS, COMPUTE_BACKEND_SLURM, COMPUTE_BACKEND_LOCAL]
+COMPUTE_BACKENDS = [COMPUTE_BACKEND_SUBPROCESS, COMPUTE_BACKEND_SLURM, COMPUTE_BACKEND_LOCAL, COMPUTE_BACKEND_WORKER]
 
 DATAFRAME_COLUMNS = ["algo", "item_name", "input_movie_path", "params", "outputs", "added_time", "ran_time", "algo_duration", "comments", "uuid"]
 
@@ -52,6 +60,82 @@ def get_parent_raw_data_path() -> Path:
     return PARENT_DATA_PATH
 
 
+def set_path_cache_ttl(ttl: Optional[float]):
+    """
+    Set how long resolved paths are cached, see ``df.paths.resolve()``.
+
+    Files that are created or removed by mesmerize are updated in the cache right away, a TTL is only useful if
+    files in the batch dir or parent raw data dir are moved or removed by other means.
+
+    Parameters
+    ----------
+    ttl: float or None
+        | time in seconds after which a cached path is checked again on the file system
+        | ``None`` to cache resolved paths until they are invalidated, this is the default
+        | ``0`` to disable the cache
+
+    """
+    global PATH_CACHE_TTL
+    PATH_CACHE_TTL = ttl
+
+
+def clear_path_cache(batch_dir: Optional[Union[str, Path]] = None, path: Optional[Union[str, Path]] = None):
+    """
+    Remove resolved paths from the cache.
+
+    Parameters
+    ----------
+    batch_dir: str or Path, optional
+        only remove paths that were resolved for batches in this dir, all paths are removed by default
+
+    path: str or Path, optional
+        only remove this relative path and the paths within it, for example the output dir of a batch item
+
+    """
+    if batch_dir is None:
+        _RESOLVED_PATHS.clear()
+        return
+
+    batch_dir = Path(batch_dir)
+    prefix = None if path is None else Path(path).as_posix()
+
+    for key in list(_RESOLVED_PATHS.keys()):
+        if key[0] != batch_dir:
+            continue
+        if prefix is None or key[2] == prefix or key[2].startswith(f"{prefix}/"):
+            _RESOLVED_PATHS.pop(key, None)
+
+
+def _resolve_uncached(batch_dir: Path, path: Path, exists=os.path.exists) -> Optional[Path]:
+    # check if input movie is within batch dir
+    if exists(batch_dir.joinpath(path)):
+        return batch_dir.joinpath(path)
+
+    # else check if in parent raw data dir
+    elif get_parent_raw_data_path() is not None:
+        if exists(get_parent_raw_data_path().joinpath(path)):
+            return get_parent_raw_data_path().joinpath(path)
+
+    return None
+
+
+def _get_cached_path(key: Tuple[Path, Optional[Path], str]) -> Optional[Path]:
+    if key not in _RESOLVED_PATHS.keys():
+        return None
+
+    full_path, resolved_time = _RESOLVED_PATHS[key]
+    if PATH_CACHE_TTL is not None and time.monotonic() - resolved_time >= PATH_CACHE_TTL:
+        return None
+
+    return full_path
+
+
+def _cache_path(key: Tuple[Path, Optional[Path], str], full_path: Path):
+    # only paths that exist are cached, a file that is created later is found the next time
+    if PATH_CACHE_TTL != 0:
+        _RESOLVED_PATHS[key] = (full_path, time.monotonic())
+
+
 class _BasePathExtensions:
     def __init__(self, data: Union[pd.DataFrame, pd.Series]):
         self._data = data
@@ -91,16 +175,20 @@ class _BasePathExtensions:
 
         """
         path = Path(path)
-        # check if input movie is within batch dir
-        if self.get_batch_path().parent.joinpath(path).exists():
-            return self.get_batch_path().parent.joinpath(path)
+        batch_dir = self.get_batch_path().parent
 
-        # else check if in parent raw data dir
-        elif get_parent_raw_data_path() is not None:
-            if get_parent_raw_data_path().joinpath(path).exists():
-                return get_parent_raw_data_path().joinpath(path)
+        # resolved paths are cached, see ``set_path_cache_ttl()``
+        key = (batch_dir, get_parent_raw_data_path(), path.as_posix())
+        full_path = _get_cached_path(key)
+        if full_path is not None:
+            return full_path
+
+        full_path = _resolve_uncached(batch_dir, path)
+        if full_path is None:
+            raise FileNotFoundError(f"Could not resolve full path of:\n{path}")
 
-        raise FileNotFoundError(f"Could not resolve full path of:\n{path}")
+        _cache_path(key, full_path)
+        return full_path
 
     def split(self, path: Union[str, Path]):
         """
@@ -140,7 +228,70 @@ class _BasePathExtensions:
 
 @pd.api.extensions.register_dataframe_accessor("paths")
 class PathsDataFrameExtension(_BasePathExtensions):
-    pass
+    def resolve_column(self, column: Union[str, pd.Series]) -> pd.Series:
+        """
+        Resolve the full paths of all the relative paths in a column at once, see ``resolve()``.
+
+        Each distinct path is resolved once, and the contents of directories that contain several of the
+        paths are listed once instead of checking every path on the file system.
+
+        Parameters
+        ----------
+        column: str or pd.Series
+            | name of the column, such as ``"input_movie_path"``
+            | or a Series of relative paths, for example ``df["outputs"].map(lambda o: o["mean-projection-path"])``
+
+        Returns
+        -------
+        pd.Series
+            full paths, ``None`` for paths that are ``None`` or could not be resolved
+
+        Examples
+        --------
+
+        .. code-block:: python
+
+            input_movie_paths = df.paths.resolve_column("input_movie_path")
+
+        """
+        paths = self._data[column] if isinstance(column, str) else column
+        batch_dir = self.get_batch_path().parent
+        parent_data_path = get_parent_raw_data_path()
+
+        keys = {p: (batch_dir, parent_data_path, Path(p).as_posix()) for p in set(paths.dropna())}
+
+        resolved = dict()
+        uncached = list()
+        for p, key in keys.items():
+            full_path = _get_cached_path(key)
+            if full_path is None:
+                uncached.append(p)
+            else:
+                resolved[p] = full_path
+
+        # directories that contain more than one of the paths are listed once
+        candidates = [batch_dir] if parent_data_path is None else [batch_dir, parent_data_path]
+        dir_counts = Counter(root.joinpath(p).parent for p in uncached for root in candidates)
+        listings = dict()
+
+        def exists(full_path: Path) -> bool:
+            parent = full_path.parent
+            if dir_counts[parent] < 2:
+                return full_path.exists()
+            if parent not in listings.keys():
+                try:
+                    listings[parent] = set(os.listdir(parent))
+                except (FileNotFoundError, NotADirectoryError):
+                    listings[parent] = set()
+            return full_path.name in listings[parent]
+
+        for p in uncached:
+            full_path = _resolve_uncached(batch_dir, Path(p), exists=exists)
+            if full_path is not None:
+                _cache_path(keys[p], full_path)
+            resolved[p] = full_path
+
+        return paths.map(lambda p: None if p is None else resolved.get(p))
 
 
 @pd.api.extensions.register_series_accessor("paths")
@@ -148,14 +299,36 @@ class PathsSeriesExtension(_BasePathExtensions):
     pass
 
 
-def load_batch(path: Union[str, Path]) -> pd.DataFrame:
+def load_batch(
+        path: Union[str, Path],
+        columns: Optional[List[str]] = None,
+        lazy: bool = False,
+        track_changes: bool = True,
+) -> pd.DataFrame:
     """
-    Load the batch dataframe pickle file
+    Load the batch dataframe from a pickle file, or an SQLite file if the extension is
+    one of ``.db``, ``.sqlite``, or ``.sqlite3``
 
     Parameters
     ----------
     path: str or Path
 
+    columns: list of str, optional
+        | only load these columns, the ``"uuid"`` column is always loaded
+        | with SQLite batch files only these columns are read from disk, which is much faster for large batches.
+          Use a DataFrame with all columns to add, remove, or modify batch items.
+
+    lazy: bool
+        | SQLite batch files only, the ``"params"`` and ``"outputs"`` dicts are read from disk when they are first
+          accessed, ``outputs["success"]`` is available without reading the entire dict
+        | default ``False``
+
+    track_changes: bool
+        | default ``True``, keep a digest of every cell so that ``save_to_disk()`` can merge the changes made to the
+          DataFrame with changes made to the batch file after it was loaded
+        | ``False`` skips computing the digests, which is faster for large batches that are only read. If the batch
+          file was modified after loading, ``save_to_disk()`` overwrites the rows of this DataFrame on disk.
+
     Returns
     -------
     pd.DataFrame
@@ -173,22 +346,37 @@ def load_batch(path: Union[str, Path]) -> pd.DataFrame:
         # view dataframe
         df.head()
 
+        # quickly list the items of a large SQLite batch
+        df = load_batch("/path/to/batch.db", columns=["algo", "item_name", "outputs"], lazy=True)
+
     """
 
     path = validate_path(path)
 
-    df = pd.read_pickle(Path(path))
+    storage = get_storage(path)
+    df, version = storage.read_versioned(columns, lazy)
+    # used by `save_to_disk()` to detect and merge changes made to the batch file after it was loaded,
+    # digests of the rows as they were read from the file
+    digests = get_row_digests(df, track_changes)
 
     df.paths.set_batch_path(path)
 
     # check to see if added and ran timestamp are in df
-    if all(item in df.columns for item in ["added_time", "ran_time", "algo_duration"]):
-        return df
-    else:
-        df["added_time"] = None
-        df["ran_time"] = None
-        df["algo_duration"] = None
-        return df
+    timestamp_columns = ["added_time", "ran_time", "algo_duration"]
+    if columns is not None:
+        timestamp_columns = [c for c in timestamp_columns if c in columns]
+    if not all(item in df.columns for item in timestamp_columns):
+        for c in timestamp_columns:
+            df[c] = None
+
+    # results of items that were run since the batch file was last written,
+    # engines that write single rows store the results directly
+    if not storage.row_level:
+        merge_item_results(df, path)
+
+    set_batch_version(df, version, digests)
+
+    return df
 
 
 def create_batch(path: Union[str, Path], remove_existing: bool = False) -> pd.DataFrame:
@@ -198,7 +386,10 @@ def create_batch(path: Union[str, Path], remove_existing: bool = False) -> pd.Da
     Parameters
     ----------
     path: str or Path
-        path to save the new batch DataFrame as a pickle file
+        | path to save the new batch DataFrame as a pickle file
+        | if the extension is one of ``.db``, ``.sqlite``, or ``.sqlite3`` the batch is stored in an SQLite
+          database instead, only the batch items that change are written to disk which is much faster for large
+          batches
 
     remove_existing: bool
         If ``True``, remove an existing batch DataFrame file if it exists at the given `path`, default ``False``
@@ -219,10 +410,11 @@ def create_batch(path: Union[str, Path], remove_existing: bool = False) -> pd.Da
 
     """
     path = validate_path(path)
+    storage = get_storage(path)
 
-    if Path(path).is_file():
+    if storage.exists():
         if remove_existing:
-            os.remove(path)
+            storage.delete()
         else:
             raise FileExistsError(
                 f"Batch file already exists at specified location: {path}"
@@ -234,11 +426,65 @@ def create_batch(path: Union[str, Path], remove_existing: bool = False) -> pd.Da
     df = pd.DataFrame(columns=DATAFRAME_COLUMNS)
     df.paths.set_batch_path(path)
 
-    df.to_pickle(path)
+    storage.write(df)
 
     return df
 
 
+def migrate_batch(src: Union[str, Path], dst: Union[str, Path], remove_src: bool = False) -> pd.DataFrame:
+    """
+    Copy an existing batch to a new batch file that uses the storage engine of the new file's extension,
+    for example to convert a pickle batch to an SQLite batch.
+
+    Parameters
+    ----------
+    src: str or Path
+        path to the existing batch file
+
+    dst: str or Path
+        path to the new batch file, must be in the same dir as ``src`` since the outputs of
+        the batch items are stored relative to the batch dir
+
+    remove_src: bool
+        If ``True``, remove the ``src`` batch file once it has been migrated, default ``False``
+
+    Returns
+    -------
+    pd.DataFrame
+        batch DataFrame loaded from the new batch file
+
+    Examples
+    --------
+
+    .. code-block:: python
+
+        from mesmerize_core import *
+
+        df = migrate_batch("/path/to/batch.pickle", "/path/to/batch.db")
+
+    """
+    src = Path(validate_path(src))
+    dst = Path(validate_path(dst))
+
+    if get_storage(dst).exists():
+        raise FileExistsError(
+            f"Batch file already exists at specified location: {dst}"
+        )
+
+    if src.parent.resolve() != dst.parent.resolve():
+        raise ValueError(
+            "The new batch file must be in the same dir as the existing batch file"
+        )
+
+    df = load_batch(src)
+    get_storage(dst).write(df)
+
+    if remove_src:
+        get_storage(src).delete()
+
+    return load_batch(dst)
+
+
 def get_full_raw_data_path(path: Union[Path, str]) -> Path:
     path = Path(path)
     if PARENT_DATA_PATH is not None:
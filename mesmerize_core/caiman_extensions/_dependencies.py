@@ -0,0 +1,135 @@
+from collections import deque
+from pathlib import Path
+from typing import *
+from weakref import ref
+
+import pandas as pd
+
+from ..batch_storage import VERSION_ATTR, DEPENDENCY_GRAPH_ATTR
+
+
+def _path_key(path: Union[str, Path]) -> str:
+    # paths are compared as they are stored in the DataFrame, relative to the batch dir or parent raw data dir
+    return Path(path).as_posix()
+
+
+class DependencyGraph:
+    """
+    Parent -> children relations of the items in a batch DataFrame. An item is the child of a *motion correction*
+    item if its input movie is the output of that motion correction item.
+
+    The graph is built from the paths stored in the DataFrame, the file system is not accessed.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self._uuids: List[str] = list(df["uuid"])
+        self._parents: Dict[str, Optional[str]] = dict()
+        self._children: Dict[str, List[str]] = {u: list() for u in self._uuids}
+
+        # mcorr output path -> mcorr uuid
+        outputs: Dict[str, str] = dict()
+        for algo, u, item_outputs in zip(df["algo"], df["uuid"], df["outputs"]):
+            if algo != "mcorr" or item_outputs is None or not item_outputs["success"]:
+                continue
+            output_path = item_outputs.get("mcorr-output-path")
+            if output_path is not None:
+                outputs[_path_key(output_path)] = u
+
+        for u, input_movie_path in zip(df["uuid"], df["input_movie_path"]):
+            parent = outputs.get(_path_key(input_movie_path))
+            if parent == u:
+                parent = None
+            self._parents[u] = parent
+            if parent is not None:
+                self._children[parent].append(u)
+
+        # used to check that a cached graph belongs to the DataFrame
+        self._owner = ref(df)
+        self._key = self._get_key(df)
+
+    @staticmethod
+    def _get_key(df: pd.DataFrame) -> tuple:
+        return df.index.size, df.attrs.get(VERSION_ATTR)
+
+    def is_valid(self, df: pd.DataFrame) -> bool:
+        """``True`` if the graph was built from ``df`` and no items were added or removed since"""
+        return self._owner is not None and self._owner() is df and self._key == self._get_key(df)
+
+    def __deepcopy__(self, memo):
+        # stored in ``df.attrs``, sub-DataFrames build their own graph since they are not the owner
+        return self
+
+    def __getstate__(self):
+        # weakrefs cannot be pickled, an unpickled graph does not have an owner
+        return {**self.__dict__, "_owner": None}
+
+    def __contains__(self, u: str) -> bool:
+        return u in self._parents.keys()
+
+    def __len__(self) -> int:
+        return len(self._uuids)
+
+    def parent(self, u: str) -> Optional[str]:
+        """UUID of the item whose output is the input of item ``u``, ``None`` if it has no parent in the batch"""
+        return self._parents[str(u)]
+
+    def children(self, u: str) -> List[str]:
+        """UUIDs of the items that use the output of item ``u`` as their input"""
+        return list(self._children[str(u)])
+
+    def descendants(self, u: str) -> List[str]:
+        """UUIDs of all items that depend on item ``u`` directly or indirectly, parents before children"""
+        descendants = list()
+        queue = deque(self._children[str(u)])
+        while len(queue) > 0:
+            child = queue.popleft()
+            descendants.append(child)
+            queue.extend(self._children[child])
+
+        return descendants
+
+    def topological_order(self, uuids: Optional[Iterable[str]] = None) -> List[str]:
+        """
+        UUIDs in an order where every item comes after its parent, otherwise in the order of the DataFrame.
+
+        Parameters
+        ----------
+        uuids: iterable of str, optional
+            only order these items, all items are ordered by default
+
+        """
+        if uuids is None:
+            uuids = self._uuids
+        uuids = [str(u) for u in uuids]
+        selected = set(uuids)
+
+        order = list()
+        visited = set()
+        for u in uuids:
+            # the item and its parents that are not ordered yet, from the item up to the root
+            chain = list()
+            while u is not None and u not in visited and u not in chain:
+                chain.append(u)
+                u = self._parents[u]
+
+            for item in reversed(chain):
+                visited.add(item)
+                if item in selected:
+                    order.append(item)
+
+        return order
+
+
+def get_dependency_graph(df: pd.DataFrame) -> DependencyGraph:
+    """get the cached dependency graph of the DataFrame, the graph is built if needed"""
+    graph: Optional[DependencyGraph] = df.attrs.get(DEPENDENCY_GRAPH_ATTR)
+    if graph is None or not graph.is_valid(df):
+        graph = DependencyGraph(df)
+        df.attrs[DEPENDENCY_GRAPH_ATTR] = graph
+
+    return graph
+
+
+def invalidate_dependency_graph(df: pd.DataFrame):
+    """call after the items, their input movies, or their outputs change"""
+    df.attrs.pop(DEPENDENCY_GRAPH_ATTR, None)
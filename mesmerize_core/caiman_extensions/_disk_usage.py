@@ -0,0 +1,343 @@
+import os
+import pickle
+import re
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from shutil import rmtree
+from typing import *
+from uuid import UUID
+
+import pandas as pd
+import psutil
+
+from ..batch_storage import get_results_path, get_storage, SQLITE_EXTENSIONS
+
+
+FILE_TYPES = ["memmap", "hdf5", "projections", "shifts", "cache", "other"]
+
+DISK_USAGE_COLUMNS = ["path", "uuid", "item_name", "orphaned", "reason", "last_modified", *FILE_TYPES, "total"]
+
+# why an entry is orphaned
+REASON_REMOVED_ITEM = "removed item"
+REASON_FAILED_RUN = "failed run"
+REASON_RUNFILE = "runfile"
+REASON_TMP_FILE = "temp file"
+
+RUNFILE_EXTENSIONS = [".runfile", ".ps1", ".sbatch"]
+
+# temp files of batch files that are written and then renamed, "<batch file name>.<pid>.tmp"
+_TMP_FILE_PATTERN = re.compile(r"^(?P<name>.+)\.(?P<pid>\d+)\.tmp$")
+# logs of the "slurm" backend in the output dir of an item
+_SLURM_LOG_PATTERN = re.compile(r"^slurm-[\d_]+\.out$")
+# dir of the job scripts made by ``run_array()``
+SLURM_DIR = "slurm"
+# items of a job script, from the paths of their runfiles
+_SBATCH_RUNFILE_PATTERN = re.compile(
+    r"(?P<uuid>[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12})\.(runfile|ps1)\"$",
+    re.MULTILINE
+)
+
+# first bytes of the files that ``get_storage()`` can read
+_SQLITE_HEADER = b"SQLite format 3\x00"
+# protocol 2 and higher, the protocols used by pandas
+_PICKLE_HEADERS = [bytes([0x80, protocol]) for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1)]
+
+
+def _is_uuid(name: str) -> bool:
+    try:
+        UUID(name)
+    except ValueError:
+        return False
+    return True
+
+
+def _get_file_type(path: Path, in_cache: bool) -> str:
+    if in_cache:
+        return "cache"
+
+    name = path.name
+    if name.endswith(".mmap"):
+        return "memmap"
+    if name.endswith((".hdf5", ".h5")):
+        return "hdf5"
+    if name.endswith(("_projection.npy", "_cn.npy")):
+        return "projections"
+    if name.endswith("_shifts.npy"):
+        return "shifts"
+
+    return "other"
+
+
+def _scan(path: Path, exclude: Optional[Callable[[Path], bool]] = None) -> Tuple[Dict[str, int], float]:
+    """
+    bytes used by each file type within a file or dir, and the time it was last modified.
+    Files within the dir for which ``exclude`` returns ``True`` are not counted.
+    """
+    sizes = {t: 0 for t in FILE_TYPES}
+    last_modified = 0.0
+
+    if path.is_file():
+        stat = path.stat()
+        sizes[_get_file_type(path, in_cache=False)] += stat.st_size
+        return sizes, stat.st_mtime
+
+    for root, dirs, files in os.walk(path):
+        root = Path(root)
+        in_cache = "cache" in root.relative_to(path).parts
+        for name in files:
+            file_path = root.joinpath(name)
+            if exclude is not None and exclude(file_path):
+                continue
+            try:
+                stat = file_path.stat()
+            except FileNotFoundError:
+                # removed while scanning
+                continue
+            sizes[_get_file_type(file_path, in_cache)] += stat.st_size
+            last_modified = max(last_modified, stat.st_mtime)
+
+    return sizes, last_modified
+
+
+def _is_kept_file(batch_path: Path, u: str, path: Path) -> bool:
+    """files in the output dir of a failed item that are kept, the results with the traceback and the slurm logs"""
+    if path == get_results_path(batch_path, u):
+        return True
+
+    return path.parent == batch_path.parent.joinpath(u) and _SLURM_LOG_PATTERN.match(path.name) is not None
+
+
+def _is_batch_file(path: Path) -> bool:
+    """if ``get_storage()`` would read the file as a batch, checked from the first bytes of the file"""
+    try:
+        with open(path, "rb") as f:
+            header = f.read(len(_SQLITE_HEADER))
+    except OSError:
+        return False
+
+    if path.suffix in SQLITE_EXTENSIONS:
+        return header == _SQLITE_HEADER
+
+    return header[:2] in _PICKLE_HEADERS
+
+
+def get_other_batch_uuids(batch_path: Path) -> Set[str]:
+    """
+    uuids of the items of the other batch files in the batch dir, their output dirs are not orphaned.
+    Contains ``None`` if a file that looks like a batch file could not be read.
+    """
+    uuids = set()
+    for path in batch_path.parent.iterdir():
+        if path == batch_path or not path.is_file() or not _is_batch_file(path):
+            continue
+        try:
+            df = get_storage(path).read(columns=["uuid"], lazy=True)
+            uuids.update(df["uuid"])
+        except Exception as e:
+            warnings.warn(f"Could not read the items of the batch file, no output dirs are considered orphaned: {path}\n{e}")
+            uuids.add(None)
+
+    return uuids
+
+
+def _scan_slurm_dir(
+        path: Path,
+        uuids: Collection[str],
+        success: Dict[str, Optional[bool]],
+        other_uuids: Set[Optional[str]],
+) -> List[Tuple[str, Optional[str], Optional[str]]]:
+    """
+    entries of the job scripts made by ``run_array()``, a script is only needed until all of its items finished.
+    Other files in the dir are counted but never orphaned.
+    """
+    entries = list()
+    for file_path in path.iterdir():
+        if not file_path.is_file():
+            continue
+
+        name = f"{SLURM_DIR}/{file_path.name}"
+        if file_path.suffix != ".sbatch":
+            entries.append((name, None, None))
+            continue
+
+        try:
+            items = [m["uuid"] for m in _SBATCH_RUNFILE_PATTERN.finditer(file_path.read_text())]
+        except (OSError, UnicodeDecodeError):
+            continue
+
+        if any(u in other_uuids for u in items):
+            # job of another batch in the same dir
+            continue
+
+        finished = all(
+            (u not in uuids and None not in other_uuids) or success.get(u) is not None for u in items
+        )
+        entries.append((name, None, REASON_RUNFILE if finished else None))
+
+    return entries
+
+
+def scan_batch_dir(
+        batch_path: Path,
+        items: pd.DataFrame,
+        other_uuids: Set[Optional[str]],
+        max_workers: int = 8
+) -> pd.DataFrame:
+    """
+    Disk usage of the batch items and of the files that no longer belong to any item.
+
+    Only files created by mesmerize are considered, i.e. item output dirs, runfiles, the job scripts of the
+    ``"slurm"`` backend and temp files of the batch file. Other files in the batch dir, the batch file itself, its
+    lock file and SQLite journal files are never reported as orphaned. The results and slurm logs of failed items
+    are kept.
+
+    Parameters
+    ----------
+    batch_path: Path
+        batch file
+
+    items: pd.DataFrame
+        ``"uuid"``, ``"item_name"`` and ``"outputs"`` of all items in the batch
+
+    other_uuids: set of str
+        | uuids of the items of other batch files in the same dir, returned by ``get_other_batch_uuids()``
+        | if it contains ``None`` another batch file could not be read and output dirs are never orphaned
+
+    max_workers: int
+        number of threads used to scan the batch dir
+
+    """
+    batch_dir = batch_path.parent
+
+    item_names = dict(zip(items["uuid"], items["item_name"]))
+    # None if not run yet or running, True or False if the item finished
+    success = {
+        u: None if outputs is None else bool(outputs["success"])
+        for u, outputs in zip(items["uuid"], items["outputs"])
+    }
+
+    # (relative path, uuid, reason if orphaned)
+    entries: List[Tuple[str, Optional[str], Optional[str]]] = list()
+    output_dirs = set()
+    for entry in os.scandir(batch_dir):
+        name = entry.name
+        path = Path(entry.path)
+
+        if path.stem in other_uuids:
+            # belongs to another batch in the same dir
+            continue
+
+        if entry.is_dir() and name == SLURM_DIR:
+            entries.extend(_scan_slurm_dir(path, item_names.keys(), success, other_uuids))
+
+        elif entry.is_dir() and _is_uuid(name):
+            output_dirs.add(name)
+            if name not in item_names.keys():
+                entries.append((name, name, None if None in other_uuids else REASON_REMOVED_ITEM))
+            elif success[name] is False:
+                # the results with the traceback are kept
+                entries.append((name, name, REASON_FAILED_RUN))
+            else:
+                entries.append((name, name, None))
+
+        elif entry.is_file() and path.suffix in RUNFILE_EXTENSIONS and _is_uuid(path.stem):
+            u = path.stem
+            # the runfile is only needed while the item is running
+            finished = (u not in item_names.keys() and None not in other_uuids) or success.get(u) is not None
+            entries.append((name, u, REASON_RUNFILE if finished else None))
+
+        elif entry.is_file() and _TMP_FILE_PATTERN.match(name) is not None:
+            match = _TMP_FILE_PATTERN.match(name)
+            if match["name"] == batch_path.name and not psutil.pid_exists(int(match["pid"])):
+                # left by a process that was killed while writing the batch file
+                entries.append((name, None, REASON_TMP_FILE))
+
+    def scan(entry) -> Tuple[Dict[str, int], float]:
+        name, u, reason = entry
+        exclude = partial(_is_kept_file, batch_path, u) if reason == REASON_FAILED_RUN else None
+        return _scan(batch_dir.joinpath(name), exclude=exclude)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        scans = list(executor.map(scan, entries))
+
+    rows = list()
+    for (name, u, reason), (sizes, last_modified) in zip(entries, scans):
+        rows.append(
+            {
+                "path": name,
+                "uuid": u,
+                "item_name": item_names.get(u),
+                "orphaned": reason is not None,
+                "reason": reason,
+                "last_modified": last_modified,
+                **sizes,
+                "total": sum(sizes.values()),
+            }
+        )
+
+    # items that have no output dir
+    for u in items["uuid"]:
+        if u not in output_dirs:
+            rows.append(
+                {
+                    "path": None,
+                    "uuid": u,
+                    "item_name": item_names[u],
+                    "orphaned": False,
+                    "reason": None,
+                    "last_modified": None,
+                    **{t: 0 for t in FILE_TYPES},
+                    "total": 0,
+                }
+            )
+
+    return pd.DataFrame(rows, columns=DISK_USAGE_COLUMNS)
+
+
+def _remove_entry(batch_path: Path, row: pd.Series):
+    path = batch_path.parent.joinpath(row["path"])
+
+    if path.is_file():
+        os.remove(path)
+        return
+
+    if row["reason"] != REASON_FAILED_RUN:
+        rmtree(path, ignore_errors=True)
+        return
+
+    # output dir of a failed item, keep the results and logs
+    for child in path.iterdir():
+        if _is_kept_file(batch_path, row["uuid"], child):
+            continue
+        if child.is_dir():
+            rmtree(child, ignore_errors=True)
+        else:
+            os.remove(child)
+
+
+def remove_garbage(
+        batch_path: Path,
+        usage: pd.DataFrame,
+        min_age: float = 3600,
+        dry_run: bool = False,
+        max_workers: int = 8,
+) -> pd.DataFrame:
+    """
+    remove the orphaned entries of ``usage`` returned by ``scan_batch_dir()`` that were not modified
+    in the last ``min_age`` seconds, returns the rows of the removed entries
+    """
+    orphans = usage.loc[
+        usage["orphaned"]
+        & (usage["last_modified"].fillna(0).astype(float) < time.time() - min_age)
+        # output dirs of failed items that only contain the results
+        & ((usage["reason"] != REASON_FAILED_RUN) | (usage["total"] > 0))
+    ]
+
+    if not dry_run:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(lambda r: _remove_entry(batch_path, r[1]), orphans.iterrows()))
+
+    return orphans.reset_index(drop=True)
@@ -2,8 +2,11 @@ from functools import wraps
 from typing import Union
 from uuid import UUID
 
+import pandas as pd
+
 from mesmerize_core.caiman_extensions._batch_exceptions import BatchItemNotRunError, BatchItemUnsuccessfulError, \
     WrongAlgorithmExtensionError
+from mesmerize_core.batch_storage import _get_uuid_position, _build_uuid_index, _add_to_uuid_index
 
 
 def validate(algo: str = None):
@@ -38,12 +41,11 @@ def _index_parser(func):
             index = args[0]  # always first positional arg
 
         if isinstance(index, (UUID, str)):
-            _index = instance._df[instance._df["uuid"] == str(index)].index
-            if _index.size == 0:
+            try:
+                index = _get_uuid_position(instance._df, index)
+            except KeyError:
                 raise ValueError(f"No batch item found with uuid: {index}")
 
-            index = _index.item()
-
         if not isinstance(index, int):
             raise TypeError(f"`index` argument must be of type `int`, `str`, or `UUID`")
 
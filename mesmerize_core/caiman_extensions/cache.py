@@ -1,59 +1,896 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+import warnings
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from collections import OrderedDict
 from functools import wraps
-from typing import Union, Optional
+from inspect import signature
+from pathlib import Path
+from types import ModuleType, FunctionType, MethodType
+from typing import Union, Optional, Any, Hashable, Tuple, List, Callable, NamedTuple
 
 import pandas as pd
 import time
 import numpy as np
 import sys
-from caiman.source_extraction.cnmf import CNMF
-import re
-from sys import getsizeof
 import copy
+from tqdm import tqdm
 
+from ..utils import MESMERIZE_LRU_CACHE, MESMERIZE_CACHE_CONFIG
 
-def _check_arg_equality(args, cache_args):
-    if not type(args) == type(cache_args):
-        return False
-    if isinstance(cache_args, np.ndarray):
-        return np.array_equal(cache_args, args)
-    else:
-        return cache_args == args
 
+logger = logging.getLogger(__name__)
 
-def _check_args_equality(args, cache_args):
-    if len(args) != len(cache_args):
-        return False
-    equality = list()
-    if isinstance(args, tuple):
-        for arg, cache_arg in zip(args, cache_args):
-            equality.append(_check_arg_equality(arg, cache_arg))
-    else:
-        for k in args.keys():
-            equality.append(_check_arg_equality(args[k], cache_args[k]))
-    return all(equality)
-
-
-def _return_wrapper(output, copy_bool):
-    if copy_bool == True:
-        return copy.deepcopy(output)
-    else:
+
+class _Uncacheable(Exception):
+    """raised when the arguments of a call cannot be turned into a cache key"""
+    pass
+
+
+class _ArrayDigest(NamedTuple):
+    """stands in for an array argument in cache keys and entries, so that the cache does not keep the array alive"""
+    shape: tuple
+    dtype: str
+    digest: str
+
+    def __repr__(self):
+        return f"<ndarray shape={self.shape} dtype={self.dtype} digest={self.digest}>"
+
+
+def _digest_array(arr: np.ndarray) -> _ArrayDigest:
+    """
+    Fast content digest of an array, two arrays with the same shape, dtype and contents get the same digest.
+    """
+    if arr.dtype.hasobject:
+        # the buffer of an object array only holds pointers
+        raise _Uncacheable("arrays with dtype object cannot be used as cache keys")
+
+    h = hashlib.blake2b(digest_size=16)
+    h.update(np.ascontiguousarray(arr).data)
+
+    return _ArrayDigest(arr.shape, arr.dtype.str, h.hexdigest())
+
+
+def _normalize_arg(arg) -> Hashable:
+    """
+    Return a hashable representation of a function argument that compares equal
+    for equal arguments, the type is kept so that ``1``, ``1.0`` and ``True`` are different keys.
+    Arrays are represented by a digest of their contents, lookups never compare arrays element-wise.
+    """
+    if isinstance(arg, np.ndarray):
+        return np.ndarray, _digest_array(arg)
+
+    if isinstance(arg, (list, tuple)):
+        return type(arg), tuple(_normalize_arg(a) for a in arg)
+
+    if isinstance(arg, dict):
+        return dict, tuple(sorted(((k, _normalize_arg(v)) for k, v in arg.items()), key=repr))
+
+    if isinstance(arg, (set, frozenset)):
+        return type(arg), frozenset(_normalize_arg(a) for a in arg)
+
+    try:
+        hash(arg)
+    except TypeError:
+        raise _Uncacheable(f"argument of type {type(arg)} is not hashable")
+
+    return type(arg), arg
+
+
+def _strip_arrays(arg):
+    """
+    Replace arrays in a function argument with their digest,
+    this is what is stored in ``_CacheEntry.args`` and ``_CacheEntry.kwargs``.
+    """
+    if isinstance(arg, np.ndarray):
+        return _digest_array(arg)
+
+    if type(arg) in (list, tuple):
+        return type(arg)(_strip_arrays(a) for a in arg)
+
+    if isinstance(arg, dict):
+        return {k: _strip_arrays(v) for k, v in arg.items()}
+
+    return arg
+
+
+def _stable_key(arg):
+    """
+    Replace frozensets in a normalized argument with sorted tuples, the pickle of a frozenset of strings depends on
+    the order of iteration which changes between processes with ``PYTHONHASHSEED``.
+    """
+    if isinstance(arg, frozenset):
+        return frozenset, tuple(sorted((_stable_key(a) for a in arg), key=repr))
+
+    if type(arg) is tuple:
+        return tuple(_stable_key(a) for a in arg)
+
+    return arg
+
+
+def _get_nbytes(obj, _seen: set = None) -> int:
+    """
+    Deep memory footprint of an object in bytes.
+
+    Counts the buffers of numpy arrays, the ``data``, ``indices`` and ``indptr`` arrays of
+    ``scipy.sparse`` matrices, nested containers, and the attributes of objects such as ``CNMF``
+    and its ``Estimates``. Objects that are referenced more than once are only counted once.
+    ``np.memmap`` arrays are backed by a file and their buffers are not counted.
+    """
+    if _seen is None:
+        _seen = set()
+
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+
+    if isinstance(obj, np.memmap):
+        return 0
+
+    if isinstance(obj, np.ndarray):
+        if obj.base is not None:
+            # view, it keeps the object that owns the memory alive
+            return _get_nbytes(obj.base, _seen)
+        return obj.nbytes
+
+    if isinstance(obj, (str, bytes, bytearray, int, float, complex, bool, type(None))):
+        return sys.getsizeof(obj)
+
+    if isinstance(obj, (type, ModuleType, FunctionType, MethodType)):
+        return 0
+
+    size = sys.getsizeof(obj)
+
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += _get_nbytes(k, _seen) + _get_nbytes(v, _seen)
+
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for v in obj:
+            size += _get_nbytes(v, _seen)
+
+    elif hasattr(obj, "__dict__"):
+        # CNMF, Estimates, CNMFParams, scipy.sparse matrices, LazyArrays etc.
+        size += _get_nbytes(vars(obj), _seen)
+
+    return size
+
+
+COPY_MODES = ["copy", "readonly"]
+
+
+def _readonly(output):
+    """
+    Read-only views of arrays, lists and tuples are returned as new lists and tuples of read-only views.
+    Objects that cannot be made read-only are deep copied.
+    """
+    if isinstance(output, np.ndarray):
+        view = output.view()
+        view.flags.writeable = False
+        return view
+
+    if isinstance(output, list):
+        return [_readonly(o) for o in output]
+
+    if isinstance(output, tuple):
+        return tuple(_readonly(o) for o in output)
+
+    if isinstance(output, (str, bytes, int, float, complex, bool, np.generic, type(None))):
         return output
 
+    return copy.deepcopy(output)
+
+
+def _return_wrapper(output, copy_bool: Union[bool, str], copy_mode: str = "copy"):
+    """
+    Parameters
+    ----------
+    copy_bool: bool or str
+        ``True`` to return according to ``copy_mode``, ``False`` to return the cached object itself,
+        or ``"copy"`` or ``"readonly"`` to override ``copy_mode``. Values such as ``1`` or ``np.bool_``
+        are treated as bools.
+
+    copy_mode: str
+        ``"copy"`` returns a deep copy, ``"readonly"`` returns read-only views where possible
+    """
+    if not isinstance(copy_bool, str):
+        if not bool(copy_bool):
+            return output
+        copy_bool = copy_mode
+
+    if copy_bool == "readonly":
+        return _readonly(output)
+
+    elif copy_bool == "copy":
+        return copy.deepcopy(output)
+
+    raise ValueError(f"`return_copy` must be a `bool` or one of: {COPY_MODES}, you have passed: {copy_bool}")
+
+
+def _parse_size(max_size: Union[int, str]) -> int:
+    """``"10G"``, ``"500M"`` or a number of bytes"""
+    if isinstance(max_size, str):
+        if max_size.endswith("G"):
+            return int(max_size[:-1]) * 1024**3
+        elif max_size.endswith("M"):
+            return int(max_size[:-1]) * 1024**2
+        return int(max_size)
+    return int(max_size)
+
+
+class DiskCache:
+    """
+    Persistent second tier for cached values, stored in a ``cache`` dir within each batch item's output dir,
+    i.e. ``<batch_dir>/<uuid>/cache/``.
+
+    Only numpy arrays and sequences of lists of arrays (such as contours and centers of mass) are stored,
+    arrays are saved as ``.npy`` files and sequences of lists of arrays are concatenated and saved as
+    ``.npz`` files. Keys include the modification time and size of the item's output file so that entries
+    become stale when the output file is rewritten.
+
+    Files are evicted in least recently used order when the total size of a batch dir's disk cache
+    exceeds ``max_size``. Each process keeps its own index of the files, which is built the first time a batch
+    dir is used, so the limit is approximate if several processes write to the same batch at the same time.
+    """
+
+    def __init__(self, max_size: Union[int, str] = "10G"):
+        self.set_maxsize(max_size)
+        # batch dir -> OrderedDict[path, nbytes], least recently used first
+        self._indices: dict = dict()
+        # guards the indices, file reads and writes are done outside of the lock
+        self._lock = threading.RLock()
+
+    def set_maxsize(self, max_size: Union[int, str]):
+        """
+        Parameters
+        ----------
+        max_size: int or str
+            number of bytes, or a str such as ``"10G"`` or ``"500M"``
+        """
+        self.size = _parse_size(max_size)
+
+    def _get_index(self, batch_dir: Path) -> OrderedDict:
+        """must be called with the lock held"""
+        if batch_dir not in self._indices.keys():
+            files = list()
+            for path in batch_dir.glob("*/cache/*.np[yz]"):
+                try:
+                    st = path.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, path, st.st_size))
+            self._indices[batch_dir] = OrderedDict((p, n) for _, p, n in sorted(files))
+        return self._indices[batch_dir]
+
+    @staticmethod
+    def get_key(instance, key: tuple) -> Optional[str]:
+        """
+        Digest of a cache key and the state of the item's output file, ``None`` if the item has no output file.
+        The digest is the same in every process.
+        """
+        if instance._series.get("outputs") is None:
+            return None
+
+        try:
+            stat = os.stat(instance.get_output_path())
+        except (AttributeError, TypeError, KeyError, FileNotFoundError):
+            return None
+
+        digest = hashlib.sha1(
+            pickle.dumps((_stable_key(key[1:]), stat.st_mtime_ns, stat.st_size), protocol=4)
+        ).hexdigest()
+
+        return f"{key[1]}-{digest}"
+
+    @staticmethod
+    def _get_cache_dir(instance) -> Path:
+        return instance._series.paths.get_batch_path().parent.joinpath(instance._series["uuid"], "cache")
+
+    def load(self, instance, disk_key: str) -> Tuple[bool, Any]:
+        """
+        Returns
+        -------
+        Tuple[bool, Any]
+            (found, value)
+        """
+        cache_dir = self._get_cache_dir(instance)
+
+        for ext in [".npy", ".npz"]:
+            path = cache_dir.joinpath(disk_key + ext)
+            try:
+                if ext == ".npy":
+                    value = np.load(path, allow_pickle=False)
+                else:
+                    value = self._decode_sequence(path)
+            except FileNotFoundError:
+                continue
+
+            # update access time so that LRU order is kept across processes
+            try:
+                os.utime(path)
+                nbytes = path.stat().st_size
+            except FileNotFoundError:
+                # evicted by another thread or process after it was read
+                return True, value
+
+            with self._lock:
+                index = self._get_index(cache_dir.parent.parent)
+                if path in index.keys():
+                    index.move_to_end(path)
+                else:
+                    index[path] = nbytes
+            return True, value
+
+        return False, None
+
+    def save(self, instance, disk_key: str, value: Any):
+        """
+        Store a value, errors such as a full disk only raise a warning since the disk cache is only an optimization.
+        """
+        if isinstance(value, np.ndarray) and value.dtype != object:
+            ext = ".npy"
+        elif self._is_sequence_of_arrays(value):
+            ext = ".npz"
+        else:
+            # not something that can be stored efficiently
+            return
+
+        if _get_nbytes(value) > self.size:
+            return
+
+        cache_dir = self._get_cache_dir(instance)
+        if not cache_dir.parent.is_dir():
+            return
+
+        path = cache_dir.joinpath(disk_key + ext)
+        tmp_path = path.with_name(path.name + f".{os.getpid()}-{threading.get_ident()}.tmp")
+
+        try:
+            cache_dir.mkdir(exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                if ext == ".npy":
+                    np.save(f, value, allow_pickle=False)
+                else:
+                    np.savez(f, **self._encode_sequence(value))
+            os.replace(tmp_path, path)
+            nbytes = path.stat().st_size
+        except OSError as e:
+            warnings.warn(f"Could not write to the disk cache, the value is not stored on disk: {e}")
+            try:
+                tmp_path.unlink()
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            index = self._get_index(cache_dir.parent.parent)
+            index[path] = nbytes
+            self._evict(index)
+
+    def _evict(self, index: OrderedDict):
+        """must be called with the lock held"""
+        total = sum(index.values())
+        while total > self.size and len(index) > 0:
+            path, nbytes = index.popitem(last=False)
+            total -= nbytes
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def invalidate(self, instance):
+        """remove all disk cache entries of a batch item"""
+        cache_dir = self._get_cache_dir(instance)
+
+        with self._lock:
+            index = self._get_index(cache_dir.parent.parent)
+            for path in list(cache_dir.glob("*.np[yz]")):
+                index.pop(path, None)
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def clear(self, batch_dir: Union[str, Path]):
+        """remove all disk cache entries of all batch items in a batch dir"""
+        batch_dir = Path(batch_dir)
+        with self._lock:
+            for path in batch_dir.glob("*/cache/*.np[yz]"):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            self._indices.pop(batch_dir, None)
+
+    @staticmethod
+    def _is_sequence_of_arrays(value) -> bool:
+        if not isinstance(value, (tuple, list)):
+            return False
+
+        for seq in value:
+            if not isinstance(seq, list):
+                return False
+            if len(seq) == 0:
+                continue
+            if not all(isinstance(a, np.ndarray) and a.ndim > 0 for a in seq):
+                return False
+            # must be able to concatenate along the first axis
+            if len({(a.dtype.str, a.shape[1:]) for a in seq}) != 1:
+                return False
+
+        return True
+
+    @staticmethod
+    def _encode_sequence(value) -> dict:
+        d = {"container": np.array(type(value).__name__)}
+        for i, seq in enumerate(value):
+            d[f"{i}_lengths"] = np.array([a.shape[0] for a in seq], dtype=np.int64)
+            if len(seq) > 0:
+                d[f"{i}_data"] = np.concatenate(seq, axis=0)
+                d[f"{i}_shape"] = np.array(seq[0].shape[1:], dtype=np.int64)
+        return d
+
+    @staticmethod
+    def _decode_sequence(path: Path) -> Union[tuple, list]:
+        with np.load(path, allow_pickle=False) as npz:
+            out = list()
+            i = 0
+            while f"{i}_lengths" in npz.files:
+                lengths = npz[f"{i}_lengths"]
+                if lengths.size == 0:
+                    out.append(list())
+                else:
+                    data = npz[f"{i}_data"]
+                    out.append(np.split(data, np.cumsum(lengths)[:-1], axis=0))
+                i += 1
+
+            if str(npz["container"]) == "tuple":
+                return tuple(out)
+            return out
+
+
+class _FunctionStats:
+    """counters and timings for one decorated function"""
+
+    # upper edges of the compute time histogram bins, in seconds
+    histogram_bins = [0.001, 0.01, 0.1, 1.0, 10.0, 60.0, np.inf]
+    histogram_labels = ["<1ms", "<10ms", "<100ms", "<1s", "<10s", "<1min", ">=1min"]
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        # misses that waited for the same value being computed by another thread
+        self.coalesced = 0
+        self.hit_time = 0.0
+        self.miss_time = 0.0
+        self.miss_time_histogram = np.zeros(len(self.histogram_bins), dtype=np.int64)
+        # reason -> count
+        self.evictions: dict = dict()
+
+    def add_miss(self, duration: float):
+        self.misses += 1
+        self.miss_time += duration
+        self.miss_time_histogram[np.searchsorted(self.histogram_bins, duration)] += 1
+
+    def add_eviction(self, reason: str):
+        self.evictions[reason] = self.evictions.get(reason, 0) + 1
+
+
+class _FunctionPolicy:
+    """limits for the entries of one decorated function, ``None`` means no limit"""
+
+    def __init__(
+            self,
+            max_size: Optional[Union[int, str]] = None,
+            max_items: Optional[int] = None,
+            ttl: Optional[float] = None
+    ):
+        self.max_bytes = None if max_size is None else _parse_size(max_size)
+        self.max_items = max_items
+        self.ttl = ttl
+
+    def to_dict(self) -> dict:
+        return {"max_size": self.max_bytes, "max_items": self.max_items, "ttl": self.ttl}
+
+
+def get_cache_config() -> dict:
+    """
+    Get the default cache configuration.
+
+    The JSON file at the path set by the ``MESMERIZE_CACHE_CONFIG`` environment variable is read if it exists,
+    and the ``MESMERIZE_LRU_CACHE`` environment variable overrides its ``"max_size"``. A warning is raised if the
+    file does not exist or is not valid JSON.
+
+    Example config file:
+
+    .. code-block:: json
+
+        {
+            "max_size": "2G",
+            "copy_mode": "readonly",
+            "disk_cache": "20G",
+            "functions": {
+                "get_output": {"max_size": "1G", "max_items": 4},
+                "get_rcm": {"ttl": 600}
+            }
+        }
+
+    Returns
+    -------
+    dict
+        config that can be passed to ``Cache.configure()``
+    """
+    config = dict()
+
+    if MESMERIZE_CACHE_CONFIG is not None:
+        if not Path(MESMERIZE_CACHE_CONFIG).is_file():
+            warnings.warn(f"Cache config file does not exist, it is ignored: {MESMERIZE_CACHE_CONFIG}")
+        else:
+            try:
+                with open(MESMERIZE_CACHE_CONFIG, "r") as f:
+                    config = json.load(f)
+                if not isinstance(config, dict):
+                    raise ValueError("the config must be a JSON object")
+            except (OSError, ValueError) as e:
+                warnings.warn(f"Could not read the cache config file, it is ignored: {MESMERIZE_CACHE_CONFIG}\n{e}")
+                config = dict()
+
+    if MESMERIZE_LRU_CACHE is not None:
+        config["max_size"] = MESMERIZE_LRU_CACHE
+
+    return config
+
+
+class _CacheEntry:
+    __slots__ = ["uuid", "function", "args", "kwargs", "return_val", "time_stamp", "nbytes", "inserted", "pinned"]
+
+    def __init__(self, uuid: str, function: str, args: tuple, kwargs: dict, return_val: Any):
+        self.uuid = uuid
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.return_val = return_val
+        self.time_stamp = time.time()
+        # time_stamp is updated on every access, the TTL is relative to insertion
+        self.inserted = self.time_stamp
+        # measured once, entries are never modified after they are inserted
+        self.nbytes = _get_nbytes(return_val)
+        self.pinned = False
+
 
 class Cache:
+    """
+    LRU cache for the outputs of extension methods.
+
+    Entries are stored in an ``OrderedDict`` keyed by ``(uuid, function name, normalized arguments)``,
+    ordered from least recently used to most recently used, so that lookups, inserts and
+    evictions are all ``O(1)``. A secondary ``uuid -> keys`` index is used to invalidate all the
+    entries of a batch item.
+
+    The deep size of each entry is measured once when it is inserted and a running total is kept,
+    in ``"RAM"`` mode least recently used entries are evicted until the total is within the limit.
+
+    An optional :class:`DiskCache` can be enabled with ``set_disk_cache()``, it is checked on a RAM miss
+    before the value is recomputed.
+
+    Cached values are returned as deep copies, as read-only views, or as the cached object itself depending
+    on the ``return_copy`` kwarg of the decorated function and the cache's ``copy_mode``, see ``set_copy_mode()``.
+
+    The cache is safe to use from multiple threads. A lock guards the entries and is never held while a value
+    is computed or copied. Concurrent misses on the same key are coalesced, the value is computed
+    once and the other callers wait for the result.
+
+    Hit, miss and eviction counters as well as timings are collected for each decorated function,
+    see ``get_stats()`` and ``get_item_stats()``.
+
+    Each decorated function can have its own byte and item limits and a TTL, see ``set_function_policy()``,
+    and the entries of batch items can be pinned so that they are never evicted, see ``pin()``.
+    All of these can be changed at runtime without losing the current entries, and defaults can be set with
+    environment variables or a config file, see ``configure()`` and :func:`get_cache_config`.
+    """
+
+    _columns = ["uuid", "function", "args", "kwargs", "return_val", "time_stamp", "nbytes"]
+
     def __init__(self, cache_size: Optional[Union[int, str]] = None):
-        self.cache = pd.DataFrame(
-            data=None,
-            columns=["uuid", "function", "args", "kwargs", "return_val", "time_stamp"],
-        )
+        self._entries: "OrderedDict[tuple, _CacheEntry]" = OrderedDict()
+        self._uuid_keys: dict = dict()
+        self._nbytes: int = 0
+        # function name -> OrderedDict of keys in LRU order, and function name -> bytes
+        self._function_keys: dict = dict()
+        self._function_nbytes: dict = dict()
+        # function name -> _FunctionPolicy
+        self._policies: dict = dict()
+        # set of (uuid, function name or None for all functions)
+        self._pins: set = set()
+        self._lock = threading.RLock()
+        # key -> Future for values that are currently being computed
+        self._in_flight: "dict[tuple, Future]" = dict()
+        # incremented when entries are invalidated, values computed before invalidation are not stored
+        self._generations: dict = dict()
+        self._clear_count: int = 0
+        # function name -> _FunctionStats
+        self._stats: dict = dict()
+        self._stats_logging_stop: Optional[threading.Event] = None
+        self.disk_cache: Optional[DiskCache] = None
+        self.copy_mode: str = "copy"
         self.set_maxsize(cache_size)
 
-    def get_cache(self):
-        return self.cache
+    def get_cache(self) -> pd.DataFrame:
+        """
+        Get the current cache entries, from least recently used to most recently used.
+
+        Returns
+        -------
+        pd.DataFrame
+            DataFrame view of the cache for introspection, modifying it does not modify the cache.
+        """
+        with self._lock:
+            data = [[getattr(e, c) for c in self._columns] for e in self._entries.values()]
+
+        return pd.DataFrame(data=data, columns=self._columns)
 
     def clear_cache(self):
-        while len(self.cache.index) != 0:
-            self.cache.drop(index=self.cache.index[-1], axis=0, inplace=True)
+        with self._lock:
+            for entry in self._entries.values():
+                self._get_stats(entry.function).add_eviction("cleared")
+            self._entries.clear()
+            self._uuid_keys.clear()
+            self._function_keys.clear()
+            self._function_nbytes.clear()
+            self._nbytes = 0
+            self._clear_count += 1
+
+    def configure(self, config: dict):
+        """
+        Apply a cache configuration, current entries are kept and only evicted if they exceed the new limits.
+
+        Parameters
+        ----------
+        config: dict
+            | ``"max_size"``: passed to ``set_maxsize()``
+            | ``"copy_mode"``: passed to ``set_copy_mode()``
+            | ``"disk_cache"``: max size passed to ``set_disk_cache()``, ``None`` disables the disk cache
+            | ``"functions"``: dict of function name -> kwargs for ``set_function_policy()``
+
+            keys that are not present are not changed, see :func:`get_cache_config` for an example.
+        """
+        valid = ["max_size", "copy_mode", "disk_cache", "functions"]
+        for k in config.keys():
+            if k not in valid:
+                raise KeyError(f"Invalid cache config key: `{k}`, valid keys are: {valid}")
+
+        if "max_size" in config.keys():
+            self.set_maxsize(config["max_size"])
+
+        if "copy_mode" in config.keys():
+            self.set_copy_mode(config["copy_mode"])
+
+        if "disk_cache" in config.keys():
+            self.set_disk_cache(config["disk_cache"])
+
+        for function, policy in config.get("functions", dict()).items():
+            self.set_function_policy(function, **policy)
+
+    def set_function_policy(
+            self,
+            function: str,
+            max_size: Optional[Union[int, str]] = None,
+            max_items: Optional[int] = None,
+            ttl: Optional[float] = None,
+    ):
+        """
+        Set limits for the entries of one decorated function, in addition to the limit of the whole cache.
+        For example limit the number of full ``CNMF`` objects from ``get_output`` so that they cannot evict all
+        the small and frequently used results of other functions.
+
+        Parameters
+        ----------
+        function: str
+            name of the decorated function, such as ``"get_output"`` or ``"get_contours"``
+
+        max_size: int, str or None
+            max bytes held by this function's entries, number of bytes or a str such as ``"500M"``
+
+        max_items: int or None
+            max number of entries for this function
+
+        ttl: float or None
+            seconds after which an entry of this function expires
+        """
+        with self._lock:
+            if max_size is None and max_items is None and ttl is None:
+                self._policies.pop(function, None)
+            else:
+                self._policies[function] = _FunctionPolicy(max_size, max_items, ttl)
+                self._evict_function(function)
+
+    def get_policies(self) -> pd.DataFrame:
+        """
+        Returns
+        -------
+        pd.DataFrame
+            the per-function policies, columns are ``"function"``, ``"max_size"`` in bytes, ``"max_items"``, ``"ttl"``
+        """
+        with self._lock:
+            rows = [{"function": f, **p.to_dict()} for f, p in self._policies.items()]
+        return pd.DataFrame(rows, columns=["function", "max_size", "max_items", "ttl"])
+
+    def pin(self, uuid: str, function: Optional[str] = None):
+        """
+        Pin the entries of a batch item so that they are never evicted by the size limits or TTLs.
+        They are still removed when the batch item is invalidated or the cache is cleared.
+
+        Parameters
+        ----------
+        uuid: str
+            batch item UUID
+
+        function: str, optional
+            only pin the entries of this function, all functions if ``None``
+        """
+        with self._lock:
+            self._pins.add((str(uuid), function))
+            self._update_pins(str(uuid))
+
+    def unpin(self, uuid: str, function: Optional[str] = None):
+        """undo ``pin()`` with the same arguments"""
+        with self._lock:
+            self._pins.discard((str(uuid), function))
+            self._update_pins(str(uuid))
+            self._evict()
+            for f in list(self._function_keys.keys()):
+                self._evict_function(f)
+
+    def _is_pinned(self, uuid: str, function: str) -> bool:
+        return (uuid, None) in self._pins or (uuid, function) in self._pins
+
+    def _update_pins(self, uuid: str):
+        """must be called with the lock held"""
+        for key in self._uuid_keys.get(uuid, ()):
+            entry = self._entries[key]
+            entry.pinned = self._is_pinned(uuid, entry.function)
+
+    def _get_stats(self, function: str) -> _FunctionStats:
+        """must be called with the lock held"""
+        if function not in self._stats.keys():
+            self._stats[function] = _FunctionStats()
+        return self._stats[function]
+
+    def get_stats(self) -> pd.DataFrame:
+        """
+        Get cache statistics for each decorated function.
+
+        Returns
+        -------
+        pd.DataFrame
+            one row per function with the following columns:
+
+            =====================   ================================================================
+            column                  details
+            =====================   ================================================================
+            function                name of the decorated function
+            hits                    calls that returned a value from the RAM cache
+            misses                  calls whose value had to be computed
+            disk_hits               RAM misses that returned a value from the disk cache
+            coalesced               misses that waited for another thread computing the same value
+            hit_rate                hits / all calls
+            mean_hit_time           mean time to return a cached value, including copying, in seconds
+            mean_miss_time          mean time to compute a value, in seconds
+            time_saved              estimated seconds saved by the cache, ``hits * mean_miss_time``
+            miss_time_histogram     dict of compute time bin -> count
+            evictions               dict of eviction reason -> count
+            n_entries               number of entries currently in the cache
+            nbytes                  bytes currently held in the cache
+            =====================   ================================================================
+
+            eviction reasons are ``"lru"``, the size limit was reached, ``"function_limit"``, a function's
+            policy limit was reached, ``"ttl"``, ``"invalidated"``, ``"cleared"``, and ``"oversize"`` for values
+            that were too large to be stored at all.
+        """
+        with self._lock:
+            current = {f: [0, 0] for f in self._stats.keys()}
+            for entry in self._entries.values():
+                # entries can outlive their stats, see ``reset_stats()``
+                counts = current.setdefault(entry.function, [0, 0])
+                counts[0] += 1
+                counts[1] += entry.nbytes
+
+            rows = list()
+            for function in current.keys():
+                stats = self._stats.get(function, _FunctionStats())
+                n_calls = stats.hits + stats.misses + stats.disk_hits + stats.coalesced
+                mean_miss_time = stats.miss_time / stats.misses if stats.misses > 0 else np.nan
+                rows.append(
+                    {
+                        "function": function,
+                        "hits": stats.hits,
+                        "misses": stats.misses,
+                        "disk_hits": stats.disk_hits,
+                        "coalesced": stats.coalesced,
+                        "hit_rate": stats.hits / n_calls if n_calls > 0 else np.nan,
+                        "mean_hit_time": stats.hit_time / stats.hits if stats.hits > 0 else np.nan,
+                        "mean_miss_time": mean_miss_time,
+                        "time_saved": stats.hits * mean_miss_time if stats.misses > 0 else np.nan,
+                        "miss_time_histogram": dict(
+                            zip(_FunctionStats.histogram_labels, stats.miss_time_histogram.tolist())
+                        ),
+                        "evictions": dict(stats.evictions),
+                        "n_entries": current[function][0],
+                        "nbytes": current[function][1],
+                    }
+                )
+
+        return pd.DataFrame(
+            rows,
+            columns=[
+                "function", "hits", "misses", "disk_hits", "coalesced", "hit_rate", "mean_hit_time",
+                "mean_miss_time", "time_saved", "miss_time_histogram", "evictions", "n_entries", "nbytes",
+            ]
+        )
+
+    def get_item_stats(self) -> pd.DataFrame:
+        """
+        Get the number of entries and bytes currently held in the cache for each batch item.
+
+        Returns
+        -------
+        pd.DataFrame
+            columns are ``"uuid"``, ``"n_entries"``, ``"nbytes"``, sorted by ``"nbytes"`` in descending order
+        """
+        with self._lock:
+            rows = [
+                (u, len(keys), sum(self._entries[k].nbytes for k in keys))
+                for u, keys in self._uuid_keys.items()
+            ]
+
+        return pd.DataFrame(
+            rows, columns=["uuid", "n_entries", "nbytes"]
+        ).sort_values("nbytes", ascending=False, ignore_index=True)
+
+    def reset_stats(self):
+        """reset all counters and timings"""
+        with self._lock:
+            self._stats.clear()
+
+    def start_stats_logging(self, interval: float = 60.0, level: int = logging.INFO):
+        """
+        Periodically log a summary of ``get_stats()`` from a background thread,
+        using the ``mesmerize_core.caiman_extensions.cache`` logger.
+
+        Parameters
+        ----------
+        interval: float
+            seconds between log records
+
+        level: int
+            logging level
+        """
+        self.stop_stats_logging()
+
+        stop = threading.Event()
+        self._stats_logging_stop = stop
+
+        def _log():
+            while not stop.wait(interval):
+                stats = self.get_stats()
+                logger.log(
+                    level,
+                    f"cache: {self._nbytes} bytes in {len(self._entries)} entries\n"
+                    f"{stats.drop(columns=['miss_time_histogram']).to_string(index=False)}"
+                )
+
+        threading.Thread(target=_log, daemon=True, name="mesmerize-cache-stats").start()
+
+    def stop_stats_logging(self):
+        """stop logging started with ``start_stats_logging()``"""
+        if self._stats_logging_stop is not None:
+            self._stats_logging_stop.set()
+            self._stats_logging_stop = None
 
     def set_maxsize(self, max_size: Union[int, str]):
         if max_size is None:
@@ -61,129 +898,292 @@ class Cache:
             self.size = 1024**3
         elif isinstance(max_size, str):
             self.storage_type = "RAM"
-            if max_size.endswith("G"):
-                self.size = int(max_size[:-1]) * 1024**3
-            elif max_size.endswith("M"):
-                self.size = int(max_size[:-1]) * 1024**2
+            self.size = _parse_size(max_size)
         else:
             self.storage_type = "ITEMS"
-            self.size = max_size
+            self.size = int(max_size)
+
+        with self._lock:
+            self._evict()
+
+    def set_copy_mode(self, mode: str):
+        """
+        Set how cached values are returned when the decorated function is called with ``return_copy=True``,
+        which is the default for most extensions.
+
+        Parameters
+        ----------
+        mode: str
+            | ``"copy"``: return a deep copy of the cached value, default
+            | ``"readonly"``: return read-only views of cached arrays, and new lists and tuples of read-only views
+              for sequences of arrays such as contours. Much faster than copying large arrays, objects that cannot
+              be made read-only, such as ``CNMF`` objects, are still deep copied.
+        """
+        if mode not in COPY_MODES:
+            raise ValueError(f"`mode` must be one of: {COPY_MODES}")
+        self.copy_mode = mode
+
+    def set_disk_cache(self, max_size: Optional[Union[int, str]] = "10G"):
+        """
+        Enable the persistent disk cache tier, stored within the batch dir.
+
+        Parameters
+        ----------
+        max_size: int, str or None
+            max size of the disk cache of each batch dir, as a number of bytes or a str such as ``"10G"``.
+            ``None`` disables the disk cache, existing files are kept.
+        """
+        if max_size is None:
+            self.disk_cache = None
+        elif self.disk_cache is None:
+            self.disk_cache = DiskCache(max_size)
+        else:
+            self.disk_cache.set_maxsize(max_size)
 
-    def _get_cache_size_bytes(self):
+    def _get_cache_size_bytes(self) -> int:
         """Returns in bytes"""
-        cache_size = 0
-        for i in range(len(self.cache.index)):
-            if isinstance(self.cache.iloc[i, 4], np.ndarray):
-                cache_size += self.cache.iloc[i, 4].data.nbytes
-            elif isinstance(self.cache.iloc[i, 4], (tuple, list)):
-                for lists in self.cache.iloc[i, 4]:
-                    for array in lists:
-                        cache_size += array.data.nbytes
-            elif isinstance(self.cache.iloc[i, 4], CNMF):
-                sizes = list()
-                for attr in self.cache.iloc[i, 4].estimates.__dict__.values():
-                    if isinstance(attr, np.ndarray):
-                        sizes.append(attr.data.nbytes)
-                    else:
-                        sizes.append(getsizeof(attr))
-            else:
-                cache_size += sys.getsizeof(self.cache.iloc[i, 4])
+        return self._nbytes
+
+    def _make_key(self, uuid: str, func, bound) -> tuple:
+        """
+        Key for a call, arguments are bound to the function signature with defaults applied so that
+        positional and keyword forms of the same call share a cache entry.
+        ``return_copy`` only changes how the value is returned and is not part of the key.
+        """
+        normalized = list()
+        for i, (name, value) in enumerate(bound.arguments.items()):
+            if i == 0 or name == "return_copy":
+                # skip `self`
+                continue
+            normalized.append((name, _normalize_arg(value)))
+
+        return uuid, func.__name__, tuple(normalized)
+
+    def _insert(self, key: tuple, entry: _CacheEntry) -> bool:
+        """returns ``True`` if the entry was stored, must be called with the lock held"""
+        policy = self._policies.get(entry.function)
+        if (self.storage_type == "RAM" and entry.nbytes > self.size) or \
+                (policy is not None and policy.max_bytes is not None and entry.nbytes > policy.max_bytes):
+            # would evict everything else and still not fit
+            self._get_stats(entry.function).add_eviction("oversize")
+            return False
+
+        entry.pinned = self._is_pinned(entry.uuid, entry.function)
+
+        self._entries[key] = entry
+        self._uuid_keys.setdefault(entry.uuid, set()).add(key)
+        self._function_keys.setdefault(entry.function, OrderedDict())[key] = None
+        self._function_nbytes[entry.function] = self._function_nbytes.get(entry.function, 0) + entry.nbytes
+        self._nbytes += entry.nbytes
+
+        self._evict_function(entry.function)
+        self._evict()
+
+        return True
+
+    def _touch(self, key: tuple, entry: _CacheEntry):
+        """mark an entry as most recently used, must be called with the lock held"""
+        entry.time_stamp = time.time()
+        self._entries.move_to_end(key)
+        self._function_keys[entry.function].move_to_end(key)
+
+    def _is_expired(self, entry: _CacheEntry) -> bool:
+        policy = self._policies.get(entry.function)
+        if policy is None or policy.ttl is None or entry.pinned:
+            return False
+        return (time.time() - entry.inserted) > policy.ttl
+
+    def _remove(self, key: tuple, reason: str):
+        """must be called with the lock held"""
+        entry = self._entries.pop(key)
+        self._get_stats(entry.function).add_eviction(reason)
+        self._nbytes -= entry.nbytes
+
+        keys = self._uuid_keys[entry.uuid]
+        keys.discard(key)
+        if len(keys) == 0:
+            del self._uuid_keys[entry.uuid]
+
+        function_keys = self._function_keys[entry.function]
+        del function_keys[key]
+        self._function_nbytes[entry.function] -= entry.nbytes
+        if len(function_keys) == 0:
+            del self._function_keys[entry.function]
+            del self._function_nbytes[entry.function]
+
+    def _pop_lru(self, keys: OrderedDict, reason: str) -> bool:
+        """
+        remove the least recently used entry in ``keys`` that is not pinned,
+        returns ``False`` if all entries are pinned. Must be called with the lock held
+        """
+        for _ in range(len(keys)):
+            key = next(iter(keys))
+            if not self._entries[key].pinned:
+                self._remove(key, reason)
+                return True
+            # pinned entries are moved out of the way so that the next eviction does not check them again
+            keys.move_to_end(key)
+        return False
+
+    def _evict(self):
+        """
+        remove least recently used entries until the cache is within its size limit,
+        must be called with the lock held
+        """
+        if self.storage_type == "ITEMS":
+            while len(self._entries) > self.size:
+                if not self._pop_lru(self._entries, "lru"):
+                    break
+
+        elif self.storage_type == "RAM":
+            while len(self._entries) > 0 and self._nbytes > self.size:
+                if not self._pop_lru(self._entries, "lru"):
+                    break
+
+    def _evict_function(self, function: str):
+        """enforce the limits of a function's policy, must be called with the lock held"""
+        policy = self._policies.get(function)
+        if policy is None or function not in self._function_keys.keys():
+            return
+
+        keys = self._function_keys[function]
+
+        if policy.ttl is not None:
+            now = time.time()
+            for key in [k for k in keys if not self._entries[k].pinned]:
+                if (now - self._entries[key].inserted) > policy.ttl:
+                    self._remove(key, "ttl")
+
+        while policy.max_items is not None and len(self._function_keys.get(function, ())) > policy.max_items:
+            if not self._pop_lru(self._function_keys[function], "function_limit"):
+                break
+
+        while policy.max_bytes is not None and self._function_nbytes.get(function, 0) > policy.max_bytes:
+            if not self._pop_lru(self._function_keys[function], "function_limit"):
+                break
+
+    def _get_generation(self, u: str) -> tuple:
+        return self._clear_count, self._generations.get(u, 0)
+
+    def _invalidate_uuid(self, u: str):
+        with self._lock:
+            self._generations[u] = self._generations.get(u, 0) + 1
+            for key in list(self._uuid_keys.get(u, ())):
+                self._remove(key, "invalidated")
 
-        return cache_size
+    def _compute(self, instance, key: tuple, func, args, kwargs) -> Tuple[Any, bool]:
+        """
+        value on a RAM miss, from the disk cache if possible else computed
+
+        Returns
+        -------
+        Tuple[Any, bool]
+            (value, ``True`` if the value was loaded from the disk cache)
+        """
+        disk_key = None
+        if self.disk_cache is not None:
+            disk_key = self.disk_cache.get_key(instance, key)
+            if disk_key is not None:
+                found, value = self.disk_cache.load(instance, disk_key)
+                if found:
+                    return value, True
+
+        return_val = func(instance, *args, **kwargs)
+
+        if disk_key is not None:
+            self.disk_cache.save(instance, disk_key, return_val)
+
+        return return_val, False
 
     def use_cache(self, func):
+        func_signature = signature(func)
+
         @wraps(func)
         def _use_cache(instance, *args, **kwargs):
-            if "return_copy" in kwargs.keys():
-                return_copy = kwargs["return_copy"]
-            else:
-                return_copy = True
+            t0 = time.perf_counter()
+            bound = func_signature.bind(instance, *args, **kwargs)
+            bound.apply_defaults()
+            # functions without a `return_copy` arg always return copies
+            return_copy = bound.arguments.get("return_copy", True)
 
             if self.size == 0:
                 self.clear_cache()
-                return _return_wrapper(func(instance, *args, **kwargs), return_copy)
-
-            # if cache is empty, will always be a cache miss
-            if len(self.cache.index) == 0:
-                return_val = func(instance, *args, **kwargs)
-                self.cache.loc[len(self.cache.index)] = [
-                    instance._series["uuid"],
-                    func.__name__,
-                    args,
-                    kwargs,
-                    return_val,
-                    time.time(),
-                ]
-                return _return_wrapper(return_val, copy_bool=return_copy)
-
-            # checking to see if there is a cache hit
-            for i in range(len(self.cache.index)):
-                if (
-                    self.cache.iloc[i, 0] == instance._series["uuid"]
-                    and self.cache.iloc[i, 1] == func.__name__
-                    and _check_args_equality(args, self.cache.iloc[i, 2])
-                    and _check_args_equality(kwargs, self.cache.iloc[i, 3])
-                ):
-                    self.cache.iloc[i, 5] = time.time()
-                    return_val = self.cache.iloc[i, 4]
-                    return _return_wrapper(self.cache.iloc[i, 4], copy_bool=return_copy)
-
-            # no cache hit, must check cache limit, and if limit is going to be exceeded...remove least recently used and add new entry
-            # if memory type is 'ITEMS': drop the least recently used and then add new item
-            if self.storage_type == "ITEMS" and len(self.cache.index) >= self.size:
-                return_val = func(instance, *args, **kwargs)
-                self.cache.drop(
-                    index=self.cache.sort_values(
-                        by=["time_stamp"], ascending=False
-                    ).index[-1],
-                    axis=0,
-                    inplace=True,
-                )
-                self.cache = self.cache.reset_index(drop=True)
-                self.cache.loc[len(self.cache.index)] = [
-                    instance._series["uuid"],
-                    func.__name__,
-                    args,
-                    kwargs,
-                    return_val,
-                    time.time(),
-                ]
-                return _return_wrapper(
-                    self.cache.iloc[len(self.cache.index) - 1, 4], copy_bool=return_copy
-                )
-            # if memory type is 'RAM': add new item and then remove least recently used items until cache is under correct size again
-            elif self.storage_type == "RAM":
-                while self._get_cache_size_bytes() > self.size:
-                    self.cache.drop(
-                        index=self.cache.sort_values(
-                            by=["time_stamp"], ascending=False
-                        ).index[-1],
-                        axis=0,
-                        inplace=True,
+                # not stored in the cache, no need to copy
+                return func(instance, *args, **kwargs)
+
+            u = instance._series["uuid"]
+
+            try:
+                key = self._make_key(u, func, bound)
+            except _Uncacheable:
+                return func(instance, *args, **kwargs)
+
+            with self._lock:
+                # checking to see if there is a cache hit
+                entry = self._entries.get(key)
+                if entry is not None and self._is_expired(entry):
+                    self._remove(key, "ttl")
+                    entry = None
+
+                if entry is not None:
+                    self._touch(key, entry)
+
+                else:
+                    in_flight = self._in_flight.get(key)
+                    is_owner = in_flight is None
+                    if is_owner:
+                        # this thread computes the value
+                        in_flight = Future()
+                        self._in_flight[key] = in_flight
+                        generation = self._get_generation(u)
+
+            if entry is not None:
+                rval = _return_wrapper(entry.return_val, return_copy, self.copy_mode)
+                with self._lock:
+                    stats = self._get_stats(func.__name__)
+                    stats.hits += 1
+                    stats.hit_time += time.perf_counter() - t0
+                return rval
+
+            if not is_owner:
+                with self._lock:
+                    self._get_stats(func.__name__).coalesced += 1
+                # another thread is computing this value, wait for it, raises if the computation raised
+                return _return_wrapper(in_flight.result(), return_copy, self.copy_mode)
+
+            # no cache hit, compute, add new entry and then remove least recently used items
+            # until the cache is under the size limit again
+            try:
+                return_val, from_disk = self._compute(instance, key, func, args, kwargs)
+            except BaseException as e:
+                with self._lock:
+                    del self._in_flight[key]
+                in_flight.set_exception(e)
+                raise
+
+            with self._lock:
+                del self._in_flight[key]
+                stats = self._get_stats(func.__name__)
+                if from_disk:
+                    stats.disk_hits += 1
+                else:
+                    stats.add_miss(time.perf_counter() - t0)
+
+                if self._get_generation(u) != generation:
+                    # invalidated while it was being computed
+                    stored = False
+                else:
+                    stored = self._insert(
+                        key,
+                        _CacheEntry(u, func.__name__, _strip_arrays(args), _strip_arrays(kwargs), return_val)
                     )
-                    self.cache = self.cache.reset_index(drop=True)
-                return_val = func(instance, *args, **kwargs)
-                self.cache.loc[len(self.cache.index)] = [
-                    instance._series["uuid"],
-                    func.__name__,
-                    args,
-                    kwargs,
-                    return_val,
-                    time.time(),
-                ]
-            # no matter the storage type if size is not going to be exceeded for either, then item can just be added to cache
-            else:
-                return_val = func(instance, *args, **kwargs)
-                self.cache.loc[len(self.cache.index)] = [
-                    instance._series["uuid"],
-                    func.__name__,
-                    args,
-                    kwargs,
-                    return_val,
-                    time.time(),
-                ]
-
-            return _return_wrapper(return_val, copy_bool=return_copy)
+
+            in_flight.set_result(return_val)
+
+            if not stored:
+                return return_val
+
+            return _return_wrapper(return_val, return_copy, self.copy_mode)
 
         return _use_cache
 
@@ -206,20 +1206,180 @@ class Cache:
                 u = instance._series["uuid"]
 
                 if pre:
-                    self.cache.drop(
-                        self.cache.loc[self.cache["uuid"] == u].index,
-                        inplace=True
-                    )
+                    self._invalidate_uuid(u)
+                    if self.disk_cache is not None:
+                        self.disk_cache.invalidate(instance)
 
                 rval = func(instance, *args, **kwargs)
 
                 if post:
-                    self.cache.drop(
-                        self.cache.loc[self.cache["uuid"] == u].index,
-                        inplace=True
-                    )
+                    self._invalidate_uuid(u)
+                    if self.disk_cache is not None:
+                        self.disk_cache.invalidate(instance)
 
                 return rval
 
             return __invalidate
         return _invalidate
+
+
+class CacheWarmer:
+    """
+    Runs cache warm-up tasks in the background using a thread or process pool,
+    returned by ``CaimanDataFrameExtensions.warm_cache()``.
+
+    Tasks are submitted lazily, no more than ``max_workers`` at a time, so that warm-up stops
+    as soon as it is cancelled or the budget is reached.
+    """
+
+    def __init__(
+            self,
+            tasks: List[Tuple[str, Callable]],
+            cache: Cache,
+            max_workers: int = 4,
+            backend: str = "thread",
+            budget: Optional[Union[int, str]] = None,
+            progress: bool = True,
+    ):
+        """
+        Parameters
+        ----------
+        tasks: List[Tuple[str, Callable]]
+            list of (label, callable), callables must be picklable for the ``"process"`` backend
+
+        cache: Cache
+            the cache that is being warmed
+
+        max_workers: int
+            number of threads or processes
+
+        backend: str
+            ``"thread"`` to populate the in-memory cache, ``"process"`` to populate only the disk cache
+
+        budget: int, str or None
+            | ``"thread"`` backend only, max number of bytes to add to the cache, a str such as ``"500M"`` can
+              also be used. If ``None`` the budget is the cache's size limit.
+            | Warm-up also stops if the cache starts evicting entries to make space.
+
+        progress: bool
+            show a progress bar
+        """
+        if backend not in ["thread", "process"]:
+            raise ValueError("`backend` must be one of: 'thread', 'process'")
+
+        self._tasks = tasks
+        self._cache = cache
+        self._max_workers = max_workers
+        self._backend = backend
+        self._budget = None if budget is None else _parse_size(budget)
+        self._progress = progress
+
+        self._cancel = threading.Event()
+        self._finished = threading.Event()
+
+        self.n_done: int = 0
+        #: label -> exception, for tasks that raised
+        self.errors: dict = dict()
+        #: why warm-up stopped early, ``None`` if all tasks were run
+        self.stop_reason: Optional[str] = None
+
+        with cache._lock:
+            self._start_nbytes = cache._nbytes
+            self._start_evictions = self._get_lru_evictions()
+
+        self._thread = threading.Thread(target=self._run, daemon=True, name="mesmerize-cache-warmer")
+        self._thread.start()
+
+    @property
+    def n_total(self) -> int:
+        return len(self._tasks)
+
+    def _get_lru_evictions(self) -> int:
+        return sum(
+            s.evictions.get("lru", 0) + s.evictions.get("function_limit", 0)
+            for s in self._cache._stats.values()
+        )
+
+    def _budget_reached(self) -> bool:
+        if self._backend == "process":
+            return False
+
+        with self._cache._lock:
+            if self._get_lru_evictions() > self._start_evictions:
+                return True
+
+            if self._budget is not None:
+                return (self._cache._nbytes - self._start_nbytes) >= self._budget
+
+            if self._cache.storage_type == "ITEMS":
+                return len(self._cache._entries) >= self._cache.size
+
+            return self._cache._nbytes >= self._cache.size
+
+    def _run(self):
+        if self._backend == "thread":
+            pool = ThreadPoolExecutor(max_workers=self._max_workers)
+        else:
+            pool = ProcessPoolExecutor(max_workers=self._max_workers)
+
+        tasks = iter(self._tasks)
+        pending = dict()
+        exhausted = False
+
+        with tqdm(total=self.n_total, disable=not self._progress, desc="warming cache") as pbar:
+            while True:
+                while not exhausted and len(pending) < self._max_workers:
+                    if self._cancel.is_set():
+                        self.stop_reason = "cancelled"
+                        break
+                    if self._budget_reached():
+                        self.stop_reason = "budget reached"
+                        break
+                    try:
+                        label, task = next(tasks)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending[pool.submit(task)] = label
+
+                if self.stop_reason is not None:
+                    exhausted = True
+
+                if len(pending) == 0:
+                    break
+
+                done, _ = wait(pending.keys(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    label = pending.pop(future)
+                    if future.exception() is not None:
+                        self.errors[label] = future.exception()
+                    self.n_done += 1
+                    pbar.update(1)
+
+        pool.shutdown(wait=True)
+        self._finished.set()
+
+    def cancel(self):
+        """stop submitting tasks, tasks that are already running are finished"""
+        self._cancel.set()
+
+    def done(self) -> bool:
+        return self._finished.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for warm-up to finish
+
+        Returns
+        -------
+        bool
+            ``True`` if warm-up has finished, ``False`` if ``timeout`` was reached
+        """
+        return self._finished.wait(timeout)
+
+    def __repr__(self):
+        status = "done" if self.done() else "running"
+        return (
+            f"<CacheWarmer {status}: {self.n_done}/{self.n_total} tasks, {len(self.errors)} errors, "
+            f"stop reason: {self.stop_reason}>"
+        )
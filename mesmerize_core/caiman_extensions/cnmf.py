@@ -8,15 +8,22 @@ from caiman.source_extraction.cnmf.cnmf import load_CNMF
 from caiman.utils.visualization import get_contours as caiman_get_contours
 from functools import wraps
 import os
+import warnings
 from copy import deepcopy
 
 from ._utils import validate
-from .cache import Cache
+from .cache import Cache, get_cache_config
 from ..arrays import *
 from ..arrays._base import LazyArray
 
 
 cnmf_cache = Cache()
+try:
+    cnmf_cache.configure(get_cache_config())
+except (KeyError, ValueError, TypeError) as e:
+    # an invalid config must not prevent importing mesmerize_core
+    warnings.warn(f"Invalid cache config, the default config is used:\n{e}")
+    cnmf_cache = Cache()
 
 
 # this decorator MUST be called BEFORE caching decorators!
@@ -30,7 +37,7 @@ def _component_indices_parser(func):
         else:
             component_indices = None  # default
 
-        cnmf_obj = instance.get_output()
+        cnmf_obj = instance._get_output_shared()
 
         # TODO: finally time to learn Python's new switch case
         accepted = (np.ndarray, str, type(None))
@@ -83,6 +90,11 @@ def _check_permissions(func):
 class CNMFExtensions:
     """
     Extensions for managing CNMF output data
+
+    Cached extensions with a ``return_copy`` kwarg return a deep copy of the cached value by default. With
+    ``return_copy="readonly"``, or ``True`` after ``cnmf_cache.set_copy_mode("readonly")``, they instead return
+    read-only views of the cached arrays, lists and tuples of arrays are returned as new lists and tuples of read-only
+    views. This is much faster than a copy for large arrays, other objects are still deep copied.
     """
 
     def __init__(self, s: pd.Series):
@@ -184,6 +196,13 @@ class CNMFExtensions:
         # collective global cache
         return load_CNMF(self.get_output_path())
 
+    def _get_output_shared(self) -> CNMF:
+        """
+        Internal read-only handle to the cached CNMF object, used by the extensions that only read from it.
+        The returned object is shared with the cache and must NEVER be modified, use ``get_output()`` for that.
+        """
+        return self.get_output(return_copy=False)
+
     @validate("cnmf")
     @_component_indices_parser
     @cnmf_cache.use_cache
@@ -206,8 +225,9 @@ class CNMFExtensions:
         threshold: float
             threshold
 
-        return_copy: bool
+        return_copy: bool or str
             | if ``True`` returns a copy of the cached value in memory.
+            | if ``"readonly"`` returns read-only views of the cached value, see :class:`CNMFExtensions`.
             | if ``False`` returns the same object as the cached value in memory, not recommend this could result in strange unexpected behavior.
             | In general you want a copy of the cached value.
 
@@ -218,7 +238,7 @@ class CNMFExtensions:
 
         """
 
-        cnmf_obj = self.get_output()
+        cnmf_obj = self._get_output_shared()
 
         dims = cnmf_obj.dims
         if dims is None:
@@ -281,8 +301,9 @@ class CNMFExtensions:
         swap_dim: bool
             swap the x and y coordinates, use if the contours don't align with the cells in your image
 
-        return_copy: bool
+        return_copy: bool or str
             | if ``True`` returns a copy of the cached value in memory.
+            | if ``"readonly"`` returns read-only views of the cached value, see :class:`CNMFExtensions`.
             | if ``False`` returns the same object as the cached value in memory, not recommend this could result in strange unexpected behavior.
             | In general you want a copy of the cached value.
 
@@ -340,7 +361,7 @@ class CNMFExtensions:
             VBox([plot.show(), slider])
         """
 
-        cnmf_obj = self.get_output()
+        cnmf_obj = self._get_output_shared()
         contours = self._get_spatial_contours(cnmf_obj, component_indices, swap_dim)
 
         coordinates = list()
@@ -377,8 +398,9 @@ class CNMFExtensions:
         add_background: bool
             if ``True``, add the temporal background, ``cnmf.estimates.C + cnmf.estimates.f``
 
-        return_copy: bool
+        return_copy: bool or str
             | if ``True`` returns a copy of the cached value in memory.
+            | if ``"readonly"`` returns read-only views of the cached value, see :class:`CNMFExtensions`.
             | if ``False`` returns the same object as the cached value in memory, not recommend this could result in strange unexpected behavior.
             | In general you want a copy of the cached value.
 
@@ -405,7 +427,7 @@ class CNMFExtensions:
             heatmap(temporal)
         """
 
-        cnmf_obj = self.get_output()
+        cnmf_obj = self._get_output_shared()
 
         C = cnmf_obj.estimates.C[component_indices]
         f = cnmf_obj.estimates.f
@@ -480,7 +502,7 @@ class CNMFExtensions:
             iw.show()
         """
 
-        cnmf_obj = self.get_output()
+        cnmf_obj = self._get_output_shared()
 
         if temporal_components is None:
             temporal_components = cnmf_obj.estimates.C
@@ -542,7 +564,7 @@ class CNMFExtensions:
             iw.show()
         """
 
-        cnmf_obj = self.get_output()
+        cnmf_obj = self._get_output_shared()
 
         if cnmf_obj.estimates.dims is not None:
             dims = cnmf_obj.estimates.dims
@@ -676,7 +698,7 @@ class CNMFExtensions:
     def get_detrend_dfof(
             self,
             component_indices: Union[np.ndarray, str] = None,
-            return_copy: bool = True
+            return_copy: Union[bool, str] = True
     ):
         """
         Get the detrended dF/F0 curves after calling ``run_detrend_dfof``.
@@ -691,8 +713,9 @@ class CNMFExtensions:
             | if ``"bad"`` uses bad components, i.e. ``Estimates.idx_components_bad``
             | if ``np.ndarray``, uses the indices in the provided array
 
-        return_copy: bool
+        return_copy: bool or str
             | if ``True`` returns a copy of the cached value in memory.
+            | if ``"readonly"`` returns read-only views of the cached value, see :class:`CNMFExtensions`.
             | if ``False`` returns the same object as the cached value in memory, not recommend this could result in strange unexpected behavior.
             | In general you want a copy of the cached value.
 
@@ -703,7 +726,7 @@ class CNMFExtensions:
 
         """
 
-        cnmf_obj = self.get_output()
+        cnmf_obj = self._get_output_shared()
         if cnmf_obj.estimates.F_dff is None:
             raise AttributeError("You must run ``cnmf.run_detrend_dfof()`` first")
 
@@ -784,8 +807,8 @@ class CNMFExtensions:
 
         """
 
-        cnmf_obj = self.get_output()
-        return cnmf_obj.estimates.idx_components
+        cnmf_obj = self._get_output_shared()
+        return deepcopy(cnmf_obj.estimates.idx_components)
 
     @validate("cnmf")
     def get_bad_components(self) -> np.ndarray:
@@ -799,5 +822,5 @@ class CNMFExtensions:
 
         """
 
-        cnmf_obj = self.get_output()
-        return cnmf_obj.estimates.idx_components_bad
+        cnmf_obj = self._get_output_shared()
+        return deepcopy(cnmf_obj.estimates.idx_components_bad)
@@ -1,32 +1,72 @@
+import asyncio
 import os
-import shutil
+import warnings
 from pathlib import Path
 from subprocess import Popen
 from typing import *
 from uuid import UUID, uuid4
 from shutil import rmtree
-from itertools import chain
+from itertools import chain, product
 from collections import Counter
 from datetime import datetime
+from functools import partial
+from inspect import signature
+from concurrent.futures import ThreadPoolExecutor, Future
+from copy import deepcopy
 
 import numpy as np
 import pandas as pd
 
 from ._batch_exceptions import BatchItemNotRunError, BatchItemUnsuccessfulError, DependencyError
-from ._utils import validate, _index_parser
+from ._utils import validate, _index_parser, _get_uuid_position, _build_uuid_index, _add_to_uuid_index
+from ._dependencies import DependencyGraph, get_dependency_graph, invalidate_dependency_graph
+from ._disk_usage import scan_batch_dir, remove_garbage, get_other_batch_uuids, SLURM_DIR
 from ..batch_utils import (
     COMPUTE_BACKENDS,
     COMPUTE_BACKEND_SUBPROCESS,
     COMPUTE_BACKEND_LOCAL,
+    COMPUTE_BACKEND_SLURM,
+    COMPUTE_BACKEND_WORKER,
     get_parent_raw_data_path,
-    load_batch
+    set_parent_raw_data_path,
+    load_batch,
+    clear_path_cache,
 )
-from ..utils import validate_path, IS_WINDOWS, make_runfile, warning_experimental
-from .cnmf import cnmf_cache
+from ..batch_storage import (
+    get_storage,
+    get_results_path,
+    read_all_item_results,
+    apply_item_results,
+    merge_batch,
+    VERSION_ATTR,
+    _update_row_digests,
+)
+from ..utils import (
+    validate_path,
+    IS_WINDOWS,
+    make_runfile,
+    warning_experimental,
+    get_n_processes,
+    STAGE_METRICS_FIELDS,
+)
+from .cnmf import cnmf_cache, CNMFExtensions
+from .cache import CacheWarmer
+from .runner import BatchRunner, RunFuture, estimate_durations, monitor_process
+from .slurm import (
+    SlurmJob,
+    get_slurm_commands,
+    estimate_resources,
+    combine_resources,
+    make_sbatch_script,
+)
+from .worker import WorkerJob, get_worker, start_worker
 from .. import algorithms
 from ..movie_readers import default_reader
 
 
+# items of the local backend run one at a time in the background
+_LOCAL_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mesmerize-local")
+
 ALGO_MODULES = {
     "cnmf": algorithms.cnmf,
     "mcorr": algorithms.mcorr,
@@ -34,6 +74,31 @@ ALGO_MODULES = {
 }
 
 
+def _warm_cache_task(series: pd.Series, accessor: str, kwargs: dict):
+    """call a cached cnmf extension so that its output is cached, the output is not returned"""
+    func = getattr(series.cnmf, accessor)
+    if "return_copy" in signature(func).parameters.keys():
+        kwargs = {**kwargs, "return_copy": False}
+    func(**kwargs)
+
+
+def _warm_disk_cache_task(
+        batch_path: str,
+        data_path: Optional[str],
+        u: str,
+        accessor: str,
+        kwargs: dict,
+        disk_cache_size: int
+):
+    """runs in a worker process, only the disk cache of the batch is populated"""
+    if data_path is not None:
+        set_parent_raw_data_path(data_path)
+    cnmf_cache.set_disk_cache(disk_cache_size)
+
+    df = load_batch(batch_path)
+    _warm_cache_task(df.caiman.uloc(u), accessor, kwargs)
+
+
 @pd.api.extensions.register_dataframe_accessor("caiman")
 class CaimanDataFrameExtensions:
     """
@@ -47,17 +112,12 @@ class CaimanDataFrameExtensions:
         """
         Return the series corresponding to the passed UUID
         """
-        df_u = self._df.loc[self._df["uuid"] == str(u)]
-
-        if df_u.index.size == 0:
+        try:
+            i = _get_uuid_position(self._df, u)
+        except KeyError:
             raise KeyError("Item with given UUID not found in dataframe")
-        elif df_u.index.size > 1:
-            raise KeyError(
-                f"Duplicate items with given UUID found in dataframe, something is wrong\n"
-                f"{df_u}"
-            )
 
-        return df_u.squeeze()
+        return self._df.iloc[i]
 
     def add_item(self, algo: str, item_name: str, input_movie_path: Union[str, pd.Series], params: dict):
         """
@@ -79,12 +139,144 @@ class CaimanDataFrameExtensions:
             Parameters for running the algorithm with the input movie
 
         """
+        self._check_parent_raw_data_path()
+
+        s = pd.Series(
+            self._make_row(algo, item_name, self._get_input_movie_path(input_movie_path), params)
+        )
+
+        # Add the Series to the DataFrame
+        self._df.loc[self._df.index.size] = s
+        _add_to_uuid_index(self._df, [s["uuid"]], start=self._df.index.size - 1)
+        invalidate_dependency_graph(self._df)
+
+        # Save DataFrame to disk
+        get_storage(self._df.paths.get_batch_path()).append_rows(self._df, self._df.iloc[[-1]])
+
+    def add_items(
+            self,
+            items: Optional[Iterable[Union[tuple, dict]]] = None,
+            algo: Optional[str] = None,
+            item_name: Optional[str] = None,
+            input_movie_path: Optional[Union[str, Path, pd.Series, List[Union[str, Path, pd.Series]]]] = None,
+            params: Optional[dict] = None,
+            grid: Optional[Dict[str, Iterable]] = None,
+    ):
+        """
+        Add many items to the DataFrame at once, for example to sweep parameters.
+        Each distinct input movie path is validated only once and the batch file is written only once.
+
+        Parameters
+        ----------
+        items: Iterable of tuple or dict, optional
+            | items to add, either ``(algo, item_name, input_movie_path, params)`` tuples
+            | or dicts with the same keys, i.e. the arguments of ``add_item()``
+
+        algo: str, optional
+            Name of the algorithm to run for every combination of the ``grid``
+
+        item_name: str, optional
+            User set name for the batch items of the ``grid``
+
+        input_movie_path: str, Path, pd.Series, or list of these, optional
+            | input movie of the ``grid`` items, see ``add_item()``
+            | if a list is given the ``grid`` is added for each input movie
+
+        params: dict, optional
+            base parameters of the ``grid`` items
+
+        grid: dict, optional
+            | ``{param name: values}``, one item is added for every combination of the values,
+            | the values are set in ``params["main"]``
+
+        Examples
+        --------
+        Add items from tuples
+
+        .. code-block:: python
+
+            df.caiman.add_items(
+                [
+                    ("mcorr", "my_movie", "path/to/movie.tif", mcorr_params),
+                    ("mcorr", "other_movie", "path/to/other_movie.tif", mcorr_params),
+                ]
+            )
+
+        Sweep CNMF parameters on the output of a mcorr item, this adds 9 items
+
+        .. code-block:: python
+
+            df.caiman.add_items(
+                algo="cnmf",
+                item_name="my_movie",
+                input_movie_path=df.iloc[0],
+                params=cnmf_params,
+                grid={"gSig": [(4, 4), (5, 5), (6, 6)], "K": [20, 30, 40]},
+            )
+
+        """
+        self._check_parent_raw_data_path()
+
+        items = list() if items is None else list(items)
+
+        if grid is not None:
+            if algo is None or params is None or input_movie_path is None:
+                raise ValueError("`algo`, `input_movie_path` and `params` must be provided with a `grid`")
+
+            if not isinstance(input_movie_path, list):
+                input_movie_path = [input_movie_path]
+
+            keys = list(grid.keys())
+            for path in input_movie_path:
+                for values in product(*[grid[k] for k in keys]):
+                    item_params = deepcopy(params)
+                    item_params["main"].update(zip(keys, values))
+                    items.append((algo, item_name, path, item_params))
+
+        # each distinct input movie is resolved and validated once
+        input_movie_paths = dict()
+
+        rows = list()
+        for item in items:
+            if isinstance(item, dict):
+                item = (item["algo"], item["item_name"], item["input_movie_path"], item["params"])
+            item_algo, item_item_name, item_input_movie_path, item_params = item
+
+            if isinstance(item_input_movie_path, pd.Series):
+                key = ("uuid", item_input_movie_path["uuid"])
+            else:
+                key = ("path", str(item_input_movie_path))
+
+            if key not in input_movie_paths.keys():
+                input_movie_paths[key] = self._get_input_movie_path(item_input_movie_path)
+
+            rows.append(self._make_row(item_algo, item_item_name, input_movie_paths[key], item_params))
+
+        if len(rows) == 0:
+            return
+
+        new_rows = pd.DataFrame(rows, columns=list(rows[0].keys()), dtype=object)
+
+        # add all rows in one concat, the accessor must modify the DataFrame in place
+        # so the data of the concatenated DataFrame replaces the data of this DataFrame
+        df = pd.concat([self._df, new_rows], ignore_index=True)
+        self._df._update_inplace(df)
+        _add_to_uuid_index(self._df, new_rows["uuid"], start=self._df.index.size - len(rows))
+        invalidate_dependency_graph(self._df)
+
+        # Save DataFrame to disk
+        get_storage(self._df.paths.get_batch_path()).append_rows(self._df, self._df.iloc[-len(rows):])
+
+    @staticmethod
+    def _check_parent_raw_data_path():
         if get_parent_raw_data_path() is None:
             raise ValueError(
                 "parent raw data path is not set, you must set it using:\n"
                 "`set_parent_raw_data_path()`"
             )
 
+    def _get_input_movie_path(self, input_movie_path: Union[str, Path, pd.Series]) -> str:
+        """validate the input movie path and return the path relative to the batch dir or parent raw data path"""
         if isinstance(input_movie_path, pd.Series):
             if not input_movie_path["algo"] == "mcorr":
                 raise ValueError(
@@ -98,66 +290,82 @@ class CaimanDataFrameExtensions:
         validate_path(input_movie_path)
 
         # get relative path
-        input_movie_path = self._df.paths.split(input_movie_path)[1]
+        return str(self._df.paths.split(input_movie_path)[1])
 
+    @staticmethod
+    def _make_row(algo: str, item_name: str, input_movie_path: str, params: dict) -> dict:
+        """row of a new batch item, ``input_movie_path`` must already be validated"""
         # convert lists to tuples so that get_params_diffs works
         for k in list(params["main"].keys()):
             if isinstance(params["main"][k], list):
                 params["main"][k] = tuple(params["main"][k])
 
-        # Create a pandas Series (Row) with the provided arguments
-        s = pd.Series(
-            {
-                "algo": algo,
-                "item_name": item_name,
-                "input_movie_path": str(input_movie_path),
-                "params": params,
-                "outputs": None,  # to store dict of output information, such as output file paths
-                "added_time": datetime.now().isoformat(timespec="seconds", sep="T"),
-                "ran_time": None,
-                "algo_duration": None,
-                "comments": None,
-                "uuid": str(
-                    uuid4()
-                ),  # unique identifier for this combination of movie + params
-            }
-        )
-
-        # Add the Series to the DataFrame
-        self._df.loc[self._df.index.size] = s
-
-        # Save DataFrame to disk
-        self._df.to_pickle(self._df.paths.get_batch_path())
+        return {
+            "algo": algo,
+            "item_name": item_name,
+            "input_movie_path": input_movie_path,
+            "params": params,
+            "outputs": None,  # to store dict of output information, such as output file paths
+            "added_time": datetime.now().isoformat(timespec="seconds", sep="T"),
+            "ran_time": None,
+            "algo_duration": None,
+            "comments": None,
+            "uuid": str(
+                uuid4()
+            ),  # unique identifier for this combination of movie + params
+        }
 
     def save_to_disk(self, max_index_diff: int = 0):
         """
-        Saves DataFrame to disk, copies to a backup before overwriting existing file.
+        Saves DataFrame to disk.
+
+        If the batch file was modified after this DataFrame was loaded, for example by a batch item that finished
+        running or by another notebook, the changes made in this DataFrame are merged with the changes on disk
+        instead of overwriting them. Cells that were changed both here and on disk are overwritten with the values in
+        this DataFrame. Use ``reload_from_disk()`` after a merge to get the merged DataFrame.
         """
         path: Path = self._df.paths.get_batch_path()
+        storage = get_storage(path)
 
-        disk_df = load_batch(path)
-
-        # check that max_index_diff is not exceeded
-        if abs(disk_df.index.size - self._df.index.size) > max_index_diff:
-            raise IndexError(
-                f"The number of rows in the DataFrame on disk differs more "
-                f"than has been allowed by the `max_index_diff` kwarg which "
-                f"is set to <{max_index_diff}>. This is to prevent overwriting "
-                f"the full DataFrame with a sub-DataFrame. If you still wish "
-                f"to save the smaller DataFrame, use `caiman.save_to_disk()` "
-                f"with `max_index_diff` set to the highest allowable difference "
-                f"in row number."
-            )
+        while True:
+            disk_df, disk_version = storage.read_versioned()
 
-        bak = path.with_suffix(path.suffix + f"bak.{time()}")
+            if self._df.attrs.get(VERSION_ATTR) == disk_version and set(disk_df.columns) <= set(self._df.columns):
+                df, conflicts = self._df, list()
+            else:
+                # merge outside the lock, the lock is only held while writing
+                df, conflicts = merge_batch(self._df, disk_df)
+
+            # check that max_index_diff is not exceeded
+            if abs(disk_df.index.size - df.index.size) > max_index_diff:
+                raise IndexError(
+                    f"The number of rows in the DataFrame on disk differs more "
+                    f"than has been allowed by the `max_index_diff` kwarg which "
+                    f"is set to <{max_index_diff}>. This is to prevent overwriting "
+                    f"the full DataFrame with a sub-DataFrame. If you still wish "
+                    f"to save the smaller DataFrame, use `caiman.save_to_disk()` "
+                    f"with `max_index_diff` set to the highest allowable difference "
+                    f"in row number."
+                )
 
-        shutil.copyfile(path, bak)
-        try:
-            self._df.to_pickle(path)
-            os.remove(bak)
-        except:
-            shutil.copyfile(bak, path)
-            raise IOError(f"Could not save dataframe to disk.")
+            with storage.lock:
+                if storage.lock.version != disk_version:
+                    # written again while merging, start over
+                    continue
+                storage.write(df)
+            break
+
+        if df is not self._df:
+            warnings.warn(
+                "The batch file was modified after this DataFrame was loaded, the changes were merged. "
+                "Use `df = df.caiman.reload_from_disk()` to get the merged DataFrame."
+            )
+
+        if len(conflicts) > 0:
+            warnings.warn(
+                "The following cells were modified both in this DataFrame and in the batch file, "
+                f"the values in this DataFrame were saved, (uuid, column):\n{conflicts}"
+            )
 
     def reload_from_disk(self) -> pd.DataFrame:
         """
@@ -176,6 +384,81 @@ class CaimanDataFrameExtensions:
         """
         return load_batch(self._df.paths.get_batch_path())
 
+    def sync_results(self) -> List[str]:
+        """
+        Write the results of batch items that have finished running to the batch file.
+
+        When a batch item is run with a pickle batch file, its ``outputs``, ``ran_time`` and ``algo_duration`` are
+        written to a small results file in the item's output dir instead of rewriting the whole batch file, so that
+        items can safely be run in parallel. ``load_batch()`` merges these results into the DataFrame, this
+        writes them to the batch file in one go and removes the results files.
+        The results are also merged into this DataFrame.
+
+        Returns
+        -------
+        List[str]
+            UUIDs of the items whose results were written to the batch file
+
+        Examples
+        --------
+
+        .. code-block:: python
+
+            for i, r in df.iterrows():
+                r.caiman.run()
+
+            df.caiman.sync_results()
+
+        """
+        path = self._df.paths.get_batch_path()
+        storage = get_storage(path)
+
+        while True:
+            disk_df, disk_version = storage.read_versioned()
+
+            synced = dict()
+            sidecars = list()
+            for u, results in read_all_item_results(path, disk_df["uuid"]).items():
+                sidecar = get_results_path(path, u)
+                # only remove the file later if it is not replaced by another run in the meantime
+                sidecars.append((sidecar, sidecar.stat().st_mtime_ns))
+
+                apply_item_results(disk_df, u, results)
+                synced[u] = results
+
+            if len(synced) == 0:
+                return list()
+
+            with storage.lock:
+                if storage.lock.version != disk_version:
+                    # written again in the meantime, start over
+                    continue
+                version = storage.write(disk_df)
+            break
+
+        for u, results in synced.items():
+            apply_item_results(self._df, u, results)
+
+        # outputs of mcorr items are the inputs of their children
+        invalidate_dependency_graph(self._df)
+
+        # output files of items that were run again may have been replaced
+        for u in synced.keys():
+            clear_path_cache(path.parent, u)
+
+        if self._df.attrs.get(VERSION_ATTR) == disk_version:
+            # the only changes on disk are the synced results, which this DataFrame now also has
+            _update_row_digests(self._df, version, changed=disk_df.loc[disk_df["uuid"].isin(synced.keys())])
+
+        for sidecar, mtime in sidecars:
+            try:
+                if sidecar.stat().st_mtime_ns == mtime:
+                    os.remove(sidecar)
+            except FileNotFoundError:
+                pass
+
+        return list(synced.keys())
+
     @_index_parser
     def remove_item(self, index: Union[int, str, UUID], remove_data: bool = True, safe_removal: bool = True):
         """
@@ -226,13 +509,574 @@ class CaimanDataFrameExtensions:
                 )
             except FileNotFoundError:
                 pass
+            clear_path_cache(self._df.paths.get_batch_path().parent, u)
 
         # Drop selected index
         self._df.drop([index], inplace=True)
         # Reset indices so there are no 'jumps'
         self._df.reset_index(drop=True, inplace=True)
+        _build_uuid_index(self._df)
+        invalidate_dependency_graph(self._df)
         # Save new df to disc
-        self._df.to_pickle(self._df.paths.get_batch_path())
+        get_storage(self._df.paths.get_batch_path()).remove_row(self._df, u)
+
+    def _get_all_items(self) -> pd.DataFrame:
+        """uuid, item_name and outputs of the items in the batch file and in this DataFrame"""
+        columns = ["uuid", "item_name", "outputs"]
+        disk_df = load_batch(self._df.paths.get_batch_path(), columns=columns, lazy=True)
+        local_df = self._df.loc[~self._df["uuid"].isin(disk_df["uuid"]), columns]
+
+        return pd.concat([disk_df[columns], local_df], ignore_index=True)
+
+    def get_disk_usage(self, max_workers: int = 8) -> pd.DataFrame:
+        """
+        Get the disk usage of the batch items, and of the files in the batch dir that no longer belong to any item.
+        Orphaned files are left by items that were removed with ``remove_data=False``, failed runs and runfiles.
+        They can be removed with ``collect_garbage()``.
+
+        Parameters
+        ----------
+        max_workers: int
+            number of threads used to scan the batch dir
+
+        Returns
+        -------
+        pd.DataFrame
+            | one row per item output dir, runfile, or temp file, and for items without an output dir
+            | ``"path"``: path relative to the batch dir
+            | ``"orphaned"``: ``True`` if the path does not belong to any item, ``"reason"`` tells why
+            | ``"memmap"``, ``"hdf5"``, ``"projections"``, ``"shifts"``, ``"cache"``, ``"other"``: bytes used by
+              each file type
+            | ``"total"``: total bytes used
+
+        Examples
+        --------
+
+        .. code-block:: python
+
+            usage = df.caiman.get_disk_usage()
+
+            # bytes used by each file type
+            usage[["memmap", "hdf5", "projections", "shifts", "cache", "other"]].sum()
+
+            # bytes that can be reclaimed
+            usage.loc[usage["orphaned"], "total"].sum()
+
+        """
+        batch_path = self._df.paths.get_batch_path()
+        return scan_batch_dir(
+            batch_path, self._get_all_items(), get_other_batch_uuids(batch_path), max_workers=max_workers
+        )
+
+    def collect_garbage(
+            self,
+            dry_run: bool = False,
+            min_age: float = 3600,
+            background: bool = False,
+            max_workers: int = 8,
+    ) -> Union[pd.DataFrame, Future]:
+        """
+        Remove the orphaned files reported by ``get_disk_usage()``.
+
+        The batch file, its lock and journal files, the results of existing items, the output dirs of other batch
+        files in the same dir, and files that were not created by mesmerize are never removed.
+
+        Parameters
+        ----------
+        dry_run: bool
+            if ``True`` only return what would be removed
+
+        min_age: float
+            only remove orphaned files and dirs that were not modified in the last ``min_age`` seconds, so that
+            items that are being added or run by another process are not affected
+
+        background: bool
+            if ``True`` return immediately, files are removed in a background thread
+
+        max_workers: int
+            number of threads used to scan the batch dir and remove files
+
+        Returns
+        -------
+        pd.DataFrame or Future
+            | the rows of ``get_disk_usage()`` that were removed, or that would be removed if ``dry_run=True``
+            | if ``background=True``, a ``concurrent.futures.Future`` that returns the DataFrame
+
+        """
+        batch_path = self._df.paths.get_batch_path()
+        items = self._get_all_items()
+
+        def collect() -> pd.DataFrame:
+            usage = scan_batch_dir(batch_path, items, get_other_batch_uuids(batch_path), max_workers=max_workers)
+            removed = remove_garbage(batch_path, usage, min_age=min_age, dry_run=dry_run, max_workers=max_workers)
+            if not dry_run:
+                for path in removed["path"]:
+                    clear_path_cache(batch_path.parent, path)
+            return removed
+
+        if not background:
+            return collect()
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        future = executor.submit(collect)
+        executor.shutdown(wait=False)
+        return future
+
+    def get_stage_timings(
+            self,
+            items: Optional[Union[List[Union[int, str, UUID]], pd.Series]] = None,
+            summary: bool = False,
+    ) -> pd.DataFrame:
+        """
+        Time and resources used by each stage of the algorithms, such as ``"memmap"``, ``"fit"``, or
+        ``"evaluate_components"``. They are recorded in ``outputs["stage_metrics"]`` of every item that is run,
+        items that were run with an older version are skipped.
+
+        Parameters
+        ----------
+        items: list or pd.Series, optional
+            | list of numerical indices or UUIDs, or a boolean Series to select rows of the DataFrame
+            | if ``None`` all items are used
+
+        summary: bool
+            aggregate the stages of the items by algo and stage
+
+        Returns
+        -------
+        pd.DataFrame
+            | one row per item and stage with the columns ``"uuid"``, ``"item_name"``, ``"algo"``, ``"stage"``,
+              ``"wall_time"`` and ``"cpu_time"`` in seconds, ``"peak_rss"``, ``"read_bytes"``, and
+              ``"write_bytes"`` in bytes, and ``"success"``
+            | if ``summary=True`` one row per algo and stage with the number of items, the total and mean wall
+              time, the fraction of the algo's total wall time, the total and mean cpu time, the largest peak
+              memory, and the total bytes read and written, sorted by total wall time
+
+        Examples
+        --------
+
+        .. code-block:: python
+
+            # which stages take the most time
+            df.caiman.get_stage_timings(summary=True)
+
+            # how the parameters of CNMF items affect the duration of the fit
+            timings = df.caiman.get_stage_timings(df["algo"] == "cnmf")
+            timings[timings["stage"] == "fit"].sort_values("wall_time")
+
+        """
+        if items is None:
+            indices = range(self._df.index.size)
+        else:
+            indices = self._get_indices(items)
+
+        rows = list()
+        for i in indices:
+            outputs = self._df["outputs"].iat[i]
+            if outputs is None or outputs.get("stage_metrics") is None:
+                continue
+            for stage, metrics in outputs["stage_metrics"].items():
+                rows.append(
+                    {
+                        "uuid": self._df["uuid"].iat[i],
+                        "item_name": self._df["item_name"].iat[i],
+                        "algo": self._df["algo"].iat[i],
+                        "stage": stage,
+                        **{field: metrics.get(field, np.nan) for field in STAGE_METRICS_FIELDS},
+                        "success": bool(outputs["success"]),
+                    }
+                )
+
+        timings = pd.DataFrame(
+            rows, columns=["uuid", "item_name", "algo", "stage", *STAGE_METRICS_FIELDS, "success"]
+        )
+
+        if not summary:
+            return timings
+
+        grouped = timings.groupby(["algo", "stage"], sort=False)
+        summary_df = grouped.agg(
+            n_items=("uuid", "nunique"),
+            wall_time_total=("wall_time", "sum"),
+            wall_time_mean=("wall_time", "mean"),
+            cpu_time_total=("cpu_time", "sum"),
+            cpu_time_mean=("cpu_time", "mean"),
+            peak_rss_max=("peak_rss", "max"),
+            read_bytes_total=("read_bytes", "sum"),
+            write_bytes_total=("write_bytes", "sum"),
+        ).reset_index()
+
+        algo_totals = summary_df.groupby("algo")["wall_time_total"].transform("sum")
+        summary_df.insert(
+            summary_df.columns.get_loc("wall_time_mean") + 1,
+            "wall_time_fraction",
+            summary_df["wall_time_total"] / algo_totals,
+        )
+
+        return summary_df.sort_values("wall_time_total", ascending=False, ignore_index=True)
+
+    def _get_indices(self, items: Union[List[Union[int, str, UUID]], pd.Series]) -> List[int]:
+        """numerical indices of a list of numerical indices or UUIDs, or of a boolean Series"""
+        if isinstance(items, pd.Series) and items.dtype == bool:
+            return list(np.flatnonzero(items.values))
+
+        return [i if isinstance(i, int) else _get_uuid_position(self._df, i) for i in items]
+
+    def run_many(
+            self,
+            items: Union[List[Union[int, str, UUID]], pd.Series],
+            n_processes: Optional[Union[int, Dict[str, int], Callable[[pd.Series], int]]] = None,
+            max_cores: Optional[int] = None,
+            backend: str = COMPUTE_BACKEND_SUBPROCESS,
+            progress: bool = True,
+    ) -> BatchRunner:
+        """
+        Run many batch items in parallel external processes.
+        Returns immediately, use the returned ``BatchRunner`` to check progress, wait, or cancel.
+
+        Items are started as soon as enough cores are free, for example on a 64 core machine eight CNMF items
+        that use 8 processes each run at the same time.
+
+        Items whose parent is also run, see ``get_dependency_graph()``, start as soon as their parent finished
+        successfully and are skipped if it failed, independent items run concurrently. Items on the longest
+        chains of estimated run time are started first so that the whole batch finishes as early as possible.
+        Run times are estimated from previous runs of the items and from the sizes of their input movies.
+
+        Parameters
+        ----------
+        items: list or pd.Series
+            list of numerical indices or UUIDs, or a boolean Series to select rows of the DataFrame
+
+        n_processes: int, dict, or callable, optional
+            | number of processes used by each item, it is also the number of cores the item needs
+            | a dict of UUID -> number of processes, or a function that takes the item's Series and returns the
+              number of processes can be used to set it per item
+            | if ``None`` the ``MESMERIZE_N_PROCESSES`` environment variable is used, default ``n_cpus - 1``
+
+        max_cores: int, optional
+            | total number of cores used by the items that are running, default is the number of cpus
+            | with the ``"slurm"`` backend it is the number of cores that the submitted jobs can use in total,
+              by default all items are submitted and SLURM schedules them
+
+        backend: str
+            | backend used to run each item, ``"subprocess"``, ``"slurm"``, or ``"worker"``
+            | with ``"slurm"`` each item is a separate job that is polled, use ``run_array()`` to submit many
+              independent items, such as a parameter sweep, as a single array job
+
+        progress: bool
+            show a progress bar
+
+        Returns
+        -------
+        BatchRunner
+            | ``runner.futures``: dict of UUID -> ``concurrent.futures.Future``, the result is the item's
+              ``outputs``, the Future raises if the item was unsuccessful
+            | ``runner.wait()``, ``runner.cancel()``
+
+        Examples
+        --------
+
+        .. code-block:: python
+
+            # run all CNMF items with 8 processes each
+            runner = df.caiman.run_many(df["algo"] == "cnmf", n_processes=8)
+
+            # check progress
+            print(runner)
+
+            # wait until all items are done and load the results
+            runner.wait()
+            df = df.caiman.reload_from_disk()
+
+        """
+        items = [self._df.iloc[i] for i in self._get_indices(items)]
+
+        if n_processes is None and backend == COMPUTE_BACKEND_SLURM:
+            n_processes = lambda s: estimate_resources(s)["cpus_per_task"]
+        elif n_processes is None:
+            n_processes = get_n_processes()
+
+        if isinstance(n_processes, int):
+            item_n_processes = [n_processes] * len(items)
+        elif isinstance(n_processes, dict):
+            item_n_processes = [n_processes.get(s["uuid"], get_n_processes()) for s in items]
+        else:
+            item_n_processes = [n_processes(s) for s in items]
+
+        if max_cores is None and backend == COMPUTE_BACKEND_SLURM:
+            max_cores = sum(item_n_processes)
+        elif max_cores is None:
+            max_cores = os.cpu_count()
+
+        # parents that are also run
+        graph = self.get_dependency_graph()
+        uuids = {s["uuid"] for s in items}
+        parents = {s["uuid"]: graph.parent(s["uuid"]) for s in items if graph.parent(s["uuid"]) in uuids}
+
+        # priority of an item is the estimated time until it and all of its descendants are done
+        durations = dict(zip([s["uuid"] for s in items], estimate_durations(items, self._df)))
+        priorities = dict()
+        for u in reversed(graph.topological_order(uuids)):
+            children = [priorities[c] for c in graph.children(u) if c in uuids]
+            priorities[u] = durations[u] + max(children, default=0)
+
+        return BatchRunner(
+            items,
+            n_processes=item_n_processes,
+            max_cores=max_cores,
+            parents=parents,
+            priorities=[priorities[s["uuid"]] for s in items],
+            backend=backend,
+            progress=progress,
+        )
+
+    def run_all(self, skip_finished: bool = True, **kwargs) -> BatchRunner:
+        """
+        Run all batch items in parallel external processes, see ``run_many()``
+
+        Parameters
+        ----------
+        skip_finished: bool
+            do not run items that have already been run
+
+        **kwargs
+            passed to ``run_many()``
+
+        """
+        if skip_finished:
+            items = self._df["outputs"].map(lambda outputs: outputs is None).astype(bool)
+        else:
+            items = pd.Series(True, index=self._df.index)
+
+        return self.run_many(items, **kwargs)
+
+    def run_array(
+            self,
+            items: Optional[Union[List[Union[int, str, UUID]], pd.Series]] = None,
+            max_concurrent: Optional[int] = None,
+            wait: bool = False,
+            sbatch_args: Optional[List[str]] = None,
+            poll_interval: float = 10,
+            **kwargs
+    ) -> SlurmJob:
+        """
+        Submit batch items as one SLURM array job, each task of the job runs one item. Useful to fan out a
+        parameter sweep across the nodes of a cluster. The items should not depend on each other, use
+        ``run_many(backend="slurm")`` to run items after their parents.
+
+        Every task requests the largest resources estimated for the items, see ``CaimanSeriesExtensions.run()``.
+        Jobs are submitted with the commands set by ``set_slurm_commands()``.
+
+        Parameters
+        ----------
+        items: list or pd.Series, optional
+            | list of numerical indices or UUIDs, or a boolean Series to select rows of the DataFrame
+            | if ``None`` all items that have not been run are submitted
+
+        max_concurrent: int, optional
+            maximum number of tasks that run at the same time
+
+        wait: bool
+            wait until all tasks are done
+
+        sbatch_args: List[str], optional
+            other sbatch options, for example ``["--partition=gpu", "--account=lab"]``
+
+        poll_interval: float
+            seconds between polling the job state
+
+        **kwargs
+            ``cpus_per_task``, ``mem`` in megabytes, or ``time`` to override the estimated resources
+
+        Returns
+        -------
+        SlurmJob
+            | ``job.states``: dict of UUID -> SLURM state of the item's task
+            | ``job.wait()``, ``job.poll()``, ``job.terminate()``
+            | the results are written to the batch dir by the tasks, use ``reload_from_disk()`` or
+              ``sync_results()`` to load them
+            | the log of each task is written to the output dir of its item
+
+        Examples
+        --------
+
+        .. code-block:: python
+
+            # parameter sweep
+            df.caiman.add_items(algo="cnmf", item_name="sweep", input_movie_path=df.iloc[0], grid=params_grid)
+
+            # submit all items that have not been run, at most 100 run at the same time
+            job = df.caiman.run_array(max_concurrent=100, sbatch_args=["--partition=compute"])
+
+            job.wait()
+            df = df.caiman.reload_from_disk()
+
+        """
+        if get_parent_raw_data_path() is None:
+            raise ValueError(
+                "parent raw data path is not set, you must set it using:\n"
+                "`set_parent_raw_data_path()`"
+            )
+
+        if items is None:
+            items = self._df["outputs"].map(lambda outputs: outputs is None).astype(bool)
+        items = [self._df.iloc[i] for i in self._get_indices(items)]
+        if len(items) == 0:
+            raise ValueError("No items to submit")
+
+        resources = {
+            **combine_resources([estimate_resources(s) for s in items]),
+            **{k: v for k, v in kwargs.items() if k in ["cpus_per_task", "mem", "time"]},
+        }
+
+        batch_path = self._df.paths.get_batch_path()
+        # the algorithms use all the cores of the task
+        runfiles = [s.caiman._make_runfile(batch_path, resources["cpus_per_task"]) for s in items]
+
+        # the logs of each task go in the output dir of its item, like with ``run(backend="slurm")``
+        log_dirs = [batch_path.parent.joinpath(s["uuid"]) for s in items]
+        for log_dir in log_dirs:
+            log_dir.mkdir(exist_ok=True)
+
+        script_dir = batch_path.parent.joinpath(SLURM_DIR)
+        script_dir.mkdir(exist_ok=True)
+        script_path = make_sbatch_script(
+            filename=script_dir.joinpath(f"{uuid4()}.sbatch"),
+            runfiles=runfiles,
+            job_name=f"mesmerize-{batch_path.stem}",
+            log_dir=log_dirs,
+            max_concurrent=max_concurrent,
+            sbatch_args=sbatch_args,
+            **resources,
+        )
+
+        commands = get_slurm_commands()
+        job_id = commands.submit(script_path, cwd=batch_path.parent)
+
+        job = SlurmJob(
+            job_id,
+            batch_path,
+            [s["uuid"] for s in items],
+            commands,
+            array=len(items) > 1,
+            poll_interval=poll_interval,
+        )
+        if wait:
+            job.wait()
+
+        return job
+
+    def warm_cache(
+            self,
+            accessors: Union[List[str], Dict[str, dict]] = ("get_output", "get_contours", "get_temporal"),
+            items: Optional[Union[List[Union[int, str, UUID]], pd.Series]] = None,
+            max_workers: int = 4,
+            backend: str = "thread",
+            budget: Optional[Union[int, str]] = None,
+            progress: bool = True,
+    ) -> CacheWarmer:
+        """
+        Populate the CNMF cache in the background, for example to pre-load results before reviewing a batch.
+        Returns immediately, use the returned ``CacheWarmer`` to check progress, wait, or cancel.
+
+        Parameters
+        ----------
+        accessors: list of str or dict
+            | names of the ``cnmf`` extensions to call for each item, such as ``"get_contours"``
+            | a dict of name -> kwargs can be used to pass kwargs, for example
+              ``{"get_contours": {"component_indices": "good"}}``
+
+        items: list or pd.Series, optional
+            | list of numerical indices or UUIDs, or a boolean Series to select rows of the DataFrame
+            | if ``None`` all successful ``cnmf`` and ``cnmfe`` items are used
+
+        max_workers: int
+            number of threads or processes
+
+        backend: str
+            | ``"thread"``: populate the in-memory cache, and the disk cache if it is enabled
+            | ``"process"``: populate only the disk cache using a process pool, requires that the disk cache is
+              enabled using ``cnmf_cache.set_disk_cache()``
+
+        budget: int, str, or None
+            max bytes to add to the in-memory cache, such as ``"2G"``, default is the cache's size limit.
+            Warm-up also stops as soon as the cache has to evict entries to make space.
+
+        progress: bool
+            show a progress bar
+
+        Returns
+        -------
+        CacheWarmer
+            call ``wait()`` to block until warm-up is finished, or ``cancel()`` to stop it
+
+        Examples
+        --------
+
+        .. code-block:: python
+
+            from mesmerize_core import *
+
+            df = load_batch("/path/to/batch.pickle")
+
+            warmer = df.caiman.warm_cache(["get_output", "get_contours"])
+
+            # check progress
+            print(warmer)
+
+            # stop warm-up
+            warmer.cancel()
+
+        """
+        if not isinstance(accessors, dict):
+            accessors = {a: dict() for a in accessors}
+
+        for accessor in accessors.keys():
+            if accessor.startswith("_") or not callable(getattr(CNMFExtensions, accessor, None)):
+                raise AttributeError(f"`{accessor}` is not a cnmf extension")
+
+        if items is None:
+            indices = [
+                i for i in range(self._df.index.size)
+                if self._df.iloc[i]["algo"] in ["cnmf", "cnmfe"]
+                and self._df.iloc[i]["outputs"] is not None
+                and self._df.iloc[i]["outputs"]["success"]
+            ]
+        else:
+            indices = self._get_indices(items)
+
+        tasks = list()
+        for i in indices:
+            series = self._df.iloc[i]
+            for accessor, kwargs in accessors.items():
+                label = f"{series['uuid']}: {accessor}"
+                if backend == "process":
+                    if cnmf_cache.disk_cache is None:
+                        raise ValueError(
+                            "The disk cache must be enabled using `cnmf_cache.set_disk_cache()` "
+                            "to warm the cache with the 'process' backend"
+                        )
+                    data_path = get_parent_raw_data_path()
+                    task = partial(
+                        _warm_disk_cache_task,
+                        str(self._df.paths.get_batch_path()),
+                        None if data_path is None else str(data_path),
+                        series["uuid"],
+                        accessor,
+                        kwargs,
+                        cnmf_cache.disk_cache.size,
+                    )
+                else:
+                    task = partial(_warm_cache_task, series, accessor, kwargs)
+                tasks.append((label, task))
+
+        return CacheWarmer(
+            tasks,
+            cache=cnmf_cache,
+            max_workers=max_workers,
+            backend=backend,
+            budget=budget,
+            progress=progress,
+        )
 
     @warning_experimental("This feature is new and the might improve in the future")
     def get_params_diffs(self, algo: str, item_name: str) -> pd.Series:
@@ -309,19 +1153,7 @@ class CaimanDataFrameExtensions:
                 "mcorr batch items, CNMF(E) items do not have children."
             )
 
-        # get the output path for this mcorr item
-        output_path = self._df.iloc[index].mcorr.get_output_path()
-
-        # see if this output path shows up in the input_movie_path of any other batch item
-        children = list()
-        for i, r in self._df.iterrows():
-            try:
-                _potential_child = r.caiman.get_input_movie_path()
-            except FileNotFoundError:  # assume it is not a child anyways
-                continue
-            if _potential_child == output_path:
-                children.append(r["uuid"])
-        return children
+        return self.get_dependency_graph().children(self._df.iloc[index]["uuid"])
 
     @warning_experimental("This feature will change in the future and directly return the "
                           " pandas.Series (row, ie. batch item row) instead of the UUID")
@@ -348,24 +1180,24 @@ class CaimanDataFrameExtensions:
             | if ``None``, the batch item at the provided ``index`` has no parent within the batch dataframe.
 
         """
-        input_movie_path = self._df.iloc[index].caiman.get_input_movie_path()
+        return self.get_dependency_graph().parent(self._df.iloc[index]["uuid"])
 
-        for i, r in self._df.iterrows():
-            if not r["algo"] == "mcorr":
-                continue
-            try:
-                _potential_parent = r.mcorr.get_output_path()
-            except (FileNotFoundError, BatchItemUnsuccessfulError, BatchItemNotRunError):
-                continue  # can't be a parent if it was unsuccessful
+    def get_dependency_graph(self) -> DependencyGraph:
+        """
+        Get the graph of parent -> children relations between the batch items, for example to get all the items
+        that depend on a *motion correction* item or to order items so that parents come before their children.
 
-            if _potential_parent == input_movie_path:
-                return r["uuid"]
+        The graph is built from the paths in the DataFrame and cached until items are added, removed, or their
+        results are synced.
 
+        Returns
+        -------
+        DependencyGraph
+            | ``graph.parent(uuid)``, ``graph.children(uuid)``, ``graph.descendants(uuid)``
+            | ``graph.topological_order(uuids)``
 
-class DummyProcess:
-    """Dummy process for local backend"""
-    def wait(self):
-        pass
+        """
+        return get_dependency_graph(self._df)
 
 
 @pd.api.extensions.register_series_accessor("caiman")
@@ -376,7 +1208,7 @@ class CaimanSeriesExtensions:
 
     def __init__(self, s: pd.Series):
         self._series = s
-        self.process: Popen = None
+        self.process: RunFuture = None
 
     def _run_local(
             self,
@@ -384,60 +1216,116 @@ class CaimanSeriesExtensions:
             batch_path: Path,
             uuid: UUID,
             data_path: Union[Path, None],
+            n_processes: Optional[int] = None,
     ):
         algo_module = getattr(algorithms, algo)
+
+        # passed as an argument, concurrent runs share the environment of this process
         algo_module.run_algo(
             batch_path=str(batch_path),
             uuid=str(uuid),
-            data_path=str(data_path)
+            data_path=str(data_path),
+            n_processes=n_processes,
         )
 
-        return DummyProcess()
-
     def _run_subprocess(
         self,
         runfile_path: str,
-        wait: bool,
         **kwargs
-    ):
+    ) -> Popen:
 
         # Get the dir that contains the input movie
         parent_path = self._series.paths.resolve(self._series.input_movie_path).parent
         if not IS_WINDOWS:
-            self.process = Popen(runfile_path, cwd=parent_path)
+            return Popen(runfile_path, cwd=parent_path)
         else:
-            self.process = Popen(f"powershell {runfile_path}", cwd=parent_path)
-
-        if wait:
-            self.process.wait()
-
-        return self.process
+            return Popen(f"powershell {runfile_path}", cwd=parent_path)
 
     def _run_slurm(
         self,
         runfile_path: str,
+        cpus_per_task: int,
+        mem: int,
+        time: str,
+        sbatch_args: Optional[List[str]] = None,
+        poll_interval: float = 10,
         **kwargs
     ):
-        raise NotImplementedError("Not yet implemented, just a placeholder")
-        # submission_command = (
-        #     f'sbatch --ntasks=1 --cpus-per-task=16 --mem=90000 --wrap="{runfile_path}"'
-        # )
-        #
-        # Popen(submission_command.split(" "))
+        batch_path = self._series.paths.get_batch_path()
+        u = self._series["uuid"]
+        batch_path.parent.joinpath(u).mkdir(exist_ok=True)
+
+        script_path = make_sbatch_script(
+            filename=batch_path.parent.joinpath(f"{u}.sbatch"),
+            runfiles=[runfile_path],
+            job_name=f"mesmerize-{self._series['algo']}-{u}",
+            cpus_per_task=cpus_per_task,
+            mem=mem,
+            time=time,
+            log_dir=batch_path.parent.joinpath(u),
+            sbatch_args=sbatch_args,
+        )
+
+        commands = get_slurm_commands()
+        job_id = commands.submit(script_path, cwd=batch_path.parent)
+
+        return SlurmJob(job_id, batch_path, [u], commands, poll_interval=poll_interval)
+
+    def _run_worker(self, address: Optional[str] = None, n_processes: Optional[int] = None, **kwargs) -> WorkerJob:
+        client = get_worker(address)
+        if client is None:
+            client = start_worker(address=address)
+
+        return client.submit(
+            algo=self._series["algo"],
+            batch_path=self._series.paths.get_batch_path(),
+            uuid=self._series["uuid"],
+            data_path=get_parent_raw_data_path(),
+            n_processes=n_processes,
+        )
+
+    def _make_runfile(self, batch_path: Path, n_processes: Optional[int] = None) -> str:
+        """make the runfile in the batch dir using this Series' UUID as the filename"""
+        if IS_WINDOWS:
+            runfile_ext = ".ps1"
+        else:
+            runfile_ext = ".runfile"
+        runfile_path = str(
+            batch_path.parent.joinpath(self._series["uuid"] + runfile_ext)
+        )
+
+        args_str = f"--batch-path {batch_path} --uuid {self._series.uuid}"
+        if get_parent_raw_data_path() is not None:
+            args_str += f" --data-path {get_parent_raw_data_path()}"
+
+        # make the runfile
+        return make_runfile(
+            module_path=os.path.abspath(
+                ALGO_MODULES[self._series["algo"]].__file__
+            ),  # caiman algorithm
+            filename=runfile_path,  # path to create runfile
+            args_str=args_str,
+            env=None if n_processes is None else {"MESMERIZE_N_PROCESSES": str(n_processes)},
+        )
 
     @cnmf_cache.invalidate()
     def run(
             self,
             backend: Optional[str] = None,
             wait: bool = True,
+            n_processes: Optional[int] = None,
             **kwargs
-    ):
+    ) -> RunFuture:
         """
         Run a CaImAn algorithm in an external process using the chosen backend
 
         NoRMCorre, CNMF, or CNMFE will be run for this Series.
         Each Series (DataFrame row) has a `input_movie_path` and `params` for the algorithm
 
+        Returns a ``RunFuture``, a ``concurrent.futures.Future`` whose result is the item's ``outputs``. Use
+        ``wait=False`` to return right away and ``done()``, ``result()``, ``exception()``, ``cancel()``, or
+        ``add_done_callback()`` to follow the run, or ``await`` it in asyncio, see ``run_async()``.
+
         Parameters
         ----------
         backend: str, optional
@@ -445,10 +1333,47 @@ class CaimanSeriesExtensions:
             ``"local"`` since Windows is inconsistent in the way it launches subprocesses
 
         wait: bool, default ``True``
-            if using the ``"subprocess"`` backend, call ``wait()`` on the ``Popen`` instance before returning it
+            | wait until the item has finished before returning, exceptions raised by the algorithm with the
+              ``"local"`` backend are raised
+            | items of the ``"local"`` backend are run one at a time in a background thread, only items that have not
+              started can be cancelled
+
+        n_processes: int, optional
+            number of processes used by the algorithm, overrides the ``MESMERIZE_N_PROCESSES`` environment variable
+            for this item
 
         **kwargs
-            any kwargs to pass to the backend
+            | any kwargs to pass to the backend
+            | ``"slurm"`` backend: ``cpus_per_task``, ``mem`` in megabytes and ``time`` override the resources
+              estimated from the algo and the size of the input movie, ``sbatch_args`` is a list of other sbatch
+              options such as ``["--partition=gpu"]``, ``poll_interval`` is the number of seconds between polling
+              the job state. Jobs are submitted with the commands set by ``set_slurm_commands()``.
+            | ``"worker"`` backend: ``address`` of the worker service. The item is run by the worker service which
+              keeps CaImAn imported and its pool of processes running between items, this avoids the startup cost
+              of every item. The service is started with default settings if it is not running, use
+              ``start_worker()`` to configure it.
+
+        Returns
+        -------
+        RunFuture
+            | ``result()`` returns the item's ``outputs``, it raises ``BatchItemUnsuccessfulError`` if the item
+              was unsuccessful
+            | ``wait()``, ``poll()``, ``returncode``, and ``terminate()`` work like they do for ``Popen``
+            | ``process`` is the ``Popen``, ``SlurmJob``, or ``WorkerJob`` of the backend
+
+        Examples
+        --------
+
+        .. code-block:: python
+
+            # submit items and react as they finish
+            futures = [r.caiman.run(wait=False) for i, r in df.iterrows()]
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    outputs = future.result()
+                except BatchItemUnsuccessfulError as e:
+                    print(e)
+
         """
         if get_parent_raw_data_path() is None:
             raise ValueError(
@@ -469,46 +1394,89 @@ class CaimanSeriesExtensions:
             )
 
         batch_path = self._series.paths.get_batch_path()
+        # outputs written before are from a previous run of the item
+        submit_time = datetime.now().timestamp()
 
         if backend == COMPUTE_BACKEND_LOCAL:
             print(f"Running {self._series.uuid} with local backend")
-            return self._run_local(
+            process = _LOCAL_EXECUTOR.submit(
+                self._run_local,
                 algo=self._series["algo"],
                 batch_path=batch_path,
                 uuid=self._series["uuid"],
                 data_path=get_parent_raw_data_path(),
+                n_processes=n_processes,
+            )
+            self.process = RunFuture(batch_path, self._series["uuid"], process, submit_time=submit_time)
+            process.add_done_callback(self.process._local_done)
+
+            if wait:
+                # errors of the algorithm are raised in the caller's thread
+                process.result()
+
+        elif backend == COMPUTE_BACKEND_WORKER:
+            process = self._run_worker(n_processes=n_processes, **kwargs)
+            self.process = monitor_process(
+                RunFuture(batch_path, self._series["uuid"], process, submit_time=submit_time)
             )
 
-        # Create the runfile in the batch dir using this Series' UUID as the filename
-        if IS_WINDOWS:
-            runfile_ext = ".ps1"
         else:
-            runfile_ext = ".runfile"
-        runfile_path = str(
-            batch_path.parent.joinpath(self._series["uuid"] + runfile_ext)
-        )
+            process = self._run_backend(backend, batch_path, n_processes, kwargs)
+            self.process = monitor_process(
+                RunFuture(batch_path, self._series["uuid"], process, submit_time=submit_time)
+            )
 
-        args_str = f"--batch-path {batch_path} --uuid {self._series.uuid}"
-        if get_parent_raw_data_path() is not None:
-            args_str += f" --data-path {get_parent_raw_data_path()}"
+        if wait:
+            self.process.wait()
 
-        # make the runfile
-        runfile_path = make_runfile(
-            module_path=os.path.abspath(
-                ALGO_MODULES[self._series["algo"]].__file__
-            ),  # caiman algorithm
-            filename=runfile_path,  # path to create runfile
-            args_str=args_str,
-        )
+        return self.process
+
+    def _run_backend(self, backend: str, batch_path: Path, n_processes: Optional[int], kwargs: dict):
+        """make the runfile and run it with the ``"subprocess"`` or ``"slurm"`` backend"""
+        if backend == COMPUTE_BACKEND_SLURM:
+            resources = estimate_resources(self._series, n_processes)
+            kwargs = {**resources, **kwargs}
+            # the algorithm uses all the cores of the job
+            n_processes = kwargs["cpus_per_task"]
+
+        runfile_path = self._make_runfile(batch_path, n_processes)
         try:
-            self.process = getattr(self, f"_run_{backend}")(
-                runfile_path, wait=wait, **kwargs
-            )
+            return getattr(self, f"_run_{backend}")(runfile_path, **kwargs)
         except:
             with open(runfile_path, "r") as f:
                 raise ValueError(f.read())
 
-        return self.process
+    async def run_async(
+            self,
+            backend: Optional[str] = None,
+            n_processes: Optional[int] = None,
+            **kwargs
+    ) -> dict:
+        """
+        Run the item from asyncio, see ``run()``. The item is submitted without blocking the event loop.
+
+        Returns
+        -------
+        dict
+            the item's ``outputs``, raises ``BatchItemUnsuccessfulError`` if the item was unsuccessful
+
+        Examples
+        --------
+
+        .. code-block:: python
+
+            outputs = await df.iloc[0].caiman.run_async()
+
+            # run items concurrently
+            results = await asyncio.gather(*[r.caiman.run_async() for i, r in df.iterrows()], return_exceptions=True)
+
+        """
+        loop = asyncio.get_running_loop()
+        # starting the worker service or submitting to SLURM can block
+        future = await loop.run_in_executor(
+            None, partial(self.run, backend=backend, wait=False, n_processes=n_processes, **kwargs)
+        )
+        return await future
 
     def get_input_movie_path(self) -> Path:
         """
@@ -0,0 +1,503 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from statistics import median
+from concurrent.futures import Future, InvalidStateError, wait as wait_futures
+from pathlib import Path
+from subprocess import TimeoutExpired
+from typing import *
+
+import pandas as pd
+from tqdm import tqdm
+
+from ._batch_exceptions import BatchItemUnsuccessfulError, DependencyError
+from ..batch_storage import read_item_outputs
+from ..batch_utils import COMPUTE_BACKEND_SUBPROCESS, COMPUTE_BACKEND_SLURM, COMPUTE_BACKEND_WORKER
+
+
+def _parse_duration(algo_duration: Optional[str]) -> Optional[float]:
+    """``"12.3 sec"`` -> 12.3"""
+    if algo_duration is None:
+        return None
+    try:
+        return float(str(algo_duration).split(" ")[0])
+    except ValueError:
+        return None
+
+
+def estimate_durations(items: List[pd.Series], df: pd.DataFrame) -> List[float]:
+    """
+    Estimate how long each item takes to run, only the relative durations matter.
+
+    Items that were run before use their previous duration. Otherwise the duration is estimated from the size
+    of the input movie and the seconds per byte of the items of the same algorithm in ``df`` that have been run.
+    If no item has been run the size of the input movie is used.
+    """
+    def get_size(series: pd.Series) -> float:
+        try:
+            return float(os.stat(series.caiman.get_input_movie_path()).st_size)
+        except (FileNotFoundError, OSError):
+            return 1.0
+
+    # algo -> seconds per byte of the items that were run
+    rates: Dict[str, List[float]] = dict()
+    if "algo_duration" in df.columns:
+        for i in range(df.index.size):
+            series = df.iloc[i]
+            duration = _parse_duration(series["algo_duration"])
+            if duration is not None:
+                rates.setdefault(series["algo"], list()).append(duration / get_size(series))
+    all_rates = [r for algo_rates in rates.values() for r in algo_rates]
+
+    durations = list()
+    for series in items:
+        duration = _parse_duration(series.get("algo_duration"))
+        if duration is None:
+            if series["algo"] in rates.keys():
+                duration = median(rates[series["algo"]]) * get_size(series)
+            elif len(all_rates) > 0:
+                duration = median(all_rates) * get_size(series)
+            else:
+                duration = get_size(series)
+        durations.append(duration)
+
+    return durations
+
+
+class RunFuture(Future):
+    """
+    Handle of a batch item that is being run, returned by ``CaimanSeriesExtensions.run()``.
+
+    It is a ``concurrent.futures.Future``, the result is the item's ``outputs`` dict. If the item was unsuccessful
+    ``result()`` raises ``BatchItemUnsuccessfulError`` with the traceback of the algorithm. It can be awaited in
+    asyncio, and it has the ``wait()``, ``poll()``, ``returncode``, ``terminate()`` and ``kill()`` of ``Popen``.
+
+    The processes of all items are polled by a single background thread.
+    """
+
+    def __init__(
+            self,
+            batch_path: Union[str, Path],
+            uuid: str,
+            process: Any = None,
+            submit_time: Optional[float] = None,
+    ):
+        super().__init__()
+        self.batch_path = Path(batch_path)
+        self.uuid = str(uuid)
+        #: ``Popen``, ``SlurmJob``, or ``WorkerJob`` that runs the item, a ``Future`` for the local backend
+        self.process = process
+        #: time at which the item was submitted, outputs written before are from a previous run of the item
+        self.submit_time: float = time.time() if submit_time is None else submit_time
+
+    def _finish(self):
+        """called when the process exited, the result is read from the item's outputs"""
+        outputs = read_item_outputs(self.batch_path, self.uuid, since=self.submit_time)
+        try:
+            if outputs is None:
+                self.set_exception(
+                    RuntimeError(
+                        f"Batch item {self.uuid} exited with code {self.returncode} without writing its outputs"
+                    )
+                )
+            elif not outputs["success"]:
+                self.set_exception(
+                    BatchItemUnsuccessfulError(
+                        f"Batch item was unsuccessful, traceback from subprocess:\n{outputs['traceback']}"
+                    )
+                )
+            else:
+                self.set_result(outputs)
+        except InvalidStateError:
+            # cancelled
+            pass
+
+    def _local_done(self, future: Future):
+        if future.cancelled():
+            self._cancel()
+        elif future.exception() is not None:
+            try:
+                self.set_exception(future.exception())
+            except InvalidStateError:
+                pass
+        else:
+            self._finish()
+
+    def running(self) -> bool:
+        return not self.done()
+
+    def cancel(self) -> bool:
+        """
+        Stop the item, returns ``False`` if the item has already finished. Items of the ``"local"`` backend can
+        only be stopped if they have not started.
+        """
+        if isinstance(self.process, Future):
+            # an item that has started cannot be stopped, its thread keeps running
+            if not self.process.cancel():
+                return False
+            return self._cancel()
+
+        if not self._cancel():
+            return False
+
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+        return True
+
+    @property
+    def returncode(self) -> Optional[int]:
+        """exit code of the process, ``None`` while it is running"""
+        if isinstance(self.process, Future):
+            if not self.process.done() or self.process.cancelled():
+                return None
+            return 1 if self.process.exception() is not None else 0
+        return self.process.returncode
+
+    def poll(self) -> Optional[int]:
+        """``returncode`` if the item has finished, otherwise ``None``"""
+        if not self.done():
+            return None
+        return self.returncode
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[int]:
+        """wait until the item has finished, returns ``returncode``"""
+        wait_futures([self], timeout)
+        if not self.done():
+            raise TimeoutExpired(f"batch item {self.uuid}", timeout)
+        return self.returncode
+
+    def terminate(self):
+        self.cancel()
+
+    def _cancel(self) -> bool:
+        if self.cancelled():
+            return True
+        if not super().cancel():
+            return False
+        # notify the waiters of ``concurrent.futures.wait()`` and ``as_completed()``
+        self.set_running_or_notify_cancel()
+        return True
+
+    def kill(self):
+        if isinstance(self.process, Future):
+            self.cancel()
+        elif self._cancel() and self.process.poll() is None:
+            self.process.kill()
+
+    def __await__(self):
+        return asyncio.wrap_future(self).__await__()
+
+    def __repr__(self):
+        if self.cancelled():
+            status = "cancelled"
+        elif not self.done():
+            status = "running"
+        elif self.exception() is not None:
+            status = "unsuccessful"
+        else:
+            status = "finished"
+        return f"<RunFuture {self.uuid}: {status}>"
+
+
+class _ProcessMonitor:
+    """polls the processes of all ``RunFuture`` in one thread, instead of a thread per process"""
+
+    #: seconds between polling, processes that have a ``poll_interval`` attribute are polled at that interval
+    interval: float = 0.2
+
+    def __init__(self):
+        # future -> time of the next poll
+        self._futures: Dict[RunFuture, float] = dict()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, future: RunFuture):
+        with self._lock:
+            self._futures[future] = time.time()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True, name="mesmerize-process-monitor")
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                due = [f for f, t in self._futures.items() if t <= time.time()]
+
+            for future in due:
+                try:
+                    returncode = future.process.poll()
+                except Exception:
+                    # for example squeue could not be reached, try again later
+                    returncode = None
+
+                with self._lock:
+                    # cancelled items are polled until their process has exited, so that the backend can write
+                    # their outputs and the process is reaped
+                    if returncode is None:
+                        interval = getattr(future.process, "poll_interval", self.interval)
+                        self._futures[future] = time.time() + interval
+                        continue
+                    self._futures.pop(future)
+
+                future._finish()
+
+            with self._lock:
+                if len(self._futures) == 0:
+                    self._thread = None
+                    return
+                timeout = max(min(self._futures.values()) - time.time(), 0)
+
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+
+_MONITOR = _ProcessMonitor()
+
+
+def monitor_process(future: RunFuture) -> RunFuture:
+    """finish the future when its process exits"""
+    _MONITOR.add(future)
+    return future
+
+
+class BatchRunner:
+    """
+    Runs batch items in external processes in the background, returned by ``CaimanDataFrameExtensions.run_many()``.
+
+    Every item needs a number of cores, items are started as soon as enough cores are free so that the machine is
+    never oversubscribed. Items whose parent is also being run, such as a CNMF item that uses the output of a
+    motion correction item, are started after the parent finished successfully and are skipped if it failed.
+    Ready items with the highest priority start first, items that need fewer cores can start before an item that
+    is waiting for cores.
+    """
+
+    def __init__(
+            self,
+            items: List[pd.Series],
+            n_processes: List[int],
+            max_cores: int,
+            parents: Optional[Dict[str, str]] = None,
+            priorities: Optional[List[float]] = None,
+            backend: str = COMPUTE_BACKEND_SUBPROCESS,
+            progress: bool = True,
+    ):
+        """
+        Parameters
+        ----------
+        items: List[pd.Series]
+            batch items to run
+
+        n_processes: List[int]
+            number of cores used by each item, an item that needs more than ``max_cores`` runs alone
+
+        max_cores: int
+            total number of cores that the running items can use
+
+        parents: Dict[str, str], optional
+            uuid -> uuid of the parent, for items whose parent is also in ``items``
+
+        priorities: List[float], optional
+            priority of each item, by default items are started in order
+
+        backend: str
+            backend passed to ``CaimanSeriesExtensions.run()``
+
+        progress: bool
+            show a progress bar
+        """
+        if backend not in [COMPUTE_BACKEND_SUBPROCESS, COMPUTE_BACKEND_SLURM, COMPUTE_BACKEND_WORKER]:
+            raise ValueError(
+                f"Items can only be run in parallel with the '{COMPUTE_BACKEND_SUBPROCESS}', "
+                f"'{COMPUTE_BACKEND_SLURM}', or '{COMPUTE_BACKEND_WORKER}' backend"
+            )
+
+        self._items = items
+        self._n_processes = [min(max(n, 1), max_cores) for n in n_processes]
+        self._parents = parents if parents is not None else dict()
+        self._priorities = priorities if priorities is not None else [0.0] * len(items)
+        self._max_cores = max_cores
+        self._backend = backend
+        self._progress = progress
+
+        #: uuid -> Future, the result is the item's ``outputs`` dict
+        self.futures: Dict[str, Future] = {s["uuid"]: Future() for s in items}
+        #: uuid -> RunFuture of the items that are running
+        self.processes: Dict[str, RunFuture] = dict()
+
+        self.n_done: int = 0
+        #: uuid -> exception, for items that failed or could not be started
+        self.errors: Dict[str, Exception] = dict()
+
+        self._cancel = threading.Event()
+        self._finished = threading.Event()
+        # uuids of items that finished, ``None`` to wake up the scheduler
+        self._events = queue.Queue()
+
+        self._thread = threading.Thread(target=self._run, daemon=True, name="mesmerize-batch-runner")
+        self._thread.start()
+
+    @property
+    def n_total(self) -> int:
+        return len(self._items)
+
+    def _start(self, series: pd.Series, n_processes: int) -> RunFuture:
+        return series.caiman.run(backend=self._backend, wait=False, n_processes=n_processes)
+
+    def _finish(self, series: pd.Series, process: RunFuture):
+        u = series["uuid"]
+        future = self.futures[u]
+
+        if process.cancelled():
+            e = RuntimeError(f"Batch item {u} was terminated")
+        elif process.exception() is not None:
+            e = process.exception()
+        else:
+            future.set_result(process.result())
+            return
+
+        self.errors[u] = e
+        future.set_exception(e)
+
+    def _is_ready(self, u: str) -> bool:
+        parent = self._parents.get(u)
+        if parent is None:
+            return True
+
+        future = self.futures[parent]
+        return future.done() and not future.cancelled() and future.exception() is None
+
+    def _skip_failed_children(self, pending: List[int], pbar: tqdm):
+        """items whose parent failed, was cancelled, or was skipped are skipped"""
+        skipped = True
+        while skipped:
+            skipped = False
+            for i in list(pending):
+                u = self._items[i]["uuid"]
+                parent = self._parents.get(u)
+                if parent is None:
+                    continue
+                future = self.futures[parent]
+                if not future.done() or (not future.cancelled() and future.exception() is None):
+                    continue
+
+                pending.remove(i)
+                e = DependencyError(f"Batch item {u} was not run because its parent {parent} did not succeed")
+                self.errors[u] = e
+                if self.futures[u].set_running_or_notify_cancel():
+                    self.futures[u].set_exception(e)
+                self.n_done += 1
+                pbar.update(1)
+                skipped = True
+
+    def _run(self):
+        try:
+            self._schedule()
+        finally:
+            # resolve the futures of the items that never started, also if the scheduler raised
+            for u, future in self.futures.items():
+                if future.done() or future.cancel():
+                    continue
+                e = RuntimeError(f"Batch item {u} was started but the batch runner stopped before it finished")
+                self.errors[u] = e
+                future.set_exception(e)
+            self._finished.set()
+
+    def _schedule(self):
+        # highest priority first, otherwise in order
+        pending = sorted(range(len(self._items)), key=lambda i: -self._priorities[i])
+        # uuid -> (index, cores)
+        running: Dict[str, Tuple[int, int]] = dict()
+        free_cores = self._max_cores
+
+        with tqdm(total=self.n_total, disable=not self._progress, desc="running batch items") as pbar:
+            while True:
+                if self._cancel.is_set():
+                    for i in pending:
+                        self.futures[self._items[i]["uuid"]].cancel()
+                        self.n_done += 1
+                        pbar.update(1)
+                    pending.clear()
+
+                self._skip_failed_children(pending, pbar)
+
+                for i in list(pending):
+                    if self._n_processes[i] > free_cores or not self._is_ready(self._items[i]["uuid"]):
+                        continue
+
+                    series = self._items[i]
+                    u = series["uuid"]
+                    pending.remove(i)
+
+                    if not self.futures[u].set_running_or_notify_cancel():
+                        # future was cancelled
+                        self.n_done += 1
+                        pbar.update(1)
+                        continue
+
+                    try:
+                        process = self._start(series, self._n_processes[i])
+                    except Exception as e:
+                        self.errors[u] = e
+                        self.futures[u].set_exception(e)
+                        self.n_done += 1
+                        pbar.update(1)
+                        continue
+
+                    self.processes[u] = process
+                    running[u] = (i, self._n_processes[i])
+                    free_cores -= self._n_processes[i]
+                    process.add_done_callback(lambda f, u=u: self._events.put(u))
+
+                if len(pending) == 0 and len(running) == 0:
+                    break
+
+                u = self._events.get()
+                if u is None:
+                    continue
+
+                i, cores = running.pop(u)
+                free_cores += cores
+                self._finish(self._items[i], self.processes.pop(u))
+                self.n_done += 1
+                pbar.update(1)
+
+    def cancel(self, terminate: bool = False):
+        """
+        Stop starting items, items that have not started are cancelled.
+
+        Parameters
+        ----------
+        terminate: bool
+            also terminate the processes of the items that are running
+        """
+        self._cancel.set()
+        if terminate:
+            for process in list(self.processes.values()):
+                process.terminate()
+        self._events.put(None)
+
+    def done(self) -> bool:
+        return self._finished.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for all items to finish
+
+        Returns
+        -------
+        bool
+            ``True`` if all items have finished, ``False`` if ``timeout`` was reached
+        """
+        return self._finished.wait(timeout)
+
+    def __repr__(self):
+        status = "done" if self.done() else "running"
+        return (
+            f"<BatchRunner {status}: {self.n_done}/{self.n_total} items, {len(self.processes)} running, "
+            f"{len(self.errors)} errors>"
+        )
@@ -0,0 +1,487 @@
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+from datetime import datetime
+from itertools import count
+from pathlib import Path
+from subprocess import Popen
+from typing import *
+
+import pandas as pd
+
+from ..batch_storage import read_item_outputs, write_item_results
+
+
+# job states reported by squeue and sacct
+SLURM_STATE_COMPLETED = "COMPLETED"
+#: the job is reported by neither squeue nor sacct, for example when job accounting is disabled
+SLURM_STATE_UNKNOWN = "UNKNOWN"
+SLURM_ACTIVE_STATES = [
+    "PENDING",
+    "CONFIGURING",
+    "RUNNING",
+    "COMPLETING",
+    "REQUEUED",
+    "RESIZING",
+    "SUSPENDED",
+    "STAGE_OUT",
+    "SIGNALING",
+]
+SLURM_FAILED_STATES = [
+    "FAILED",
+    "CANCELLED",
+    "TIMEOUT",
+    "OUT_OF_MEMORY",
+    "NODE_FAIL",
+    "PREEMPTED",
+    "BOOT_FAIL",
+    "DEADLINE",
+]
+
+# resources requested for each algo, memory and time scale with the size of the input movie
+SLURM_RESOURCES = {
+    "mcorr": {"cpus": 8, "mem_per_gb": 4096, "min_mem": 4096, "seconds_per_gb": 600},
+    "cnmf": {"cpus": 16, "mem_per_gb": 8192, "min_mem": 8192, "seconds_per_gb": 1800},
+    "cnmfe": {"cpus": 16, "mem_per_gb": 12288, "min_mem": 8192, "seconds_per_gb": 3600},
+}
+#: minimum time limit of a job in seconds
+SLURM_MIN_TIME = 1800
+#: time limit as a multiple of the estimated or previous run time
+SLURM_TIME_MARGIN = 2.0
+
+
+class SlurmCommands:
+    """
+    Submits, polls and cancels SLURM jobs with the ``sbatch``, ``squeue``, ``sacct`` and ``scancel`` commands.
+
+    The command names can be replaced, for example with wrapper scripts that ssh into the login node. Subclass to
+    run jobs by other means, see ``LocalSlurmCommands``.
+    """
+
+    def __init__(
+            self,
+            sbatch: str = "sbatch",
+            squeue: str = "squeue",
+            sacct: str = "sacct",
+            scancel: str = "scancel",
+    ):
+        self.sbatch = sbatch
+        self.squeue = squeue
+        self.sacct = sacct
+        self.scancel = scancel
+
+    @staticmethod
+    def _call(args: List[str], cwd: Optional[Path] = None) -> str:
+        return subprocess.run(args, cwd=cwd, capture_output=True, text=True, check=True).stdout
+
+    def submit(self, script_path: Path, cwd: Optional[Path] = None) -> str:
+        """submit a job script, returns the job ID"""
+        out = self._call([self.sbatch, "--parsable", str(script_path)], cwd=cwd)
+        # "<job id>" or "<job id>;<cluster>"
+        return out.strip().split(";")[0]
+
+    def get_states(self, job_ids: List[str]) -> Dict[str, str]:
+        """
+        States of the jobs and of the tasks of array jobs, ``"<job id>"`` -> state and
+        ``"<job id>_<task id>"`` -> state. Jobs that are not found are not included.
+        """
+        job_ids = ",".join(job_ids)
+
+        states = dict()
+        out = self._call([self.squeue, "--noheader", "--array", "--format=%i %T", f"--jobs={job_ids}"])
+        for line in out.splitlines():
+            if line.strip() != "":
+                job_id, state = line.split()[:2]
+                states[job_id] = state
+
+        # finished jobs are only reported by sacct
+        try:
+            out = self._call(
+                [self.sacct, "--noheader", "--parsable2", "--allocations", "--format=JobID,State", f"--jobs={job_ids}"]
+            )
+        except (OSError, subprocess.CalledProcessError):
+            # sacct is not installed or job accounting is disabled
+            return states
+
+        for line in out.splitlines():
+            if line.strip() == "":
+                continue
+            job_id, state = line.split("|")[:2]
+            # "CANCELLED by <uid>"
+            states.setdefault(job_id, state.split()[0])
+
+        return states
+
+    def cancel(self, job_ids: List[str]):
+        self._call([self.scancel, *job_ids])
+
+
+class LocalSlurmCommands(SlurmCommands):
+    """
+    Stand-in for a SLURM cluster that runs submitted jobs as subprocesses on this machine, all tasks of an array
+    job run at the same time. Useful to test the SLURM backend without a cluster:
+
+    .. code-block:: python
+
+        from mesmerize_core import set_slurm_commands, LocalSlurmCommands
+
+        set_slurm_commands(LocalSlurmCommands())
+        df.iloc[0].caiman.run(backend="slurm")
+
+    """
+
+    _ARRAY_PATTERN = re.compile(r"^#SBATCH\s+--array=(?P<start>\d+)-(?P<stop>\d+)", re.MULTILINE)
+    _CPUS_PATTERN = re.compile(r"^#SBATCH\s+--cpus-per-task=(?P<cpus>\d+)", re.MULTILINE)
+
+    def __init__(self):
+        super().__init__()
+        #: job ID -> subprocess
+        self.processes: Dict[str, Popen] = dict()
+        self._cancelled: Set[str] = set()
+        self._ids = count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, script_path: Path, cwd: Optional[Path] = None) -> str:
+        script = Path(script_path).read_text()
+
+        array = self._ARRAY_PATTERN.search(script)
+        cpus = self._CPUS_PATTERN.search(script)
+
+        with self._lock:
+            job_id = str(next(self._ids))
+
+        env = {**os.environ, "SLURM_JOB_ID": job_id}
+        if cpus is not None:
+            env["SLURM_CPUS_PER_TASK"] = cpus["cpus"]
+
+        # each job in its own process group so that cancelling also stops the algorithm
+        if array is None:
+            self.processes[job_id] = Popen(["bash", str(script_path)], cwd=cwd, env=env, start_new_session=True)
+            return job_id
+
+        for task_id in range(int(array["start"]), int(array["stop"]) + 1):
+            self.processes[f"{job_id}_{task_id}"] = Popen(
+                ["bash", str(script_path)],
+                cwd=cwd,
+                env={**env, "SLURM_ARRAY_JOB_ID": job_id, "SLURM_ARRAY_TASK_ID": str(task_id)},
+                start_new_session=True,
+            )
+
+        return job_id
+
+    def _get_tasks(self, job_ids: List[str]) -> List[str]:
+        return [t for t in self.processes.keys() if t in job_ids or t.split("_")[0] in job_ids]
+
+    def get_states(self, job_ids: List[str]) -> Dict[str, str]:
+        states = dict()
+        for task in self._get_tasks(job_ids):
+            returncode = self.processes[task].poll()
+            if returncode is None:
+                states[task] = "RUNNING"
+            elif task in self._cancelled:
+                states[task] = "CANCELLED"
+            elif returncode == 0:
+                states[task] = SLURM_STATE_COMPLETED
+            else:
+                states[task] = "FAILED"
+
+        return states
+
+    def cancel(self, job_ids: List[str]):
+        for task in self._get_tasks(job_ids):
+            if self.processes[task].poll() is None:
+                self._cancelled.add(task)
+                os.killpg(self.processes[task].pid, signal.SIGTERM)
+
+
+_SLURM_COMMANDS: SlurmCommands = SlurmCommands()
+
+
+def set_slurm_commands(commands: SlurmCommands):
+    """
+    Set how jobs are submitted to and polled from SLURM by the ``"slurm"`` backend.
+
+    Parameters
+    ----------
+    commands: SlurmCommands
+        | ``SlurmCommands()`` to use the SLURM command line tools, this is the default
+        | ``LocalSlurmCommands()`` to run jobs as local subprocesses, for testing
+
+    """
+    global _SLURM_COMMANDS
+    _SLURM_COMMANDS = commands
+
+
+def get_slurm_commands() -> SlurmCommands:
+    return _SLURM_COMMANDS
+
+
+def _format_time(seconds: float) -> str:
+    minutes = int(seconds + 59) // 60
+    return f"{minutes // (24 * 60)}-{(minutes // 60) % 24:02d}:{minutes % 60:02d}:00"
+
+
+def estimate_resources(series: pd.Series, n_processes: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Resources to request for a batch item, estimated from its algo and the size of its input movie.
+
+    Parameters
+    ----------
+    series: pd.Series
+        batch item
+
+    n_processes: int, optional
+        number of processes used by the algorithm, by default it depends on the algo
+
+    Returns
+    -------
+    dict
+        | ``"cpus_per_task"``: number of cores
+        | ``"mem"``: memory in megabytes
+        | ``"time"``: time limit, ``"days-hours:minutes:seconds"``
+
+    """
+    resources = SLURM_RESOURCES[series["algo"]]
+
+    try:
+        size_gb = os.stat(series.caiman.get_input_movie_path()).st_size / 1024 ** 3
+    except (FileNotFoundError, OSError):
+        size_gb = 0
+
+    # items that were run before use their previous run time
+    duration = None
+    if isinstance(series.get("algo_duration"), str):
+        try:
+            duration = float(series["algo_duration"].split(" ")[0])
+        except ValueError:
+            pass
+    if duration is None:
+        duration = resources["seconds_per_gb"] * size_gb
+
+    return {
+        "cpus_per_task": n_processes if n_processes is not None else resources["cpus"],
+        "mem": int(max(resources["min_mem"], resources["mem_per_gb"] * size_gb)),
+        "time": _format_time(max(SLURM_MIN_TIME, SLURM_TIME_MARGIN * duration)),
+    }
+
+
+def combine_resources(resources: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """resources of an array job, every task gets the largest resources of all items"""
+    def seconds(t: str) -> int:
+        days, hms = t.split("-")
+        h, m, s = hms.split(":")
+        return ((int(days) * 24 + int(h)) * 60 + int(m)) * 60 + int(s)
+
+    return {
+        "cpus_per_task": max(r["cpus_per_task"] for r in resources),
+        "mem": max(r["mem"] for r in resources),
+        "time": _format_time(max(seconds(r["time"]) for r in resources)),
+    }
+
+
+def make_sbatch_script(
+        filename: Union[str, Path],
+        runfiles: List[str],
+        job_name: str,
+        cpus_per_task: int,
+        mem: int,
+        time: str,
+        log_dir: Union[str, Path, List[Union[str, Path]]],
+        max_concurrent: Optional[int] = None,
+        sbatch_args: Optional[List[str]] = None,
+) -> str:
+    """
+    Make a SLURM job script that runs the runfiles made by ``make_runfile()``.
+    If there is more than one runfile an array job is made, each task runs one runfile.
+
+    Parameters
+    ----------
+    filename: str or Path
+        path of the job script
+
+    runfiles: List[str]
+        runfiles of the batch items
+
+    job_name: str
+        name of the job
+
+    cpus_per_task: int
+        number of cores of each task
+
+    mem: int
+        memory of each task in megabytes
+
+    time: str
+        time limit of each task
+
+    log_dir: str, Path or List[str | Path]
+        | dir of the log files of the tasks
+        | a list gives the dir of the log file of each runfile, for example the output dirs of the items
+
+    max_concurrent: int, optional
+        maximum number of tasks of an array job that run at the same time
+
+    sbatch_args: List[str], optional
+        more sbatch options, for example ``["--partition=gpu", "--account=lab"]``
+
+    Returns
+    -------
+    str
+        path to the job script
+    """
+    lines = [
+        "#!/bin/bash",
+        f"#SBATCH --job-name={job_name}",
+        "#SBATCH --ntasks=1",
+        f"#SBATCH --cpus-per-task={cpus_per_task}",
+        f"#SBATCH --mem={mem}M",
+        f"#SBATCH --time={time}",
+    ]
+
+    if isinstance(log_dir, (list, tuple)):
+        if len(log_dir) != len(runfiles):
+            raise ValueError("`log_dir` must have one dir for each runfile")
+        log_dirs = [Path(d) for d in log_dir]
+    else:
+        log_dirs = None
+
+    if len(runfiles) == 1:
+        if log_dirs is not None:
+            log_dir = log_dirs[0]
+        lines.append(f"#SBATCH --output={Path(log_dir).joinpath('slurm-%j.out')}")
+    else:
+        array = f"0-{len(runfiles) - 1}"
+        if max_concurrent is not None:
+            array += f"%{max_concurrent}"
+        lines.append(f"#SBATCH --array={array}")
+        if log_dirs is None:
+            lines.append(f"#SBATCH --output={Path(log_dir).joinpath('slurm-%A_%a.out')}")
+        else:
+            # sbatch can only set one output pattern for all tasks, each task redirects its own output
+            lines.append("#SBATCH --output=/dev/null")
+
+    if sbatch_args is not None:
+        lines.extend(f"#SBATCH {arg}" for arg in sbatch_args)
+
+    if len(runfiles) == 1:
+        lines.append(f'bash "{runfiles[0]}"')
+    else:
+        lines.append("runfiles=(")
+        lines.extend(f'  "{runfile}"' for runfile in runfiles)
+        lines.append(")")
+        if log_dirs is not None:
+            lines.append("log_dirs=(")
+            lines.extend(f'  "{d}"' for d in log_dirs)
+            lines.append(")")
+            lines.append('log_dir="${log_dirs[$SLURM_ARRAY_TASK_ID]}"')
+            lines.append('mkdir -p "$log_dir"')
+            lines.append('exec > "$log_dir/slurm-${SLURM_ARRAY_JOB_ID}_${SLURM_ARRAY_TASK_ID}.out" 2>&1')
+        lines.append('bash "${runfiles[$SLURM_ARRAY_TASK_ID]}"')
+
+    with open(filename, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+    return str(filename)
+
+
+class SlurmJob:
+    """
+    A submitted SLURM job that runs one batch item, or an array job that runs one item per task.
+    Returned by the ``"slurm"`` backend, it can be used like the ``Popen`` returned by the ``"subprocess"`` backend.
+
+    Items whose task ends without writing the item's outputs, for example because it ran out of time or memory or
+    was cancelled, get unsuccessful ``outputs`` with the state of the task as the traceback. Outputs written before
+    the job was submitted, by a previous run of the item, are replaced.
+
+    A job that is reported by neither ``squeue`` nor ``sacct`` has finished, its tasks are considered completed if
+    they wrote the outputs of their items.
+    """
+
+    def __init__(
+            self,
+            job_id: str,
+            batch_path: Path,
+            uuids: List[str],
+            commands: SlurmCommands,
+            array: bool = False,
+            poll_interval: float = 10,
+    ):
+        self.job_id = job_id
+        self.batch_path = batch_path
+        self.uuids = uuids
+        self.poll_interval = poll_interval
+        self._commands = commands
+
+        #: the job is created right after it is submitted, outputs written before are from previous runs of the items
+        self.submit_time: float = time.time()
+
+        #: uuid -> ID of the job or task that runs the item
+        self.task_ids: Dict[str, str] = {
+            u: f"{job_id}_{i}" if array else job_id for i, u in enumerate(uuids)
+        }
+
+        #: uuid -> state of the item's job or task
+        self.states: Dict[str, str] = {u: "PENDING" for u in uuids}
+
+        #: ``None`` while any task is pending or running, then ``0`` if all tasks completed, otherwise ``1``
+        self.returncode: Optional[int] = None
+
+    def poll(self) -> Optional[int]:
+        """update the states of the tasks, returns ``returncode``"""
+        if self.returncode is not None:
+            return self.returncode
+
+        states = self._commands.get_states([self.job_id])
+        for u, task_id in self.task_ids.items():
+            # pending tasks of an array job are not always reported individually
+            self.states[u] = states.get(task_id, states.get(self.job_id, SLURM_STATE_UNKNOWN))
+
+        if any(state in SLURM_ACTIVE_STATES for state in self.states.values()):
+            return None
+
+        for u, state in self.states.items():
+            outputs = read_item_outputs(self.batch_path, u, since=self.submit_time)
+            if state == SLURM_STATE_UNKNOWN and outputs is not None:
+                # finished without a reported state, the task got to write the outputs
+                self.states[u] = SLURM_STATE_COMPLETED
+            elif state != SLURM_STATE_COMPLETED and outputs is None:
+                # the algorithm did not get to write the outputs
+                write_item_results(
+                    self.batch_path,
+                    u,
+                    outputs={
+                        "success": False,
+                        "traceback": f"SLURM job {self.task_ids[u]} of batch item {u} ended with state {state}",
+                    },
+                    ran_time=datetime.now().isoformat(timespec="seconds", sep="T"),
+                )
+
+        if all(state == SLURM_STATE_COMPLETED for state in self.states.values()):
+            self.returncode = 0
+        else:
+            self.returncode = 1
+
+        return self.returncode
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[int]:
+        """wait for all tasks to finish, returns ``returncode``"""
+        start = time.time()
+        while self.poll() is None:
+            if timeout is not None and time.time() - start > timeout:
+                raise subprocess.TimeoutExpired(f"SLURM job {self.job_id}", timeout)
+            time.sleep(self.poll_interval)
+
+        return self.returncode
+
+    def terminate(self):
+        """cancel the job"""
+        self._commands.cancel([self.job_id])
+
+    kill = terminate
+
+    def __repr__(self):
+        states = pd.Series(list(self.states.values()), dtype=object).value_counts().to_dict()
+        return f"<SlurmJob {self.job_id}: {len(self.uuids)} items, {states}>"
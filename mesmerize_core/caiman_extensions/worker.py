@@ -0,0 +1,642 @@
+"""
+Long-lived local worker service that keeps CaImAn imported and a pool of processes running, used by the ``"worker"``
+backend. Start it with ``start_worker()``.
+"""
+import getpass
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from multiprocessing.connection import Listener, Client, Connection
+from pathlib import Path
+from subprocess import Popen
+from typing import *
+
+import click
+
+from ..batch_storage import write_item_results
+from ..utils import IS_WINDOWS, get_n_processes
+
+
+# states of the items submitted to the worker service
+WORKER_STATE_QUEUED = "queued"
+WORKER_STATE_RUNNING = "running"
+WORKER_STATE_DONE = "done"
+WORKER_STATE_FAILED = "failed"
+WORKER_STATE_CANCELLED = "cancelled"
+
+WORKER_FINAL_STATES = [WORKER_STATE_DONE, WORKER_STATE_FAILED, WORKER_STATE_CANCELLED]
+
+
+def _get_runtime_dir() -> Path:
+    """
+    dir in the temp dir that only the user can access, for the socket, key and log files of the service.
+    Raises ``PermissionError`` if it exists but is not private, for example if another user created it.
+    """
+    path = Path(tempfile.gettempdir()).joinpath(f"mesmerize-{getpass.getuser()}")
+    try:
+        path.mkdir(mode=0o700)
+    except FileExistsError:
+        pass
+
+    if not IS_WINDOWS:
+        # not followed if it is a symlink
+        stat = os.lstat(path)
+        if not os.path.isdir(path) or os.path.islink(path) or stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+            raise PermissionError(f"The worker service dir must be a dir that only you can access: {path}")
+
+    return path
+
+
+def get_worker_address() -> str:
+    """default address of the worker service, a Unix socket, or a named pipe on Windows"""
+    name = f"mesmerize-worker-{getpass.getuser()}"
+    if IS_WINDOWS:
+        return rf"\\.\pipe\{name}"
+    return str(_get_runtime_dir().joinpath("worker.sock"))
+
+
+def _get_key_path(address: str) -> Path:
+    # the key file is only readable by the user, clients need it to connect
+    return _get_runtime_dir().joinpath(f"{Path(address).name}.key")
+
+
+def _get_log_path(address: str) -> Path:
+    return _get_runtime_dir().joinpath(f"{Path(address).name}.log")
+
+
+def _write_key(path: Path):
+    """write a new key, the file is created with only user permissions and existing files are never followed"""
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+    fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, "O_NOFOLLOW", 0), 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(os.urandom(32))
+
+
+def _executor_main(conn: Connection):
+    """
+    runs in an executor process of the service, CaImAn is imported and the pool is started once and then
+    reused for every item that the executor runs
+    """
+    if not IS_WINDOWS:
+        # own process group so that the pool is killed together with the executor
+        os.setsid()
+
+    import caiman as cm
+    from .. import algorithms
+
+    dview, n_processes = None, None
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+
+        if dview is None or task["n_processes"] != n_processes:
+            if dview is not None:
+                cm.stop_server(dview=dview)
+            c, dview, n_processes = cm.cluster.setup_cluster(
+                backend="local", n_processes=task["n_processes"], single_thread=False
+            )
+
+        # the algorithms read the number of processes from the environment
+        os.environ["MESMERIZE_N_PROCESSES"] = str(n_processes)
+        try:
+            getattr(algorithms, task["algo"]).run_algo(
+                batch_path=task["batch_path"],
+                uuid=task["uuid"],
+                data_path=task["data_path"],
+                dview=dview,
+            )
+        except Exception:
+            # the algorithms store their own tracebacks, this is for errors before the algorithm started
+            write_item_results(
+                task["batch_path"],
+                task["uuid"],
+                outputs={"success": False, "traceback": traceback.format_exc()},
+                ran_time=datetime.now().isoformat(timespec="seconds", sep="T"),
+            )
+
+        conn.send(task["uuid"])
+
+    if dview is not None:
+        cm.stop_server(dview=dview)
+
+
+class _Executor:
+    """an executor process and the connection used to send it items"""
+
+    def __init__(self):
+        self.process: Optional[multiprocessing.Process] = None
+        self.conn: Optional[Connection] = None
+        self.n_items: int = 0
+
+    def start(self):
+        # spawn so that the executor does not inherit the threads of the service
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, child_conn = ctx.Pipe()
+        # not daemonic, daemonic processes cannot start the pool
+        self.process = ctx.Process(target=_executor_main, args=(child_conn,), name="mesmerize-executor")
+        self.process.start()
+        child_conn.close()
+        self.n_items = 0
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def kill(self):
+        if self.is_alive():
+            pid = self.process.pid
+            try:
+                if not IS_WINDOWS and os.getpgid(pid) == pid:
+                    os.killpg(pid, signal.SIGKILL)
+                else:
+                    self.process.kill()
+            except ProcessLookupError:
+                pass
+        if self.process is not None:
+            self.process.join()
+
+    def stop(self):
+        if self.is_alive():
+            try:
+                self.conn.send(None)
+                self.process.join(30)
+            except (OSError, EOFError):
+                pass
+        self.kill()
+
+
+class WorkerService:
+    """
+    Runs batch items in warm executor processes, each executor keeps CaImAn imported and a pool of
+    ``n_processes`` processes running between items.
+
+    Every item runs in an executor, not in the service. If an executor crashes the item is marked as unsuccessful
+    and the executor is restarted, other items are not affected.
+    """
+
+    def __init__(
+            self,
+            address: str,
+            authkey: bytes,
+            n_workers: int = 1,
+            n_processes: Optional[int] = None,
+            max_items_per_worker: Optional[int] = None,
+    ):
+        self.address = address
+        self.authkey = authkey
+        self.n_processes = n_processes if n_processes is not None else get_n_processes()
+        self.max_items_per_worker = max_items_per_worker
+
+        self._executors = [_Executor() for i in range(n_workers)]
+
+        self._queue: Deque[dict] = deque()
+        #: uuid -> state of the items that were submitted
+        self.states: Dict[str, str] = dict()
+        self._cancel: Set[str] = set()
+        self._condition = threading.Condition()
+        self._shutdown = False
+
+    def _set_state(self, u: str, state: str):
+        with self._condition:
+            self.states[u] = state
+            self._condition.notify_all()
+
+    def _run_item(self, executor: _Executor, task: dict) -> str:
+        """run an item in the executor, returns the final state"""
+        u = task["uuid"]
+
+        if not executor.is_alive():
+            executor.start()
+
+        try:
+            executor.conn.send(task)
+        except (EOFError, OSError):
+            # crashed, handled below
+            pass
+
+        while True:
+            try:
+                if executor.conn.poll(0.5):
+                    executor.conn.recv()
+                    executor.n_items += 1
+                    return WORKER_STATE_DONE
+            except (EOFError, OSError):
+                pass
+
+            if u in self._cancel:
+                executor.kill()
+                reason, state = "Batch item was cancelled", WORKER_STATE_CANCELLED
+                break
+
+            if not executor.is_alive():
+                reason = f"Worker process crashed with exit code {executor.process.exitcode}"
+                state = WORKER_STATE_FAILED
+                break
+
+        write_item_results(
+            task["batch_path"],
+            u,
+            outputs={"success": False, "traceback": reason},
+            ran_time=datetime.now().isoformat(timespec="seconds", sep="T"),
+        )
+
+        return state
+
+    def _dispatch(self, executor: _Executor):
+        executor.start()
+
+        while True:
+            with self._condition:
+                while len(self._queue) == 0 and not self._shutdown:
+                    self._condition.wait()
+                if self._shutdown:
+                    break
+                task = self._queue.popleft()
+                self.states[task["uuid"]] = WORKER_STATE_RUNNING
+                self._condition.notify_all()
+
+            state = self._run_item(executor, task)
+            self._set_state(task["uuid"], state)
+
+            # start with a fresh executor, or restart a crashed executor right away
+            if not executor.is_alive() or (
+                    self.max_items_per_worker is not None and executor.n_items >= self.max_items_per_worker
+            ):
+                executor.stop()
+                executor.start()
+
+        executor.stop()
+
+    def _handle(self, request: tuple) -> Any:
+        op = request[0]
+
+        if op == "ping":
+            return os.getpid()
+
+        elif op == "submit":
+            task = request[1]
+            if task["n_processes"] is None:
+                task["n_processes"] = self.n_processes
+            with self._condition:
+                self._cancel.discard(task["uuid"])
+                self._queue.append(task)
+                self.states[task["uuid"]] = WORKER_STATE_QUEUED
+                self._condition.notify_all()
+            return True
+
+        elif op == "status":
+            return self.states.get(request[1])
+
+        elif op == "wait":
+            u, timeout = request[1:]
+            with self._condition:
+                self._condition.wait_for(lambda: self.states.get(u) in WORKER_FINAL_STATES, timeout)
+                return self.states.get(u)
+
+        elif op == "cancel":
+            u = request[1]
+            with self._condition:
+                queued = [task for task in self._queue if task["uuid"] == u]
+                for task in queued:
+                    self._queue.remove(task)
+                if len(queued) > 0:
+                    self.states[u] = WORKER_STATE_CANCELLED
+                    self._condition.notify_all()
+                elif self.states.get(u) == WORKER_STATE_RUNNING:
+                    self._cancel.add(u)
+            return self.states.get(u)
+
+        elif op == "info":
+            with self._condition:
+                return {
+                    "pid": os.getpid(),
+                    "n_workers": len(self._executors),
+                    "n_processes": self.n_processes,
+                    "queued": len(self._queue),
+                    "running": list(self.states.values()).count(WORKER_STATE_RUNNING),
+                }
+
+        elif op == "shutdown":
+            with self._condition:
+                self._shutdown = True
+                for task in self._queue:
+                    self.states[task["uuid"]] = WORKER_STATE_CANCELLED
+                self._queue.clear()
+                self._cancel.update(u for u, state in self.states.items() if state == WORKER_STATE_RUNNING)
+                self._condition.notify_all()
+            return True
+
+        raise ValueError(f"Unknown request: {op}")
+
+    def _serve_connection(self, conn: Connection):
+        """answer the requests of a client until it closes the connection"""
+        with conn:
+            while not self._shutdown:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    response = self._handle(request)
+                except Exception as e:
+                    response = e
+                try:
+                    conn.send(response)
+                except (EOFError, OSError):
+                    # the client is gone
+                    return
+
+        if self._shutdown:
+            # wake up the listener
+            try:
+                Client(self.address, authkey=self.authkey).close()
+            except (OSError, EOFError):
+                pass
+
+    def serve_forever(self):
+        if not IS_WINDOWS and os.path.exists(self.address):
+            # left by a service that was killed
+            os.remove(self.address)
+
+        listener = Listener(self.address, authkey=self.authkey)
+
+        dispatchers = [
+            threading.Thread(target=self._dispatch, args=(executor,), daemon=True) for executor in self._executors
+        ]
+        for thread in dispatchers:
+            thread.start()
+
+        try:
+            while not self._shutdown:
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError, multiprocessing.AuthenticationError):
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+        finally:
+            listener.close()
+            for thread in dispatchers:
+                thread.join()
+
+
+class WorkerJob:
+    """
+    An item submitted to the worker service, returned by the ``"worker"`` backend.
+    It can be used like the ``Popen`` returned by the ``"subprocess"`` backend.
+    """
+
+    def __init__(self, client: "WorkerClient", uuid: str):
+        self.client = client
+        self.uuid = uuid
+        #: ``None`` until the item is done, then ``0``, or ``1`` if it was cancelled or the worker crashed
+        self.returncode: Optional[int] = None
+
+    def _set_state(self, state: Optional[str]) -> Optional[int]:
+        if state in WORKER_FINAL_STATES:
+            self.returncode = 0 if state == WORKER_STATE_DONE else 1
+        return self.returncode
+
+    @property
+    def state(self) -> Optional[str]:
+        return self.client.request("status", self.uuid)
+
+    def poll(self) -> Optional[int]:
+        return self._set_state(self.state)
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[int]:
+        # blocks until the item is done, the client's connection stays free for polling other items
+        state = self.client.request("wait", self.uuid, timeout, new_connection=True)
+        if state not in WORKER_FINAL_STATES:
+            raise subprocess.TimeoutExpired(f"worker item {self.uuid}", timeout)
+        return self._set_state(state)
+
+    def terminate(self):
+        """cancel the item, it is stopped if it is running"""
+        self.client.request("cancel", self.uuid)
+
+    kill = terminate
+
+    def __repr__(self):
+        return f"<WorkerJob {self.uuid}: {self.state}>"
+
+
+class WorkerClient:
+    """Connects to a running worker service, one connection is kept open and used for all requests"""
+
+    def __init__(self, address: Optional[str] = None):
+        self.address = address if address is not None else get_worker_address()
+        self._authkey: Optional[bytes] = None
+        self._conn: Optional[Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> Connection:
+        if self._authkey is None:
+            self._authkey = _get_key_path(self.address).read_bytes()
+        return Client(self.address, authkey=self._authkey)
+
+    def close(self):
+        """close the connection, it is opened again by the next request"""
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = None
+        # the service may have been restarted with a new key
+        self._authkey = None
+
+    def request(self, *request, new_connection: bool = False) -> Any:
+        """
+        send a request to the service and return its response, ``new_connection`` sends it over a separate
+        connection, for requests that block
+        """
+        if new_connection:
+            with self._connect() as conn:
+                conn.send(request)
+                response = conn.recv()
+        else:
+            with self._lock:
+                reconnect = self._conn is not None
+                while True:
+                    try:
+                        if self._conn is None:
+                            self._conn = self._connect()
+                        self._conn.send(request)
+                        response = self._conn.recv()
+                        break
+                    except (OSError, EOFError, multiprocessing.AuthenticationError):
+                        self._close()
+                        if not reconnect:
+                            raise
+                        # the service closed the connection, for example it was restarted, try once more
+                        reconnect = False
+
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def is_running(self) -> bool:
+        try:
+            self.request("ping")
+        except (OSError, EOFError, multiprocessing.AuthenticationError):
+            return False
+        return True
+
+    def submit(
+            self,
+            algo: str,
+            batch_path: Union[str, Path],
+            uuid: str,
+            data_path: Optional[Union[str, Path]] = None,
+            n_processes: Optional[int] = None,
+    ) -> WorkerJob:
+        """submit a batch item, returns immediately"""
+        self.request(
+            "submit",
+            {
+                "algo": algo,
+                "batch_path": str(batch_path),
+                "uuid": str(uuid),
+                "data_path": None if data_path is None else str(data_path),
+                "n_processes": n_processes,
+            },
+        )
+        return WorkerJob(self, str(uuid))
+
+    def info(self) -> dict:
+        """pid, number of workers and processes, and number of queued and running items"""
+        return self.request("info")
+
+    def shutdown(self):
+        self.request("shutdown")
+
+
+def start_worker(
+        n_workers: int = 1,
+        n_processes: Optional[int] = None,
+        max_items_per_worker: Optional[int] = None,
+        address: Optional[str] = None,
+        timeout: float = 120,
+) -> WorkerClient:
+    """
+    Start the worker service used by the ``"worker"`` backend in the background, if it is not already running.
+    The service keeps running after python exits, use ``stop_worker()`` to stop it.
+
+    Parameters
+    ----------
+    n_workers: int
+        number of items that run at the same time
+
+    n_processes: int, optional
+        number of processes of each worker's pool, default is the ``MESMERIZE_N_PROCESSES`` environment variable
+        or ``n_cpus - 1``. Items that are run with a different ``n_processes`` restart the pool.
+
+    max_items_per_worker: int, optional
+        restart a worker after it ran this many items, by default workers are only restarted if they crash
+
+    address: str, optional
+        address of the service, default is a Unix socket in a dir of the temp dir that only the user can access,
+        or a named pipe on Windows
+
+    timeout: float
+        seconds to wait for the service to start
+
+    Returns
+    -------
+    WorkerClient
+        client connected to the service
+
+    """
+    client = WorkerClient(address)
+    if client.is_running():
+        return client
+
+    _write_key(_get_key_path(client.address))
+
+    args = [
+        sys.executable, "-c", "from mesmerize_core.caiman_extensions.worker import main; main()",
+        "--address", client.address,
+        "--n-workers", str(n_workers),
+    ]
+    if n_processes is not None:
+        args += ["--n-processes", str(n_processes)]
+    if max_items_per_worker is not None:
+        args += ["--max-items-per-worker", str(max_items_per_worker)]
+
+    log_path = _get_log_path(client.address)
+    with open(log_path, "w") as log:
+        process = Popen(
+            args,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            env={**os.environ, "OPENBLAS_NUM_THREADS": "1", "MKL_NUM_THREADS": "1"},
+            # keep running when the parent exits
+            start_new_session=not IS_WINDOWS,
+        )
+
+    start = time.time()
+    while not client.is_running():
+        if process.poll() is not None:
+            raise RuntimeError(f"The worker service exited with code {process.returncode}, see: {log_path}")
+        if time.time() - start > timeout:
+            process.kill()
+            raise TimeoutError(f"The worker service did not start within {timeout} seconds, see: {log_path}")
+        time.sleep(0.1)
+
+    return client
+
+
+def get_worker(address: Optional[str] = None) -> Optional[WorkerClient]:
+    """client of the running worker service, ``None`` if it is not running"""
+    client = WorkerClient(address)
+    if client.is_running():
+        return client
+    return None
+
+
+def stop_worker(address: Optional[str] = None):
+    """stop the worker service, queued items are not run and running items are stopped"""
+    client = get_worker(address)
+    if client is not None:
+        client.shutdown()
+
+
+@click.command()
+@click.option("--address", type=str)
+@click.option("--n-workers", type=int, default=1)
+@click.option("--n-processes", type=int, default=None)
+@click.option("--max-items-per-worker", type=int, default=None)
+def main(address: Optional[str], n_workers: int, n_processes: Optional[int], max_items_per_worker: Optional[int]):
+    if address is None:
+        address = get_worker_address()
+
+    key_path = _get_key_path(address)
+    if not key_path.exists():
+        _write_key(key_path)
+
+    service = WorkerService(
+        address,
+        authkey=key_path.read_bytes(),
+        n_workers=n_workers,
+        n_processes=n_processes,
+        max_items_per_worker=max_items_per_worker,
+    )
+    print(f"mesmerize worker service listening on {address}", flush=True)
+    service.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
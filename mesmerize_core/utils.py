@@ -14,9 +14,14 @@ import re as regex
 from pathlib import Path
 from warnings import warn
 import sys
+import threading
+import time
+from contextlib import contextmanager
 from tempfile import NamedTemporaryFile
 from subprocess import check_call
 
+import psutil
+
 if os.name == "nt":
     IS_WINDOWS = True
     HOME = "USERPROFILE"
@@ -24,10 +29,19 @@ else:
     IS_WINDOWS = False
     HOME = "HOME"
 
+# max cache size, either a number of items or a size such as "1G" or "500M"
 if "MESMERIZE_LRU_CACHE" in os.environ.keys():
     MESMERIZE_LRU_CACHE = os.environ["MESMERIZE_LRU_CACHE"]
+    if MESMERIZE_LRU_CACHE.isdigit():
+        MESMERIZE_LRU_CACHE = int(MESMERIZE_LRU_CACHE)
+else:
+    MESMERIZE_LRU_CACHE = None
+
+# path to a JSON cache config file
+if "MESMERIZE_CACHE_CONFIG" in os.environ.keys():
+    MESMERIZE_CACHE_CONFIG = os.environ["MESMERIZE_CACHE_CONFIG"]
 else:
-    MESMERIZE_LRU_CACHE = 10
+    MESMERIZE_CACHE_CONFIG = None
 
 
 def warning_experimental(more_info: str = ""):
@@ -59,8 +73,123 @@ def validate_path(path: Union[str, Path]):
     return path
 
 
+def get_n_processes() -> int:
+    """
+    Number of processes used to run an algorithm, ``MESMERIZE_N_PROCESSES`` if it is set, else ``n_cpus - 1``
+    """
+    if "MESMERIZE_N_PROCESSES" in os.environ.keys():
+        try:
+            return int(os.environ["MESMERIZE_N_PROCESSES"])
+        except ValueError:
+            pass
+
+    return max(os.cpu_count() - 1, 1)
+
+
+# fields recorded for each stage by ``StageMetrics``
+STAGE_METRICS_FIELDS = ["wall_time", "cpu_time", "peak_rss", "read_bytes", "write_bytes"]
+
+
+class StageMetrics:
+    """
+    Records the wall time, CPU time, peak memory and disk IO of the stages of an algorithm run, stored in the
+    item's ``outputs["stage_metrics"]``.
+
+    CPU time, memory and IO include the child processes, such as the workers of the CaImAn cluster.
+    They are sampled every ``interval`` seconds by a background thread while a stage runs, the peak memory is the
+    largest sampled sum of the resident set sizes. Bytes read and written are the IO of the storage device, reads
+    served from the page cache are not counted. IO is not available on macOS.
+    """
+
+    def __init__(self, interval: float = 0.2):
+        self.interval = interval
+        #: stage name -> {"wall_time": s, "cpu_time": s, "peak_rss": bytes, "read_bytes": bytes, "write_bytes": bytes}
+        self.stages: Dict[str, Dict[str, float]] = dict()
+        self._process = psutil.Process()
+
+    @staticmethod
+    def _counters(process: psutil.Process) -> np.ndarray:
+        """cpu time, rss, bytes read, bytes written"""
+        with process.oneshot():
+            cpu = process.cpu_times()
+            rss = process.memory_info().rss
+            try:
+                io = process.io_counters()
+                read, write = io.read_bytes, io.write_bytes
+            except (AttributeError, psutil.AccessDenied, NotImplementedError):
+                # not available on macOS
+                read, write = 0, 0
+
+        return np.array([cpu.user + cpu.system, rss, read, write], dtype=np.float64)
+
+    def _sample(self) -> Dict[int, np.ndarray]:
+        """counters of this process and its children, pid -> counters"""
+        samples = {self._process.pid: self._counters(self._process)}
+        for child in self._process.children(recursive=True):
+            try:
+                samples[child.pid] = self._counters(child)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        return samples
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Record a stage, stages with the same name are added up
+
+        .. code-block:: python
+
+            with metrics.stage("fit"):
+                cnm = cnm.fit(images)
+
+        """
+        start = self._sample()
+        # pid -> last counters, processes started during the stage start from zero
+        last = dict(start)
+        peak_rss = sum(c[1] for c in start.values())
+
+        stop = threading.Event()
+
+        def sample():
+            nonlocal peak_rss
+            while not stop.wait(self.interval):
+                samples = self._sample()
+                last.update(samples)
+                peak_rss = max(peak_rss, sum(c[1] for c in samples.values()))
+
+        thread = threading.Thread(target=sample, daemon=True)
+        wall_start = time.perf_counter()
+        thread.start()
+        try:
+            yield
+        finally:
+            wall_time = time.perf_counter() - wall_start
+            stop.set()
+            thread.join()
+
+            end = self._sample()
+            last.update(end)
+            peak_rss = max(peak_rss, sum(c[1] for c in end.values()))
+
+            # processes that exited during the stage count until they were last sampled
+            totals = sum(c - start.get(pid, np.zeros(4)) for pid, c in last.items())
+
+            metrics = self.stages.setdefault(name, {field: 0.0 for field in STAGE_METRICS_FIELDS})
+            metrics["wall_time"] += wall_time
+            metrics["cpu_time"] += float(totals[0])
+            metrics["peak_rss"] = max(metrics["peak_rss"], float(peak_rss))
+            metrics["read_bytes"] += float(max(totals[2], 0))
+            metrics["write_bytes"] += float(max(totals[3], 0))
+
+    def to_dict(self) -> Dict[str, Dict[str, float]]:
+        return {name: dict(metrics) for name, metrics in self.stages.items()}
+
+
 def make_runfile(
-    module_path: str, args_str: Optional[str] = None, filename: Optional[str] = None
+    module_path: str,
+    args_str: Optional[str] = None,
+    filename: Optional[str] = None,
+    env: Optional[Dict[str, str]] = None,
 ) -> str:
     """
     Make an executable bash script.
@@ -77,6 +206,9 @@ def make_runfile(
     filename: Optional[str]
         optional, filename of the executable bash script
 
+    env: Optional[Dict[str, str]]
+        optional, environment variables to set in the script, for example ``MESMERIZE_N_PROCESSES``
+
     Returns
     -------
     str
@@ -98,6 +230,9 @@ def make_runfile(
     if args_str is None:
         args_str = ""
 
+    if env is None:
+        env = dict()
+
     if not IS_WINDOWS:
         with open(sh_file, "w") as f:
 
@@ -134,6 +269,9 @@ def make_runfile(
 
             f.write(f"export OPENBLAS_NUM_THREADS=1\n" f"export MKL_NUM_THREADS=1\n")
 
+            for k, v in env.items():
+                f.write(f'export {k}={v}\n')
+
             f.write(f"python {module_path} {args_str}")  # call the script to run
 
     else:
@@ -150,6 +288,8 @@ def make_runfile(
                     except:
                         continue
                 f.write(f'$env:{k}="{v}";\n')  # write only env vars that powershell likes
+            for k, v in env.items():
+                f.write(f'$env:{k}="{v}";\n')
             f.write(f"{sys.executable} {module_path} {args_str}")
 
     st = os.stat(sh_file)
@@ -8,12 +8,19 @@ import pandas as pd
 from mesmerize_core import (
     create_batch,
     load_batch,
+    migrate_batch,
     CaimanDataFrameExtensions,
     CaimanSeriesExtensions,
     set_parent_raw_data_path,
+    set_slurm_commands,
+    SlurmCommands,
+    LocalSlurmCommands,
+    start_worker,
+    stop_worker,
+    get_worker,
 )
 from mesmerize_core.batch_utils import DATAFRAME_COLUMNS, COMPUTE_BACKEND_SUBPROCESS, get_full_raw_data_path
-from mesmerize_core.utils import IS_WINDOWS
+from mesmerize_core.utils import IS_WINDOWS, STAGE_METRICS_FIELDS
 from uuid import uuid4
 from typing import *
 import pytest
@@ -26,7 +33,15 @@ import shutil
 from zipfile import ZipFile
 from pprint import pprint
 from mesmerize_core.caiman_extensions import cnmf
+from mesmerize_core import algorithms, batch_storage
+from mesmerize_core.caiman_extensions.cache import Cache
+from mesmerize_core.caiman_extensions._batch_exceptions import DependencyError
+from mesmerize_core.caiman_extensions.slurm import SlurmJob
+from mesmerize_core.caiman_extensions.common import _LOCAL_EXECUTOR
 import time
+import threading
+import asyncio
+from concurrent.futures import CancelledError
 import tifffile
 from copy import deepcopy
 
@@ -134,6 +149,48 @@ def _create_tmp_batch() -> Tuple[pd.DataFrame, str]:
     return df, fname
 
 
+def _create_cnmf_batch() -> Tuple[pd.DataFrame, str]:
+    """batch with an mcorr item and a cnmf item that uses its output, both have been run"""
+    set_parent_raw_data_path(vid_dir)
+    df, batch_path = _create_tmp_batch()
+
+    df.caiman.add_item(
+        algo="mcorr",
+        item_name="test-mcorr",
+        input_movie_path=get_datafile("mcorr"),
+        params=test_params["mcorr"],
+    )
+    df.iloc[-1].caiman.run()
+    df = load_batch(batch_path)
+
+    df.caiman.add_item(
+        algo="cnmf",
+        item_name="test-cnmf",
+        input_movie_path=df.iloc[-1],
+        params=test_params["cnmf"],
+    )
+    df.iloc[-1].caiman.run()
+
+    return load_batch(batch_path), batch_path
+
+
+def _make_cached_extension(cache: Cache):
+    """extension-like class with a method that is cached in ``cache`` and counts how often it is computed"""
+    class Extension:
+        n_computed = 0
+
+        def __init__(self, uuid: str):
+            self._series = pd.Series({"uuid": uuid})
+
+        @cache.use_cache
+        def compute(self, x, delay: float = 0.0, return_copy=True):
+            Extension.n_computed += 1
+            time.sleep(delay)
+            return np.array(x, ndmin=1) * 2
+
+    return Extension
+
+
 def test_create_batch():
     df, fname = _create_tmp_batch()
 
@@ -659,6 +716,42 @@ def test_cnmf():
     )
 
 
+def test_cnmf_n_processes(monkeypatch):
+    set_parent_raw_data_path(vid_dir)
+    df, batch_path = _create_tmp_batch()
+
+    df.caiman.add_item(
+        algo="mcorr",
+        item_name="test-mcorr",
+        input_movie_path=get_datafile("mcorr"),
+        params=test_params["mcorr"],
+    )
+    df.iloc[-1].caiman.run()
+    df = load_batch(batch_path)
+
+    df.caiman.add_item(
+        algo="cnmf",
+        item_name="test-cnmf",
+        input_movie_path=df.iloc[-1].mcorr.get_output_path(),
+        params=test_params["cnmf"],
+    )
+
+    # the local backend runs the algorithm in this process
+    n_processes = list()
+    setup_cluster = algorithms.cnmf.cm.cluster.setup_cluster
+
+    def record_setup_cluster(*args, **kwargs):
+        n_processes.append(kwargs["n_processes"])
+        return setup_cluster(*args, **kwargs)
+
+    monkeypatch.setattr(algorithms.cnmf.cm.cluster, "setup_cluster", record_setup_cluster)
+    df.iloc[-1].caiman.run(backend="local", n_processes=2)
+
+    # the pool that is restarted after the memmap keeps the item's number of processes
+    assert n_processes == [2, 2]
+    assert load_batch(batch_path).iloc[-1]["outputs"]["success"] is True
+
+
 def test_cnmfe():
     set_parent_raw_data_path(vid_dir)
 
@@ -965,6 +1058,11 @@ def test_remove_item():
         proc = r.caiman.run()
         # proc.wait()
 
+    # results of all the items are written to the batch file
+    assert set(df.caiman.sync_results()) == set(df["uuid"])
+    assert all(df["outputs"].apply(lambda o: o["success"]))
+    assert df.caiman.sync_results() == []
+
     df = load_batch(df.paths.get_batch_path())
 
     # make sure we can get mcorr movie output of 0th and 1st indices
@@ -1018,6 +1116,576 @@ def test_remove_item():
     )
 
 
+def test_add_items():
+    set_parent_raw_data_path(vid_dir)
+    df, batch_path = _create_tmp_batch()
+    input_movie_path = get_datafile("mcorr")
+
+    df.caiman.add_items(
+        [
+            ("mcorr", "test0", input_movie_path, deepcopy(test_params["mcorr"])),
+            {
+                "algo": "mcorr",
+                "item_name": "test1",
+                "input_movie_path": input_movie_path,
+                "params": deepcopy(test_params["mcorr"]),
+            },
+        ]
+    )
+
+    # one item for every combination of the grid
+    df.caiman.add_items(
+        algo="cnmf",
+        item_name="test-grid",
+        input_movie_path=input_movie_path,
+        params=test_params["cnmf"],
+        grid={"K": [4, 5], "gSig": [(2, 2), (3, 3), (4, 4)]},
+    )
+
+    assert df.index.size == 8
+    assert df["item_name"].tolist() == ["test0", "test1"] + ["test-grid"] * 6
+    assert df.iloc[0]["params"] == test_params["mcorr"]
+    assert [(p["main"]["K"], p["main"]["gSig"]) for p in df["params"].iloc[2:]] == [
+        (4, (2, 2)), (4, (3, 3)), (4, (4, 4)), (5, (2, 2)), (5, (3, 3)), (5, (4, 4))
+    ]
+    assert Path(df.iloc[-1]["input_movie_path"]) == input_movie_path.relative_to(vid_dir)
+    assert df.paths.resolve_column("input_movie_path").tolist() == [input_movie_path] * 8
+    assert df.paths.resolve_column(pd.Series(["does-not-exist.tif", None])).tolist() == [None, None]
+
+    # written once to disk
+    disk_df = load_batch(batch_path)
+    assert disk_df["uuid"].tolist() == df["uuid"].tolist()
+    assert disk_df["params"].tolist() == df["params"].tolist()
+
+    # uuid lookups stay correct after rows are removed and in sub-DataFrames
+    u = df.iloc[3]["uuid"]
+    assert df.caiman.uloc(u)["item_name"] == "test-grid"
+    df.caiman.remove_item(0, safe_removal=False)
+    assert df.caiman.uloc(u).name == 2
+    assert df.iloc[2:].caiman.uloc(u).name == 2
+    with pytest.raises(KeyError):
+        df.iloc[3:].caiman.uloc(u)
+
+
+def test_dependency_graph():
+    set_parent_raw_data_path(vid_dir)
+    df, batch_path = _create_tmp_batch()
+    input_movie_path = get_datafile("mcorr")
+
+    for i in range(2):
+        df.caiman.add_item(
+            algo="mcorr",
+            item_name=f"test-mcorr{i}",
+            input_movie_path=input_movie_path,
+            params=test_params["mcorr"],
+        )
+    df.iloc[0].caiman.run()
+    df = load_batch(batch_path)
+
+    df.caiman.add_items(
+        algo="cnmf",
+        item_name="test-cnmf",
+        input_movie_path=df.iloc[0],
+        params=test_params["cnmf"],
+        grid={"K": [4, 5]},
+    )
+
+    mcorr_uuid = df.iloc[0]["uuid"]
+    cnmf_uuids = df["uuid"].iloc[2:].tolist()
+
+    assert df.caiman.get_children(0) == cnmf_uuids
+    assert df.caiman.get_children(1) == list()
+    assert df.caiman.get_parent(2) == mcorr_uuid
+    assert df.caiman.get_parent(1) is None
+
+    graph = df.caiman.get_dependency_graph()
+    assert graph.descendants(mcorr_uuid) == cnmf_uuids
+    assert graph.topological_order(reversed(df["uuid"].tolist()))[:2] == [mcorr_uuid, cnmf_uuids[-1]]
+
+    # rebuilt after items are removed
+    with pytest.raises(DependencyError):
+        df.caiman.remove_item(0)
+    df.caiman.remove_item(2)
+    assert df.caiman.get_dependency_graph() is not graph
+    assert df.caiman.get_children(0) == cnmf_uuids[1:]
+
+
+def test_disk_usage():
+    set_parent_raw_data_path(vid_dir)
+    df, batch_path = _create_tmp_batch()
+    batch_dir = Path(batch_path).parent
+    input_movie_path = get_datafile("mcorr")
+
+    for i in range(2):
+        df.caiman.add_item(
+            algo="mcorr",
+            item_name=f"test{i}",
+            input_movie_path=input_movie_path,
+            params=test_params["mcorr"],
+        )
+        df.iloc[-1].caiman.run()
+    df = load_batch(batch_path)
+    removed_uuid, kept_uuid = df["uuid"].tolist()
+
+    usage = df.caiman.get_disk_usage()
+    item_usage = usage.loc[usage["path"] == kept_uuid].iloc[0]
+    assert item_usage["memmap"] > 0
+    assert item_usage["projections"] > 0
+    assert item_usage["total"] == item_usage[["memmap", "hdf5", "projections", "shifts", "cache", "other"]].sum()
+
+    # output dir is left behind
+    df.caiman.remove_item(0, remove_data=False)
+    usage = df.caiman.get_disk_usage()
+    assert usage.loc[usage["path"] == removed_uuid, "orphaned"].item()
+    assert not usage.loc[usage["path"] == kept_uuid, "orphaned"].item()
+
+    # still used by another batch in the same dir, whatever its file extension
+    other_batch_path = batch_dir.joinpath("other.pkl")
+    pd.DataFrame({"uuid": [removed_uuid]}).to_pickle(other_batch_path)
+    usage = df.caiman.get_disk_usage()
+    assert removed_uuid not in usage["path"].tolist()
+    other_batch_path.unlink()
+
+    # recently modified files are not removed by default
+    assert df.caiman.collect_garbage().index.size == 0
+
+    removed = df.caiman.collect_garbage(dry_run=True, min_age=0)
+    assert removed_uuid in removed["path"].tolist()
+    assert batch_dir.joinpath(removed_uuid).is_dir()
+
+    removed = df.caiman.collect_garbage(min_age=0, background=True).result()
+    assert removed_uuid in removed["path"].tolist()
+    assert not batch_dir.joinpath(removed_uuid).exists()
+    assert batch_dir.joinpath(kept_uuid).is_dir()
+    assert Path(batch_path).is_file()
+
+    df.iloc[0].mcorr.get_output()
+
+
+def test_run_many():
+    set_parent_raw_data_path(vid_dir)
+    df, batch_path = _create_tmp_batch()
+    input_movie_path = get_datafile("mcorr")
+
+    for i in range(3):
+        df.caiman.add_item(
+            algo="mcorr",
+            item_name=f"test{i}",
+            input_movie_path=input_movie_path,
+            params=test_params["mcorr"],
+        )
+
+    runner = df.caiman.run_many([0, 2], n_processes=2, max_cores=4)
+    assert set(runner.futures.keys()) == {df.iloc[0]["uuid"], df.iloc[2]["uuid"]}
+    assert runner.wait()
+    assert runner.n_done == 2
+    assert len(runner.errors) == 0
+    for future in runner.futures.values():
+        assert future.result()["success"] is True
+
+    # only the item that was not run
+    df = load_batch(batch_path)
+    runner = df.caiman.run_all(n_processes=2)
+    assert list(runner.futures.keys()) == [df.iloc[1]["uuid"]]
+    runner.wait()
+
+    df = load_batch(batch_path)
+    for i in range(3):
+        assert df.iloc[i]["outputs"]["success"] is True
+        df.iloc[i].mcorr.get_output()
+
+    # items that have not started when the runner is cancelled are cancelled
+    for i in range(3, 5):
+        df.caiman.add_item(
+            algo="mcorr",
+            item_name=f"test{i}",
+            input_movie_path=input_movie_path,
+            params=test_params["mcorr"],
+        )
+    runner = df.caiman.run_many([3, 4], n_processes=2, max_cores=2)
+    runner.cancel()
+    assert runner.wait()
+    assert runner.n_done == 2
+    assert runner.futures[df.iloc[4]["uuid"]].cancelled()
+
+
+def test_run_future():
+    set_parent_raw_data_path(vid_dir)
+    df, batch_path = _create_tmp_batch()
+    input_movie_path = get_datafile("mcorr")
+
+    for i in range(3):
+        df.caiman.add_item(
+            algo="mcorr",
+            item_name=f"test{i}",
+            input_movie_path=input_movie_path,
+            params=test_params["mcorr"],
+        )
+
+    future = df.iloc[0].caiman.run(wait=False)
+    done = list()
+    future.add_done_callback(lambda f: done.append(f.uuid))
+    outputs = future.result()
+    assert outputs["success"] is True
+    assert future.done()
+    assert future.wait() == 0
+    assert done == [df.iloc[0]["uuid"]]
+
+    # items of the "local" backend run one at a time, an item that has not started can be cancelled
+    release = threading.Event()
+    blocker = _LOCAL_EXECUTOR.submit(release.wait)
+    try:
+        future = df.iloc[1].caiman.run(backend="local", wait=False)
+        assert future.cancel()
+        assert future.cancelled()
+        assert future.returncode is None
+        with pytest.raises(CancelledError):
+            future.result()
+    finally:
+        release.set()
+        blocker.result()
+
+    # asyncio
+    async def run():
+        return await df.iloc[2].caiman.run_async()
+
+    assert asyncio.run(run())["success"] is True
+
+    df = load_batch(batch_path)
+    assert df.iloc[2]["outputs"]["success"] is True
+    df.iloc[2].mcorr.get_output()
+
+
+def test_run_many_dependencies():
+    set_parent_raw_data_path(vid_dir)
+    df, batch_path = _create_tmp_batch()
+    input_movie_path = get_datafile("mcorr")
+
+    df.caiman.add_item(
+        algo="mcorr",
+        item_name="test",
+        input_movie_path=input_movie_path,
+        params=test_params["mcorr"],
+    )
+    df.iloc[0].caiman.run()
+    df = load_batch(batch_path)
+
+    # children can only be added once the parent has an output
+    for i in range(2):
+        df.caiman.add_item(
+            algo="cnmf",
+            item_name="test",
+            input_movie_path=df.iloc[0],
+            params=test_params["cnmf"],
+        )
+
+    # the parent is run again together with its children, children start after the parent finished
+    runner = df.caiman.run_many([2, 0, 1], n_processes=2, max_cores=4)
+    assert runner.wait()
+    assert len(runner.errors) == 0
+
+    df = load_batch(batch_path)
+    for i in range(3):
+        assert df.iloc[i]["outputs"]["success"] is True
+    for i in [1, 2]:
+        assert df.caiman.get_parent(i) == df.iloc[0]["uuid"]
+        df.iloc[i].cnmf.get_output()
+
+
+def test_slurm_backend():
+    set_parent_raw_data_path(vid_dir)
+    df, batch_path = _create_tmp_batch()
+    input_movie_path = get_datafile("mcorr")
+
+    for i in range(4):
+        df.caiman.add_item(
+            algo="mcorr",
+            item_name=f"test{i}",
+            input_movie_path=input_movie_path,
+            params=test_params["mcorr"],
+        )
+
+    # run jobs as local subprocesses instead of submitting them to a cluster
+    set_slurm_commands(LocalSlurmCommands())
+    try:
+        job = df.iloc[0].caiman.run(backend="slurm", cpus_per_task=2, poll_interval=1)
+        assert job.returncode == 0
+        assert job.process.states == {df.iloc[0]["uuid"]: "COMPLETED"}
+        with open(batch_path.parent.joinpath(f"{df.iloc[0]['uuid']}.sbatch"), "r") as f:
+            assert "#SBATCH --cpus-per-task=2" in f.read()
+
+        # as an array job
+        job = df.caiman.run_array([1, 2], max_concurrent=1, cpus_per_task=2, poll_interval=1)
+        assert job.uuids == [df.iloc[1]["uuid"], df.iloc[2]["uuid"]]
+        assert job.wait() == 0
+
+        # a cancelled job gets unsuccessful outputs
+        job = df.iloc[3].caiman.run(backend="slurm", wait=False, cpus_per_task=2, poll_interval=1)
+        job.terminate()
+        assert job.cancelled()
+        assert job.process.wait() == 1
+        assert job.process.states[df.iloc[3]["uuid"]] == "CANCELLED"
+    finally:
+        set_slurm_commands(SlurmCommands())
+
+    df = load_batch(batch_path)
+    for i in range(3):
+        assert df.iloc[i]["outputs"]["success"] is True
+        df.iloc[i].mcorr.get_output()
+    assert df.iloc[3]["outputs"]["success"] is False
+    assert "CANCELLED" in df.iloc[3]["outputs"]["traceback"]
+
+    # a job that is reported by neither squeue nor sacct has finished, the outputs of the previous run are not
+    # taken as its outputs
+    class UnreportedSlurmCommands(SlurmCommands):
+        def get_states(self, job_ids):
+            return dict()
+
+    job = SlurmJob("1", batch_path, [df.iloc[0]["uuid"]], UnreportedSlurmCommands())
+    assert job.poll() == 1
+    assert job.states == {df.iloc[0]["uuid"]: "UNKNOWN"}
+    assert load_batch(batch_path).iloc[0]["outputs"]["success"] is False
+
+
+def test_worker_backend():
+    set_parent_raw_data_path(vid_dir)
+    df, batch_path = _create_tmp_batch()
+    input_movie_path = get_datafile("mcorr")
+
+    for i in range(3):
+        df.caiman.add_item(
+            algo="mcorr",
+            item_name=f"test{i}",
+            input_movie_path=input_movie_path,
+            params=test_params["mcorr"],
+        )
+
+    stop_worker()
+    client = start_worker(n_workers=1, n_processes=2)
+    try:
+        pid = client.info()["pid"]
+        if not IS_WINDOWS:
+            # the socket and the key are in a dir that only the user can access
+            assert os.stat(Path(client.address).parent).st_mode & 0o077 == 0
+
+        job = df.iloc[0].caiman.run(backend="worker")
+        assert job.returncode == 0
+        assert job.process.state == "done"
+
+        # the same service runs the next items
+        runner = df.caiman.run_many([1, 2], backend="worker", n_processes=2)
+        assert runner.wait()
+        assert len(runner.errors) == 0
+        assert get_worker().info()["pid"] == pid
+    finally:
+        stop_worker()
+
+    df = load_batch(batch_path)
+    for i in range(3):
+        assert df.iloc[i]["outputs"]["success"] is True
+        df.iloc[i].mcorr.get_output()
+
+
+def test_stage_timings():
+    set_parent_raw_data_path(vid_dir)
+    df, batch_path = _create_tmp_batch()
+    input_movie_path = get_datafile("mcorr")
+
+    df.caiman.add_item(
+        algo="mcorr",
+        item_name="test",
+        input_movie_path=input_movie_path,
+        params=test_params["mcorr"],
+    )
+    df.iloc[0].caiman.run()
+    df = load_batch(batch_path)
+
+    df.caiman.add_item(
+        algo="cnmf",
+        item_name="test",
+        input_movie_path=df.iloc[0],
+        params=test_params["cnmf"],
+    )
+    df.iloc[1].caiman.run()
+    df = load_batch(batch_path)
+
+    for r in df.itertuples():
+        stage_metrics = r.outputs["stage_metrics"]
+        assert "load_batch" in stage_metrics.keys()
+        for metrics in stage_metrics.values():
+            assert set(STAGE_METRICS_FIELDS) == set(metrics.keys())
+            assert metrics["wall_time"] >= 0
+
+    assert "motion_correction" in df.iloc[0]["outputs"]["stage_metrics"].keys()
+    assert "fit" in df.iloc[1]["outputs"]["stage_metrics"].keys()
+
+    timings = df.caiman.get_stage_timings()
+    assert set(timings["algo"]) == {"mcorr", "cnmf"}
+    assert timings["success"].all()
+
+    summary = df.caiman.get_stage_timings(summary=True)
+    numpy.testing.assert_allclose(
+        summary.groupby("algo")["wall_time_fraction"].sum().values, 1
+    )
+
+    # only the given items
+    timings = df.caiman.get_stage_timings(items=[df.iloc[1]["uuid"]])
+    assert set(timings["algo"]) == {"cnmf"}
+
+
+def test_sqlite_batch():
+    set_parent_raw_data_path(vid_dir)
+    fname = os.path.join(tmp_dir, f"{uuid4()}.db")
+    df = create_batch(fname)
+
+    for c in DATAFRAME_COLUMNS:
+        assert c in df.columns
+
+    # test that existing batch is not overwritten
+    with pytest.raises(FileExistsError):
+        create_batch(fname)
+
+    input_movie_path = get_datafile("mcorr")
+    movie = tifffile.imread(input_movie_path)
+    small_movie_path = input_movie_path.parent.joinpath("small_movie.tif")
+    tifffile.imwrite(small_movie_path, movie[:1001])
+
+    for i in range(3):
+        df.caiman.add_item(
+            algo="mcorr",
+            item_name=f"test{i}",
+            input_movie_path=small_movie_path,
+            params=test_params["mcorr"],
+        )
+
+    # only the row of the item that was run is updated
+    df.iloc[1].caiman.run()
+
+    df = load_batch(fname)
+    assert df.index.size == 3
+    assert df.iloc[1]["outputs"]["success"] is True
+    assert df.iloc[0]["outputs"] is None
+    assert df.iloc[2]["outputs"] is None
+    assert df.iloc[1]["params"] == test_params["mcorr"]
+    df.iloc[1].mcorr.get_output()
+
+    # only some columns, params and outputs are read when they are accessed
+    lazy_df = load_batch(fname, columns=["algo", "item_name", "outputs"], lazy=True)
+    assert lazy_df.columns.tolist() == ["algo", "item_name", "outputs", "uuid"]
+    assert lazy_df.iloc[1]["outputs"]["success"] is True
+    assert lazy_df.iloc[1]["outputs"] == df.iloc[1]["outputs"]
+    assert lazy_df.iloc[0]["outputs"] is None
+
+    df.caiman.remove_item(0, safe_removal=False)
+    df = load_batch(fname)
+    assert df["item_name"].tolist() == ["test1", "test2"]
+
+    # migrate an existing pickle batch
+    pickle_df, pickle_fname = _create_tmp_batch()
+    pickle_df.caiman.add_item(
+        algo="mcorr",
+        item_name="test-migrate",
+        input_movie_path=small_movie_path,
+        params=test_params["mcorr"],
+    )
+    migrated = migrate_batch(pickle_fname, Path(pickle_fname).with_suffix(".db"))
+    assert migrated.paths.get_batch_path() == Path(pickle_fname).with_suffix(".db")
+    assert migrated.equals(pickle_df)
+
+
+def test_save_to_disk_merge():
+    set_parent_raw_data_path(vid_dir)
+    df, batch_path = _create_tmp_batch()
+    input_movie_path = get_datafile("mcorr")
+
+    for i in range(3):
+        df.caiman.add_item(
+            algo="mcorr",
+            item_name=f"test{i}",
+            input_movie_path=input_movie_path,
+            params=test_params["mcorr"],
+        )
+
+    df_a = load_batch(batch_path)
+    df_b = load_batch(batch_path)
+    assert df_a.attrs["batch_version"] == df_b.attrs["batch_version"]
+
+    # df_a is up to date, saved as is
+    df_a.loc[0, "comments"] = "a"
+    df_a.caiman.save_to_disk()
+    assert load_batch(batch_path).attrs["batch_version"] == df_a.attrs["batch_version"]
+
+    # df_b is stale, its changes are merged with the changes made by df_a
+    df_b.loc[1, "comments"] = "b"
+    df_b.caiman.add_item(
+        algo="mcorr",
+        item_name="test-b",
+        input_movie_path=input_movie_path,
+        params=test_params["mcorr"],
+    )
+    with pytest.warns(UserWarning):
+        df_b.caiman.save_to_disk()
+
+    df = load_batch(batch_path)
+    assert df["comments"].tolist() == ["a", "b", None, None]
+    assert df["item_name"].tolist() == ["test0", "test1", "test2", "test-b"]
+
+    # an untracked stale DataFrame overwrites its rows but keeps the rows added on disk
+    df_c = load_batch(batch_path, track_changes=False)
+    assert df_c["comments"].tolist() == ["a", "b", None, None]
+    df.caiman.add_item(
+        algo="mcorr",
+        item_name="test-d",
+        input_movie_path=input_movie_path,
+        params=test_params["mcorr"],
+    )
+    df_c.loc[2, "comments"] = "c"
+    with pytest.warns(UserWarning):
+        df_c.caiman.save_to_disk()
+
+    df = load_batch(batch_path)
+    assert df["comments"].tolist() == ["a", "b", "c", None, None]
+    assert df["item_name"].tolist() == ["test0", "test1", "test2", "test-b", "test-d"]
+
+    # a sub-DataFrame does not remove the other rows
+    sub_df = df.iloc[:2]
+    with pytest.raises(IndexError):
+        sub_df.caiman.save_to_disk()
+
+
+def test_merge_item_results(monkeypatch):
+    set_parent_raw_data_path(vid_dir)
+    df, batch_path = _create_tmp_batch()
+    input_movie_path = get_datafile("mcorr")
+
+    for i in range(3):
+        df.caiman.add_item(
+            algo="mcorr",
+            item_name=f"test{i}",
+            input_movie_path=input_movie_path,
+            params=test_params["mcorr"],
+        )
+
+    u0, u1, u2 = df["uuid"]
+    batch_storage.write_item_results(batch_path, u0, comments="results")
+    # output dir of an item that was run, without a sidecar
+    Path(batch_path).parent.joinpath(u1).mkdir()
+
+    read = list()
+    read_item_results = batch_storage.read_item_results
+
+    def record(batch_path, uuid):
+        read.append(uuid)
+        return read_item_results(batch_path, uuid)
+
+    monkeypatch.setattr(batch_storage, "read_item_results", record)
+
+    # only the output dirs that exist are probed
+    df = load_batch(batch_path)
+    assert read == [u0, u1]
+    assert df["comments"].tolist() == ["results", None, None]
+
+
 def test_cache():
     print("*** Testing cache ***")
     cnmf.cnmf_cache.clear_cache()
@@ -1109,7 +1777,9 @@ def test_cache():
     # test that cache values are returned when calls are made to same function
 
     # testing that cache size limits work
-    cnmf.cnmf_cache.set_maxsize("1M")
+    # entries are measured with their deep size, the CNMF object alone is larger than 1M so the cache is filled
+    # with a larger limit first and then reduced, the number of entries evicted depends on the measured sizes
+    cnmf.cnmf_cache.set_maxsize("1G")
     cnmf_output = df.iloc[-1].cnmf.get_output()
     hex_get_output = hex(id(cnmf_output))
     cache = cnmf.cnmf_cache.get_cache()
@@ -1134,12 +1804,21 @@ def test_cache():
     df.iloc[-1].cnmf.get_masks(np.arange(5))
     df.iloc[-1].cnmf.get_masks(np.arange(4))
     df.iloc[-1].cnmf.get_masks(np.arange(3))
+    # get_cache() returns a snapshot of the cache
+    cache = cnmf.cnmf_cache.get_cache()
     time_stamp2 = cache[cache["function"] == "get_output"]["time_stamp"].item()
     hex2 = hex(id(cache[cache["function"] == "get_output"]["return_val"].item()))
     assert (cache[cache["function"] == "get_output"].index.size == 1)
-    # after adding enough items for cache to exceed max size, cache should remove least recently used items until
+    # the running byte total must match the sizes measured for each entry
+    assert (cnmf.cnmf_cache._get_cache_size_bytes() == cache["nbytes"].sum())
+    # after reducing the max size, cache should remove least recently used items until
     # size is back under max
-    assert (len(cnmf.cnmf_cache.get_cache().index) == 17)
+    cnmf.cnmf_cache.set_maxsize("1M")
+    cache_small = cnmf.cnmf_cache.get_cache()
+    assert (cache_small["nbytes"].sum() <= 1024**2)
+    assert (len(cache_small.index) < len(cache.index))
+    # the entries that remain are the most recently used ones
+    assert (cache_small["time_stamp"].tolist() == cache["time_stamp"].tolist()[-len(cache_small.index):])
     # the time stamp to get_output the second time should be greater than the original time
     # stamp because the cached item is being returned and therefore will have been accessed more recently
     assert (time_stamp2 > time_stamp1)
@@ -1216,7 +1895,8 @@ def test_cache():
 
     df = load_batch(batch_path)
 
-    cnmf.cnmf_cache.set_maxsize("1M")
+    # large enough for both CNMF objects
+    cnmf.cnmf_cache.set_maxsize("1G")
 
     df.iloc[1].cnmf.get_output() # cnmf output
     df.iloc[-1].cnmf.get_output() # cnmfe output
@@ -1234,6 +1914,7 @@ def test_cache():
 
     # call get output from cnmf, check that it is the most recent thing called in the cache
     df.iloc[1].cnmf.get_output()
+    cache = cnmf.cnmf_cache.get_cache()
     cnmf_uuid = df.iloc[1]["uuid"]
     most_recently_called = cache.sort_values(by=["time_stamp"], ascending=True).iloc[-1]
     cache_uuid = most_recently_called["uuid"]
@@ -1254,3 +1935,247 @@ def test_cache():
     output2 = df.iloc[1].cnmf.get_output(return_copy=False)
     assert(hex(id(output)) == hex(id(output2)))
     assert(hex(id(cnmf.cnmf_cache.get_cache().iloc[-1]["return_val"])) == hex(id(output)))
+
+
+def test_cache_disk():
+    df, batch_path = _create_cnmf_batch()
+    cnmf.cnmf_cache.clear_cache()
+    cnmf.cnmf_cache.reset_stats()
+    cnmf.cnmf_cache.set_maxsize("1G")
+    cnmf.cnmf_cache.set_disk_cache("1G")
+
+    try:
+        masks = df.iloc[-1].cnmf.get_masks("good")
+        contours, coms = df.iloc[-1].cnmf.get_contours("good")
+
+        cache_dir = Path(batch_path).parent.joinpath(df.iloc[-1]["uuid"], "cache")
+        assert len(list(cache_dir.glob("get_masks-*.npy"))) == 1
+        assert len(list(cache_dir.glob("get_contours-*.npz"))) == 1
+
+        # only the in-memory cache is cleared, the values are read from disk
+        cnmf.cnmf_cache.clear_cache()
+        numpy.testing.assert_array_equal(df.iloc[-1].cnmf.get_masks("good"), masks)
+        contours_disk, coms_disk = df.iloc[-1].cnmf.get_contours("good")
+        assert len(contours_disk) == len(contours)
+        for a, b in zip(contours + coms, contours_disk + coms_disk):
+            numpy.testing.assert_array_equal(a, b)
+
+        stats = cnmf.cnmf_cache.get_stats().set_index("function")
+        assert stats.loc["get_masks", "misses"] == 1
+        assert stats.loc["get_masks", "disk_hits"] == 1
+
+        # running the item again removes its disk cache
+        df.iloc[-1].caiman.run()
+        assert len(list(cache_dir.glob("*.np[yz]"))) == 0
+    finally:
+        cnmf.cnmf_cache.set_disk_cache(None)
+
+
+def test_cache_readonly():
+    df, batch_path = _create_cnmf_batch()
+    cnmf.cnmf_cache.clear_cache()
+    cnmf.cnmf_cache.set_maxsize("1G")
+
+    temporal = df.iloc[-1].cnmf.get_temporal("good", return_copy="readonly")
+    with pytest.raises(ValueError):
+        temporal[0, 0] = 0
+
+    # views of the cached array, no copy is made
+    cached = df.iloc[-1].cnmf.get_temporal("good", return_copy=False)
+    assert np.shares_memory(temporal, cached)
+    assert not np.shares_memory(df.iloc[-1].cnmf.get_temporal("good"), cached)
+
+    # sequences keep their type
+    contours, coms = df.iloc[-1].cnmf.get_contours("good", return_copy="readonly")
+    assert isinstance(contours, list)
+    with pytest.raises(ValueError):
+        contours[0][0, 0] = 0
+
+    # bool-like values work like bools
+    assert df.iloc[-1].cnmf.get_temporal("good", return_copy=np.bool_(False)) is cached
+
+    cnmf.cnmf_cache.set_copy_mode("readonly")
+    try:
+        assert not df.iloc[-1].cnmf.get_temporal("good").flags.writeable
+        assert df.iloc[-1].cnmf.get_temporal("good", return_copy="copy").flags.writeable
+    finally:
+        cnmf.cnmf_cache.set_copy_mode("copy")
+
+
+def test_cache_concurrent_misses():
+    cache = Cache("1G")
+    Extension = _make_cached_extension(cache)
+
+    barrier = threading.Barrier(2)
+    results = list()
+
+    def call():
+        barrier.wait()
+        results.append(Extension("a").compute(1, delay=0.5))
+
+    threads = [threading.Thread(target=call) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # computed once, the other thread waited for the result
+    assert Extension.n_computed == 1
+    stats = cache.get_stats().set_index("function")
+    assert stats.loc["compute", "misses"] == 1
+    assert stats.loc["compute", "coalesced"] == 1
+
+    # each thread gets its own copy
+    assert results[0] is not results[1]
+    numpy.testing.assert_array_equal(results[0], results[1])
+    assert len(cache.get_cache().index) == 1
+
+
+def test_cache_stats():
+    # max 2 entries
+    cache = Cache(2)
+    Extension = _make_cached_extension(cache)
+    ext = Extension("a")
+
+    ext.compute(1)
+    ext.compute(1)
+    ext.compute(2)
+    ext.compute(3)
+
+    stats = cache.get_stats().set_index("function")
+    assert stats.loc["compute", "hits"] == 1
+    assert stats.loc["compute", "misses"] == 3
+    assert stats.loc["compute", "hit_rate"] == 0.25
+    assert stats.loc["compute", "evictions"] == {"lru": 1}
+    assert stats.loc["compute", "n_entries"] == 2
+    assert stats.loc["compute", "nbytes"] == cache.get_cache()["nbytes"].sum()
+    assert sum(stats.loc["compute", "miss_time_histogram"].values()) == 3
+
+    item_stats = cache.get_item_stats()
+    assert item_stats["uuid"].tolist() == ["a"]
+    assert item_stats["n_entries"].tolist() == [2]
+
+    cache.clear_cache()
+    assert cache.get_stats().set_index("function").loc["compute", "evictions"] == {"lru": 1, "cleared": 2}
+
+    cache.reset_stats()
+    assert len(cache.get_stats().index) == 0
+
+    # the counters are reset, the entries that are still cached are reported
+    ext.compute(1)
+    ext.compute(2)
+    cache.reset_stats()
+    stats = cache.get_stats().set_index("function")
+    assert stats.loc["compute", "hits"] == 0
+    assert stats.loc["compute", "misses"] == 0
+    assert stats.loc["compute", "n_entries"] == 2
+    assert stats.loc["compute", "nbytes"] == cache.get_cache()["nbytes"].sum()
+
+
+def test_cache_policy():
+    cache = Cache("1G")
+    Extension = _make_cached_extension(cache)
+    a = Extension("a")
+    b = Extension("b")
+
+    # entries expire after the TTL
+    cache.set_function_policy("compute", ttl=0.2)
+    a.compute(1)
+    a.compute(1)
+    assert Extension.n_computed == 1
+    time.sleep(0.3)
+    a.compute(1)
+    assert Extension.n_computed == 2
+    assert cache.get_stats().set_index("function").loc["compute", "evictions"] == {"ttl": 1}
+
+    # pinned entries are never evicted by the limits or the TTL
+    cache.pin("a")
+    cache.set_function_policy("compute", max_items=1, ttl=0.2)
+    for i in range(3):
+        b.compute(i)
+    assert "a" in cache.get_cache()["uuid"].tolist()
+    assert cache.get_cache()["uuid"].tolist().count("b") <= 1
+
+    time.sleep(0.3)
+    n_computed = Extension.n_computed
+    a.compute(1)
+    assert Extension.n_computed == n_computed
+
+    policies = cache.get_policies().set_index("function")
+    assert policies.loc["compute", "max_items"] == 1
+
+    # unpinned entries are evicted as soon as they exceed the limits
+    cache.unpin("a")
+    cache.set_function_policy("compute", max_items=1)
+    b.compute(5)
+    assert cache.get_cache()["uuid"].tolist() == ["b"]
+
+    # removing the policy
+    cache.set_function_policy("compute")
+    assert len(cache.get_policies().index) == 0
+
+    with pytest.raises(KeyError):
+        cache.configure({"max_sze": "1G"})
+
+
+def test_warm_cache():
+    df, batch_path = _create_cnmf_batch()
+    cnmf.cnmf_cache.clear_cache()
+    cnmf.cnmf_cache.reset_stats()
+    cnmf.cnmf_cache.set_maxsize("1G")
+
+    warmer = df.caiman.warm_cache(
+        {"get_output": dict(), "get_contours": {"component_indices": "good"}},
+        progress=False
+    )
+    assert warmer.wait(timeout=600)
+    assert warmer.n_done == warmer.n_total == 2
+    assert len(warmer.errors) == 0
+    assert warmer.stop_reason is None
+
+    # only the cnmf item is warmed
+    cache = cnmf.cnmf_cache.get_cache()
+    assert {"get_output", "get_contours"}.issubset(set(cache["function"]))
+    assert set(cache["uuid"]) == {df.iloc[-1]["uuid"]}
+
+    # later calls are hits
+    df.iloc[-1].cnmf.get_contours("good")
+    assert cnmf.cnmf_cache.get_stats().set_index("function").loc["get_contours", "hits"] == 1
+
+    # nothing is warmed once the budget is reached
+    cnmf.cnmf_cache.clear_cache()
+    warmer = df.caiman.warm_cache(["get_output"], budget=0, progress=False)
+    assert warmer.wait(timeout=600)
+    assert warmer.n_done == 0
+    assert warmer.stop_reason == "budget reached"
+    assert len(cnmf.cnmf_cache.get_cache().index) == 0
+
+    with pytest.raises(AttributeError):
+        df.caiman.warm_cache(["_get_output_shared"])
+
+
+def test_cache_array_keys():
+    cache = Cache("1G")
+    Extension = _make_cached_extension(cache)
+    ext = Extension("a")
+
+    a = np.arange(10)
+    ext.compute(a)
+    # an equal array that is a different object uses the same entry
+    numpy.testing.assert_array_equal(ext.compute(np.arange(10)), a * 2)
+    ext.compute(x=a.copy())
+    assert Extension.n_computed == 1
+
+    # different contents, shape or dtype are different keys
+    ext.compute(np.arange(1, 11))
+    ext.compute(np.arange(10).reshape(2, 5))
+    ext.compute(np.arange(10, dtype=np.float32))
+    assert Extension.n_computed == 4
+
+    # the cache does not keep the array arguments alive
+    assert not any(isinstance(arg, np.ndarray) for arg in cache.get_cache()["args"].sum())
+
+    # arrays of objects are not cached
+    ext.compute(np.array([1, "a"], dtype=object))
+    ext.compute(np.array([1, "a"], dtype=object))
+    assert Extension.n_computed == 6